@@ -1,6 +1,7 @@
 import os
 from config import NOVEL_PATH, DATA_DIR
 from core.rag_engine import RAGEngine
+from models.registry import registry
 
 def main():
     if not os.path.exists(NOVEL_PATH):
@@ -8,10 +9,9 @@ def main():
         print(f"❌ 小说文件未找到！请将小说保存为：{NOVEL_PATH}")
         return
 
-    with open(NOVEL_PATH, "r", encoding="utf-8") as f:
-        novel_text = f.read()
-
-    engine = RAGEngine(novel_text)
+    engine = RAGEngine(novel_path=NOVEL_PATH)
+    registry.load_all()  # 嵌入/重排模型默认在首次提问时加载，这里提前加载以免第一问卡顿
+    print(f"模型加载情况：\n{registry.format_memory_report()}")
 
     print("\n✅ 小说问答系统已启动！输入 'quit' 或 'exit' 退出。\n")
     while True:
@@ -22,8 +22,11 @@ def main():
             print("👋 再见！")
             break
         try:
-            answer, context = engine.answer(question)
-            print(f"💡 回答：{answer}\n")
+            context, pieces = engine.answer_stream(question)
+            print("💡 回答：", end="", flush=True)
+            for piece in pieces:
+                print(piece, end="", flush=True)
+            print("\n")
         except Exception as e:
             print(f"⚠️ 出错：{e}\n")
 
@@ -1,53 +1,221 @@
 import os
-from flask import Flask, render_template, request, jsonify
-from config import NOVEL_PATH, DATA_DIR
-from core.rag_engine import RAGEngine
+import json
+import time
+import threading
+from flask import Flask, Response, render_template, request, jsonify, stream_with_context
+from config import NOVEL_PATH, COLLECTIONS_DIR, BATCH_WINDOW_MS, MAX_BATCH_SIZE, GENERATION_PROFILES
+from core.collection_manager import CollectionManager
+from core.scheduler import MicroBatchScheduler
+from core import tracing
+from models.registry import current_rss, registry
 
 # 初始化 Flask 应用
 app = Flask(__name__)
 
-# 全局 RAG 引擎（只加载一次）
-rag_engine = None
+# 全局 collection 管理器（各小说按需加载、共享模型）与请求调度器
+collection_manager = None
+scheduler = None
+# 后台预热状态：starting -> ready / failed
+warmup = {"state": "starting", "error": None, "seconds": None}
 
 def init_rag_engine():
-    global rag_engine
-    if not os.path.exists(NOVEL_PATH):
-        os.makedirs(DATA_DIR, exist_ok=True)
-        raise FileNotFoundError(f"小说文件未找到！请将小说保存为：{NOVEL_PATH}")
-    
-    with open(NOVEL_PATH, "r", encoding="utf-8") as f:
-        novel_text = f.read()
-    
-    rag_engine = RAGEngine(novel_text)
+    """创建 collection 管理器与调度器（很快）；模型与索引由 start_warm_up() 在后台加载"""
+    global collection_manager, scheduler
+    manager = CollectionManager()
+    if not manager.available():
+        os.makedirs(COLLECTIONS_DIR, exist_ok=True)
+        raise FileNotFoundError(
+            f"小说文件未找到！请将小说保存为：{NOVEL_PATH}，或放到 {COLLECTIONS_DIR}/<名称>/novel.txt"
+        )
+    collection_manager = manager
+    # 并发的 /ask 请求在短时间窗口内合并为一批处理（不同小说的请求在批内分组）
+    scheduler = MicroBatchScheduler(window_ms=BATCH_WINDOW_MS, max_batch_size=MAX_BATCH_SIZE)
+
+def warm_up():
+    """加载 LLM 与嵌入/重排模型（彼此并行），再加载默认小说的索引；其余小说在首次被请求时加载"""
+    start = time.perf_counter()
+    try:
+        collection_manager.warm_up()
+    except Exception as e:
+        warmup.update(state="failed", error=str(e))
+        print(f"❌ 模型加载失败：{e}")
+        return
+    warmup.update(state="ready", seconds=round(time.perf_counter() - start, 2))
+    print(f"✅ RAG 引擎已加载，用时 {warmup['seconds']}s")
+    # 嵌入/重排模型是惰性加载的，预热完成后才能统计到它们的内存
+    print(f"模型加载情况：\n{registry.format_memory_report()}")
+
+def start_warm_up() -> threading.Thread:
+    thread = threading.Thread(target=warm_up, name="rag-warmup", daemon=True)
+    thread.start()
+    return thread
+
+def get_engine(collection_id):
+    """返回 (引擎, 错误响应)"""
+    if collection_manager is None:
+        return None, (jsonify({"error": "RAG引擎未初始化，请检查小说文件。"}), 500)
+    if warmup["state"] != "ready":
+        message = "模型加载中，请稍后重试。" if warmup["state"] == "starting" else f"模型加载失败：{warmup['error']}"
+        response = jsonify({"error": message})
+        response.headers["Retry-After"] = "5"
+        return None, (response, 503)
+    try:
+        return collection_manager.get(collection_id), None
+    except KeyError:
+        return None, (jsonify({"error": f"未找到小说：{collection_id or collection_manager.default_id}"}), 404)
+    except Exception as e:
+        return None, (jsonify({"error": f"加载小说时出错：{str(e)}"}), 500)
 
 @app.route("/")
 def index():
     return render_template("index.html")
 
+@app.route("/healthz")
+def healthz():
+    """存活探针：进程在运行即返回 200，模型是否加载完成见 /readyz"""
+    return jsonify({"status": "ok", "warmup": warmup["state"]})
+
+@app.route("/readyz")
+def readyz():
+    """
+    就绪探针：LLM、嵌入/重排模型均已加载且默认小说的索引已打开时返回 200，否则 503。
+    同时返回进程常驻内存与各模型加载时增加的常驻内存（rss_bytes，无法获取时为 null）
+    """
+    models = [
+        {"kind": r["kind"], "model": r["model"], "loaded": r["loaded"], "rss_bytes": r["rss_bytes"]}
+        for r in registry.memory_report()
+    ]
+    body = {
+        "status": warmup["state"],
+        "error": warmup["error"],
+        "warmup_seconds": warmup["seconds"],
+        "rss_bytes": current_rss(),
+        "models": models,
+        "collections": collection_manager.loaded() if collection_manager is not None else [],
+    }
+    ready = warmup["state"] == "ready" and all(m["loaded"] for m in models)
+    return jsonify(body), 200 if ready else 503
+
 @app.route("/ask", methods=["POST"])
 def ask():
-    if rag_engine is None:
+    if collection_manager is None:
         return jsonify({"error": "RAG引擎未初始化，请检查小说文件。"}), 500
 
     data = request.get_json()
     question = data.get("question", "").strip()
+    collection_id = data.get("collection") or request.args.get("collection")
+    # 生成配置：free（默认，自由问答）、choice（选择题，只生成几个 token）等
+    profile = data.get("profile") or request.args.get("profile")
+    # 请求体或查询参数中带 timing 时，在响应中附带各阶段耗时（毫秒）
+    want_timing = bool(data.get("timing") or request.args.get("timing"))
 
     if not question:
         return jsonify({"error": "问题不能为空。"}), 400
+    if profile and profile not in GENERATION_PROFILES:
+        return jsonify({"error": f"未知的生成配置：{profile}"}), 400
 
     if question.lower() in {"quit", "exit"}:
         return jsonify({"answer": "👋 再见！", "context": ""})
 
+    engine, error = get_engine(collection_id)
+    if error:
+        return error
+
     try:
-        answer, context = rag_engine.answer(question)
-        return jsonify({"answer": answer, "context": context})
+        start = time.perf_counter()
+        future = scheduler.submit(question, engine, profile)
+        answer, context = future.result()
+        response = {"answer": answer, "context": context}
+        if want_timing:
+            timing = getattr(future, "timing", {})
+            response["timing"] = {
+                k: (v if k == "batch_size" else round(v * 1000, 2)) for k, v in timing.items()
+            }
+            response["timing"]["total"] = round((time.perf_counter() - start) * 1000, 2)
+        return jsonify(response)
     except Exception as e:
         return jsonify({"error": f"处理问题时出错：{str(e)}"}), 500
 
+@app.route("/stats")
+def stats():
+    """请求调度统计：队列深度、批大小分布等"""
+    if scheduler is None:
+        return jsonify({"error": "RAG引擎未初始化，请检查小说文件。"}), 500
+    return jsonify(scheduler.stats())
+
+@app.route("/collections")
+def list_collections():
+    """可用与已加载的小说、内存占用与预算"""
+    if collection_manager is None:
+        return jsonify({"error": "RAG引擎未初始化，请检查小说文件。"}), 500
+    return jsonify({**collection_manager.stats(), "default": collection_manager.default_id})
+
+@app.route("/metrics")
+def metrics():
+    """Prometheus 文本格式的埋点数据"""
+    if scheduler is not None:
+        stats = scheduler.stats()
+        tracing.set_gauge("rag_queue_depth", stats["queue_depth"])
+        tracing.set_gauge("rag_max_queue_depth", stats["max_queue_depth"])
+        tracing.set_gauge("rag_mean_batch_size", stats["mean_batch_size"])
+    if collection_manager is not None:
+        stats = collection_manager.stats()
+        tracing.set_gauge("rag_loaded_collections", len(stats["loaded"]))
+        tracing.set_gauge("rag_collection_memory_bytes", stats["memory_mb"] * 2 ** 20)
+    return Response(tracing.render_prometheus(), mimetype="text/plain; version=0.0.4")
+
+def sse(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@app.route("/ask/stream", methods=["GET", "POST"])
+def ask_stream():
+    """Server-Sent Events：先发送检索到的上下文，再逐段发送回答，最后发送 done"""
+    if collection_manager is None:
+        return jsonify({"error": "RAG引擎未初始化，请检查小说文件。"}), 500
+
+    params = (request.get_json(silent=True) or {}) if request.method == "POST" else request.args
+    question = params.get("question", "").strip()
+    collection_id = params.get("collection") or request.args.get("collection")
+    profile = params.get("profile") or request.args.get("profile")
+
+    if not question:
+        return jsonify({"error": "问题不能为空。"}), 400
+    if profile and profile not in GENERATION_PROFILES:
+        return jsonify({"error": f"未知的生成配置：{profile}"}), 400
+
+    engine, error = get_engine(collection_id)
+    if error:
+        return error
+
+    def events():
+        if question.lower() in {"quit", "exit"}:
+            yield sse("context", [])
+            yield sse("token", "👋 再见！")
+            yield sse("done", {})
+            return
+        try:
+            context, pieces = engine.answer_stream(question, profile)
+            yield sse("context", context)
+            for piece in pieces:
+                yield sse("token", piece)
+            yield sse("done", {})
+        except Exception as e:
+            yield sse("error", f"处理问题时出错：{str(e)}")
+
+    return Response(
+        stream_with_context(events()),
+        mimetype="text/event-stream",
+        # 禁止代理缓冲，保证逐段到达浏览器
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 if __name__ == "__main__":
     try:
         init_rag_engine()
-        print("✅ RAG 引擎已加载，启动 Flask 应用...")
-        app.run(host="127.0.0.1", port=5000, debug=True)
+        # 端口立即打开，模型在后台加载；/readyz 返回 200 后再接入流量
+        start_warm_up()
+        print("🚀 启动 Flask 应用，模型在后台加载（/healthz 存活探针，/readyz 就绪探针）...")
+        # 关闭自动重载：重载器的父子进程会各加载一遍模型
+        app.run(host="127.0.0.1", port=5000, debug=True, use_reloader=False)
     except Exception as e:
         print(f"❌ 启动失败：{e}")
\ No newline at end of file
@@ -0,0 +1,108 @@
+"""
+FAISS 索引类型对比：以 flat_ip 精确检索为基准，报告各索引的 recall@k、QPS、构建耗时和索引大小。
+
+用法（在项目根目录）：
+    python -m benchmarks.ann_benchmark                    # 合成向量，离线即可运行
+    python -m benchmarks.ann_benchmark --novel            # 用真实嵌入模型编码小说 chunk（较慢）
+    python -m benchmarks.ann_benchmark --n 200000 --nprobe 8 16 32 --ef-search 64 128
+"""
+import time
+import argparse
+import faiss
+import numpy as np
+
+from config import NOVEL_PATH, CHUNK_SIZE, CHUNK_OVERLAP, EMBEDDING_MODEL_NAME
+from retriever.faiss_index import build_config, create_index, apply_search_params
+
+
+def synthetic_vectors(n, dim, n_queries, seed=0):
+    """带聚类结构的随机向量，比均匀噪声更接近真实嵌入分布"""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((max(1, n // 100), dim)).astype(np.float32)
+    base = centers[rng.integers(len(centers), size=n)]
+    base += 0.5 * rng.standard_normal((n, dim)).astype(np.float32)
+    queries = base[rng.integers(n, size=n_queries)]
+    queries = queries + 0.3 * rng.standard_normal(queries.shape).astype(np.float32)
+    return base, queries
+
+
+def novel_vectors(n_queries, seed=0):
+    from models.embedding import EmbeddingModel
+    from retriever.chunking import split_text
+
+    with open(NOVEL_PATH, "r", encoding="utf-8") as f:
+        chunks = split_text(f.read(), CHUNK_SIZE, CHUNK_OVERLAP)
+    embedder = EmbeddingModel(EMBEDDING_MODEL_NAME)
+    base = embedder.encode(chunks, convert_to_numpy=True, show_progress_bar=True).astype(np.float32)
+    rng = np.random.default_rng(seed)
+    # 用 chunk 中的片段作查询，模拟“问题与原文部分重合”的场景
+    picks = rng.integers(len(chunks), size=n_queries)
+    queries = embedder.encode([chunks[i][:60] for i in picks], convert_to_numpy=True).astype(np.float32)
+    return base, queries
+
+
+def recall_at_k(found, truth):
+    k = truth.shape[1]
+    hits = sum(len(set(f[f >= 0]) & set(t)) for f, t in zip(found, truth))
+    return hits / (len(truth) * k)
+
+
+def measure(index, meta, queries, truth, k, search_params):
+    apply_search_params(index, meta, search_params)
+    q = np.ascontiguousarray(queries, dtype=np.float32)
+    faiss.normalize_L2(q)
+    start = time.perf_counter()
+    found = np.vstack([index.search(q[i:i + 1], k)[1] for i in range(len(q))])
+    elapsed = time.perf_counter() - start
+    return recall_at_k(found, truth), len(q) / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="FAISS ANN 索引 recall/QPS 对比")
+    parser.add_argument("--novel", action="store_true", help="使用真实模型编码 NOVEL_PATH")
+    parser.add_argument("--n", type=int, default=20000, help="合成向量数")
+    parser.add_argument("--dim", type=int, default=512, help="合成向量维度")
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--k", type=int, default=25, help="recall@k 中的 k（默认 TOP_K * 5）")
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[8, 32, 128])
+    parser.add_argument("--ef-search", type=int, nargs="+", default=[32, 128, 512])
+    args = parser.parse_args()
+
+    if args.novel:
+        base, queries = novel_vectors(args.queries)
+    else:
+        base, queries = synthetic_vectors(args.n, args.dim, args.queries)
+    print(f"向量数: {len(base)}，维度: {base.shape[1]}，查询数: {len(queries)}，k={args.k}\n")
+
+    rows = []
+    truth = None
+    for index_type in ("flat_ip", "hnsw", "ivfpq"):
+        start = time.perf_counter()
+        index, meta = create_index(base, build_config(index_type))
+        build_time = time.perf_counter() - start
+        size_mb = faiss.serialize_index(index).nbytes / 2 ** 20
+
+        if index_type == "flat_ip":
+            q = np.ascontiguousarray(queries, dtype=np.float32)
+            faiss.normalize_L2(q)
+            truth = index.search(q, args.k)[1]
+            sweep = [None]
+        elif index_type == "hnsw":
+            sweep = [{"ef_search": ef, "nprobe": 0} for ef in args.ef_search]
+        else:
+            sweep = [{"ef_search": 0, "nprobe": p} for p in args.nprobe]
+
+        for params in sweep:
+            recall, qps = measure(index, meta, queries, truth, args.k, params)
+            label = index_type
+            if params:
+                label += f" (efSearch={params['ef_search']})" if index_type == "hnsw" else f" (nprobe={params['nprobe']})"
+            rows.append((label, recall, qps, build_time, size_mb))
+
+    print(f"{'索引':<28}{'recall@k':>10}{'QPS':>10}{'构建(s)':>10}{'大小(MB)':>10}")
+    for label, recall, qps, build_time, size_mb in rows:
+        print(f"{label:<28}{recall:>10.4f}{qps:>10.0f}{build_time:>10.2f}{size_mb:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
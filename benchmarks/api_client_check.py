@@ -0,0 +1,159 @@
+"""
+APILLM 客户端行为校验：在本地启动一个 OpenAI 兼容的桩服务，不需要网络和 API Key。
+
+用法（在项目根目录）：
+    python -m benchmarks.api_client_check
+
+检查内容：
+- 连接复用：多次请求只建立一条 TCP 连接
+- 429 / 5xx 重试后成功，4xx 不重试并返回结构化错误
+- 读取超时后重试
+- token 用量解析与累计（含流式响应的 usage 事件）
+- agenerate 的并发上限
+"""
+import json
+import time
+import asyncio
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import models.llm_api as llm_api
+from models.llm_api import APILLM, APILLMError
+
+
+class StubState:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.ports = set()
+        self.requests = 0
+        self.failures = {}  # 提示词 -> 剩余需返回的错误状态列表
+        self.active = 0
+        self.max_active = 0
+
+
+STATE = StubState()
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # 支持 keep-alive
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status, body, content_type="application/json"):
+        data = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        prompt = payload["messages"][-1]["content"]
+        with STATE.lock:
+            STATE.ports.add(self.client_address[1])
+            STATE.requests += 1
+            STATE.active += 1
+            STATE.max_active = max(STATE.max_active, STATE.active)
+            pending = STATE.failures.get(prompt)
+            failure = pending.pop(0) if pending else None
+        try:
+            status, body, content_type = self._respond(prompt, payload, failure)
+        finally:
+            # 先减计数再发送：客户端收到响应后会立即发出下一个请求，发送后再减会把它算成同时在处理
+            with STATE.lock:
+                STATE.active -= 1
+        self._send(status, body, content_type)
+
+    @staticmethod
+    def _respond(prompt, payload, failure):
+        if failure == "slow":
+            time.sleep(0.5)
+        elif failure is not None:
+            return failure, json.dumps({"error": {"message": f"stub {failure}"}}), "application/json"
+        if prompt.startswith("sleep"):
+            time.sleep(0.05)
+
+        answer = f"回答：{prompt}"
+        usage = {"prompt_tokens": len(prompt), "completion_tokens": len(answer), "total_tokens": len(prompt) + len(answer)}
+        if payload.get("stream"):
+            events = [{"choices": [{"delta": {"content": ch}}]} for ch in answer]
+            events.append({"choices": [], "usage": usage})
+            body = "".join(f"data: {json.dumps(e, ensure_ascii=False)}\n\n" for e in events) + "data: [DONE]\n\n"
+            return 200, body, "text/event-stream"
+        return 200, json.dumps({
+            "choices": [{"message": {"role": "assistant", "content": answer}}], "usage": usage
+        }, ensure_ascii=False), "application/json"
+
+
+class StubServer(ThreadingHTTPServer):
+    def handle_error(self, request, client_address):
+        pass  # 超时用例中客户端会提前断开连接
+
+
+def check(name, condition):
+    print(f"{'✅' if condition else '❌'} {name}")
+    return condition
+
+
+def main():
+    server = StubServer(("127.0.0.1", 0), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    llm_api.API_BACKOFF_BASE = 0.01  # 缩短退避，加快校验
+    llm = APILLM("test-key", base_url, "stub-model", timeout=(1, 0.2), max_retries=2, max_concurrency=4)
+
+    passed = True
+    for i in range(5):
+        llm.generate(f"问题{i}")
+    passed &= check("5 次请求复用同一条连接", len(STATE.ports) == 1)
+
+    STATE.failures["限流"] = [429, 503]
+    passed &= check("429 / 503 重试后成功", llm.generate("限流") == "回答：限流")
+
+    STATE.failures["超时"] = ["slow"]
+    passed &= check("读取超时后重试成功", llm.generate("超时") == "回答：超时")
+
+    STATE.failures["参数错误"] = [400]
+    result = llm.complete("参数错误")
+    passed &= check("400 不重试，返回结构化错误", not result.ok and result.error.status == 400 and not STATE.failures["参数错误"])
+
+    STATE.failures["一直失败"] = [500] * 10
+    try:
+        llm.generate("一直失败")
+        passed &= check("重试耗尽后抛出 APILLMError", False)
+    except APILLMError as e:
+        passed &= check("重试耗尽后抛出 APILLMError", e.status == 500 and len(STATE.failures["一直失败"]) == 7)
+
+    result = llm.complete("用量")
+    passed &= check("解析 token 用量", result.usage == {"prompt_tokens": 2, "completion_tokens": 5, "total_tokens": 7})
+
+    before = llm.usage()["total_tokens"]
+    streamed = "".join(llm.generate_stream("流式"))
+    passed &= check("流式输出与 usage 事件", streamed == "回答：流式" and llm.usage()["total_tokens"] == before + 7)
+
+    STATE.max_active = 0
+    start = time.perf_counter()
+    results = asyncio.run(llm.agenerate_batch([f"sleep{i}" for i in range(16)]))
+    elapsed = time.perf_counter() - start
+    passed &= check(
+        f"agenerate 并发上限 4（实际最大并发 {STATE.max_active}，16 个请求耗时 {elapsed:.2f}s）",
+        STATE.max_active <= 4 and all(r.ok for r in results)
+    )
+    passed &= check("agenerate 结果顺序与输入一致", [r.text for r in results] == [f"回答：sleep{i}" for i in range(16)])
+
+    STATE.failures["批内失败"] = [400]
+    results = llm.generate_batch(["批内1", "批内失败", "批内2"], return_exceptions=True)
+    passed &= check(
+        "generate_batch 单条失败不影响同批其他请求",
+        results[0] == "回答：批内1" and isinstance(results[1], APILLMError) and results[2] == "回答：批内2"
+    )
+
+    print(f"\n累计用量: {llm.usage()}，桩服务收到 {STATE.requests} 个请求，{len(STATE.ports)} 条连接")
+    server.shutdown()
+    raise SystemExit(0 if passed else 1)
+
+
+if __name__ == "__main__":
+    main()
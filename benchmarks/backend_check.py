@@ -0,0 +1,93 @@
+"""
+嵌入模型 / 重排模型推理后端对比：以 PyTorch fp32 为基准，在评估问题集上检查各后端的精度与吞吐。
+
+用法（在项目根目录）：
+    python -m benchmarks.backend_check                          # 默认对比 torch / torch_int8 / onnx
+    python -m benchmarks.backend_check --backends torch onnx --chunks 1000
+
+报告内容：
+- 嵌入：问题向量与 fp32 的余弦相似度（均值/最小值）、top-k 检索结果与 fp32 的重合率、编码吞吐
+- 重排：分数与 fp32 的平均绝对误差、每题最优候选与 fp32 一致的比例、重排吞吐
+"""
+import json
+import time
+import argparse
+import numpy as np
+
+from config import (
+    NOVEL_PATH, QUESTIONS_FILE, CHUNK_SIZE, CHUNK_OVERLAP, EMBEDDING_MODEL_NAME, RERANK_MODEL_NAME
+)
+from models.backends import BACKENDS
+from models.registry import get_embedder, get_cross_encoder
+from retriever.chunking import split_text
+
+
+def load_questions(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return [q["question"] + "\n" + "\n".join(q["options"]) for q in json.load(f)]
+
+
+def normalize(x):
+    x = np.asarray(x, dtype=np.float32)
+    return x / np.linalg.norm(x, axis=1, keepdims=True)
+
+
+def top_k(q_emb, doc_emb, k):
+    return np.argsort(-(q_emb @ doc_emb.T), axis=1, kind="stable")[:, :k]
+
+
+def timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="推理后端精度与吞吐对比")
+    parser.add_argument("--backends", nargs="+", default=list(BACKENDS), choices=BACKENDS)
+    parser.add_argument("--questions", default=QUESTIONS_FILE)
+    parser.add_argument("--chunks", type=int, default=2000, help="参与检索对比的 chunk 数")
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--rerank-candidates", type=int, default=10, help="每题重排的候选数")
+    args = parser.parse_args()
+
+    questions = load_questions(args.questions)
+    with open(NOVEL_PATH, "r", encoding="utf-8") as f:
+        chunks = split_text(f.read(), CHUNK_SIZE, CHUNK_OVERLAP)[:args.chunks]
+    print(f"问题数: {len(questions)}，chunk 数: {len(chunks)}\n")
+
+    # fp32 基准
+    ref_embedder = get_embedder(EMBEDDING_MODEL_NAME, backend="torch").get()
+    ref_docs = normalize(ref_embedder.encode(chunks, convert_to_numpy=True))
+    ref_queries = normalize(ref_embedder.encode(questions, convert_to_numpy=True))
+    ref_top = top_k(ref_queries, ref_docs, args.k)
+    cand = top_k(ref_queries, ref_docs, args.rerank_candidates)
+    pairs = [[q, chunks[i]] for q, ids in zip(questions, cand) for i in ids]
+    ref_reranker = get_cross_encoder(RERANK_MODEL_NAME, backend="torch").get()
+    ref_scores = np.asarray(ref_reranker.predict(pairs), dtype=np.float32).reshape(len(questions), -1)
+
+    print(f"{'后端':<12}{'余弦均值':>10}{'余弦最小':>10}{'top-k重合':>10}"
+          f"{'编码(条/s)':>12}{'重排MAE':>10}{'top1一致':>10}{'重排(对/s)':>12}")
+    for backend in args.backends:
+        embedder = get_embedder(EMBEDDING_MODEL_NAME, backend=backend).get()
+        embedder.encode(chunks[:32])  # 预热，排除首次调用的初始化开销
+        docs, encode_time = timed(embedder.encode, chunks, convert_to_numpy=True)
+        docs = normalize(docs)
+        queries = normalize(embedder.encode(questions, convert_to_numpy=True))
+        cos = np.sum(queries * ref_queries, axis=1)
+        found = top_k(queries, docs, args.k)
+        overlap = np.mean([len(set(a) & set(b)) / args.k for a, b in zip(found, ref_top)])
+
+        reranker = get_cross_encoder(RERANK_MODEL_NAME, backend=backend).get()
+        reranker.predict(pairs[:32])
+        scores, rerank_time = timed(reranker.predict, pairs)
+        scores = np.asarray(scores, dtype=np.float32).reshape(len(questions), -1)
+        mae = float(np.abs(scores - ref_scores).mean())
+        top1 = float(np.mean(scores.argmax(axis=1) == ref_scores.argmax(axis=1)))
+
+        print(f"{backend:<12}{cos.mean():>10.4f}{cos.min():>10.4f}{overlap:>10.3f}"
+              f"{len(chunks) / encode_time:>12.1f}{mae:>10.4f}{top1:>10.3f}{len(pairs) / rerank_time:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
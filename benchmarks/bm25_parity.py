@@ -0,0 +1,80 @@
+"""
+SparseBM25 与 rank_bm25.BM25Okapi 的一致性校验。
+
+用法（在项目根目录）：
+    python -m benchmarks.bm25_parity [--chars 300000] [--top-k 25]
+
+对小说前若干字符切分出的 chunk 建两套索引，逐题比较全部文档的分数和 top-k 排序，
+不一致时以非零状态码退出。需要额外安装 rank_bm25。
+"""
+import sys
+import json
+import time
+import argparse
+import numpy as np
+import jieba
+from rank_bm25 import BM25Okapi
+
+from config import NOVEL_PATH, QUESTIONS_FILE, CHUNK_SIZE, CHUNK_OVERLAP
+from retriever.bm25_engine import SparseBM25
+from retriever.chunking import split_text
+
+
+def tokenize(text):
+    return list(jieba.cut_for_search(text))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SparseBM25 / rank_bm25 一致性校验")
+    parser.add_argument("--chars", type=int, default=300000, help="使用小说前多少个字符")
+    parser.add_argument("--top-k", type=int, default=25)
+    args = parser.parse_args()
+
+    with open(NOVEL_PATH, "r", encoding="utf-8") as f:
+        text = f.read(args.chars)
+    chunks = split_text(text, CHUNK_SIZE, CHUNK_OVERLAP)
+    tokenized = [tokenize(c) for c in chunks]
+
+    with open(QUESTIONS_FILE, "r", encoding="utf-8") as f:
+        questions = json.load(f)
+    queries = [tokenize(q["question"] + "".join(q["options"])) for q in questions]
+    # 额外覆盖重复词和未登录词
+    queries.append(tokenize("汪淼 汪淼 三体 不存在的词语ＸＹＺ"))
+
+    ref = BM25Okapi(tokenized)
+    engine = SparseBM25.from_tokenized(tokenized)
+
+    failures = 0
+    ref_time = engine_time = 0.0
+    for i, query in enumerate(queries):
+        t0 = time.perf_counter()
+        ref_scores = ref.get_scores(query)
+        ref_top = sorted(range(len(ref_scores)), key=lambda j: ref_scores[j], reverse=True)[:args.top_k]
+        t1 = time.perf_counter()
+        scores = engine.get_scores(query)
+        top, _ = engine.top_k(query, args.top_k)
+        t2 = time.perf_counter()
+        ref_time += t1 - t0
+        engine_time += t2 - t1
+
+        if not np.allclose(scores, ref_scores, rtol=1e-5, atol=1e-5):
+            failures += 1
+            print(f"第 {i} 个查询分数不一致，最大误差 {np.abs(scores - ref_scores).max():.3g}")
+        elif list(top) != ref_top:
+            # float32 权重可能让极近的分数换位，只要分数本身一致即可接受
+            ref_sorted = np.asarray(ref_scores)[ref_top]
+            if not np.allclose(np.asarray(ref_scores)[top], ref_sorted, rtol=1e-5, atol=1e-5):
+                failures += 1
+                print(f"第 {i} 个查询 top-{args.top_k} 排序不一致")
+
+    print(f"文档数: {len(chunks)}，查询数: {len(queries)}")
+    print(f"rank_bm25: {1000 * ref_time / len(queries):.2f} ms/查询")
+    print(f"SparseBM25: {1000 * engine_time / len(queries):.2f} ms/查询")
+    if failures:
+        print(f"❌ {failures} 个查询不一致")
+        sys.exit(1)
+    print("✅ 分数与排序一致")
+
+
+if __name__ == "__main__":
+    main()
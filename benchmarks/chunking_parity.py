@@ -0,0 +1,179 @@
+"""
+流式切分（retriever.chunking.iter_chunks）与旧版 split_text 的一致性与耗时对比。
+
+用法（在项目根目录）：
+    python -m benchmarks.chunking_parity [--cases 2000] [--chars 0]
+
+- 随机文本模糊测试：混合中英文标点、各种空白、连续标点和超长句，逐块比较文本，
+  并校验每个块及句子的原文偏移
+- 小说全文（--chars 0 表示全部）：比较切分结果与耗时，并校验分块读文件的结果相同
+不一致时以非零状态码退出。
+"""
+import os
+import re
+import sys
+import time
+import random
+import argparse
+import tempfile
+
+from config import NOVEL_PATH, CHUNK_SIZE, CHUNK_OVERLAP
+from retriever.chunking import iter_chunks, iter_file_chunks, chunk_files, split_text
+
+
+class LegacyHang(Exception):
+    pass
+
+
+def legacy_split_text(text, chunk_size=400, chunk_overlap=60):
+    """旧版 split_text 的原样拷贝（去掉进度条），仅在会死循环时抛出 LegacyHang"""
+    if not text or not text.strip():
+        return []
+    text = re.sub(r'\s+', ' ', text).strip()
+    if len(text) <= chunk_size:
+        return [text]
+    if chunk_overlap >= chunk_size:
+        raise ValueError("chunk_overlap must be less than chunk_size")
+    sentences = [s.strip() for s in re.split(r'(?<=[。！？.!?])\s*', text) if s.strip()]
+    if not sentences:
+        return [text[:chunk_size]]
+
+    chunks = []
+    current_chunk = ""
+    i = 0
+    total = len(sentences)
+    while i < total:
+        sentence = sentences[i]
+        if not current_chunk:
+            current_chunk = sentence
+            i += 1
+        else:
+            test_chunk = current_chunk + " " + sentence
+            if len(test_chunk) <= chunk_size:
+                current_chunk = test_chunk
+                i += 1
+            else:
+                chunks.append(current_chunk)
+                if len(chunks) > total + 1:
+                    # 重叠部分加下一句仍超长时，旧实现会反复输出同一个块
+                    raise LegacyHang()
+                overlap_text = ""
+                if chunk_overlap > 0 and chunks:
+                    overlap_sentences = []
+                    temp_len = 0
+                    for sent in reversed(sentences[:i]):
+                        if temp_len + len(sent) + 1 > chunk_overlap:
+                            break
+                        overlap_sentences.insert(0, sent)
+                        temp_len += len(sent) + 1
+                    overlap_text = " ".join(overlap_sentences)
+                current_chunk = overlap_text if overlap_text else ""
+    if current_chunk and (not chunks or current_chunk != chunks[-1]):
+        chunks.append(current_chunk)
+    if not chunks:
+        chunks = [text[:chunk_size]]
+    return chunks
+
+
+PIECES = ["天", "地", "玄", "黄", "宇宙", "洪荒", "abc", "x", "，", "、", "“", "”", "。", "！", "？", ".", "!", "?"]
+SPACES = [" ", "  ", "\n", "\n\n", "\t", "　", "\r\n"]
+
+
+def random_text(rng):
+    out = []
+    for _ in range(rng.randint(0, 400)):
+        r = rng.random()
+        if r < 0.12:
+            out.append(rng.choice(SPACES))
+        elif r < 0.125:
+            out.append("长" * rng.randint(10, 150))  # 超长句
+        else:
+            out.append(rng.choice(PIECES))
+    return "".join(out)
+
+
+def normalize(s):
+    return re.sub(r'\s+', ' ', s).strip()
+
+
+def check_offsets(text, chunks):
+    for chunk in chunks:
+        sentences = [normalize(text[a:b]) for a, b in chunk.sentences]
+        if chunk.start != chunk.sentences[0][0] or chunk.end != chunk.sentences[-1][1]:
+            return False
+        if chunk.text != " ".join(sentences) and chunk.text != normalize(text[chunk.start:chunk.end]):
+            return False
+    return True
+
+
+def fuzz(cases, seed=0):
+    rng = random.Random(seed)
+    failures = hangs = 0
+    for n in range(cases):
+        text = random_text(rng)
+        chunk_size = rng.randint(10, 200)
+        chunk_overlap = rng.randint(0, chunk_size + 5)
+        try:
+            expected = legacy_split_text(text, chunk_size, chunk_overlap)
+        except LegacyHang:
+            hangs += 1
+            continue
+        except ValueError:
+            expected = ValueError
+        try:
+            chunks = list(iter_chunks(text, chunk_size, chunk_overlap))
+            # 分块读入（极小的块）应得到相同结果
+            blocks = [text[i:i + 7] for i in range(0, len(text), 7)]
+            same_blocks = [c.text for c in iter_chunks(blocks, chunk_size, chunk_overlap)] == [c.text for c in chunks]
+            got = [c.text for c in chunks]
+        except ValueError:
+            got, same_blocks, chunks = ValueError, True, []
+        if got != expected or not same_blocks or not check_offsets(text, chunks):
+            failures += 1
+            if failures <= 3:
+                print(f"❌ 第 {n} 例不一致 (chunk_size={chunk_size}, chunk_overlap={chunk_overlap}): {text!r}")
+    print(f"模糊测试 {cases} 例：{failures} 例不一致，{hangs} 例旧实现会死循环（已跳过）")
+    return failures == 0
+
+
+def novel(chars):
+    if not os.path.exists(NOVEL_PATH):
+        print(f"未找到 {NOVEL_PATH}，跳过全文对比")
+        return True
+    with open(NOVEL_PATH, "r", encoding="utf-8") as f:
+        text = f.read(chars) if chars > 0 else f.read()
+
+    t0 = time.perf_counter()
+    expected = legacy_split_text(text, CHUNK_SIZE, CHUNK_OVERLAP)
+    t1 = time.perf_counter()
+    got = split_text(text, CHUNK_SIZE, CHUNK_OVERLAP)
+    t2 = time.perf_counter()
+    print(f"全文 {len(text)} 字符，{len(got)} 个块：旧实现 {t1 - t0:.2f}s，流式实现 {t2 - t1:.2f}s")
+    ok = got == expected
+    print(f"{'✅' if ok else '❌'} 切分结果与旧实现一致")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "novel.txt")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(text)
+        from_file = [c.text for c in iter_file_chunks(path, CHUNK_SIZE, CHUNK_OVERLAP, block_size=4096)]
+        same_file = from_file == got
+        print(f"{'✅' if same_file else '❌'} 分块读取文件结果一致")
+        results = list(chunk_files([path, path], CHUNK_SIZE, CHUNK_OVERLAP, workers=2))
+        same_pool = all([c.text for c in chunks] == got for _, chunks in results)
+        print(f"{'✅' if same_pool else '❌'} 多进程多文件切分结果一致")
+    return ok and same_file and same_pool
+
+
+def main():
+    parser = argparse.ArgumentParser(description="流式切分一致性校验")
+    parser.add_argument("--cases", type=int, default=2000, help="模糊测试例数")
+    parser.add_argument("--chars", type=int, default=0, help="使用小说前多少个字符，0 表示全文")
+    args = parser.parse_args()
+    passed = fuzz(args.cases)
+    passed &= novel(args.chars)
+    sys.exit(0 if passed else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,409 @@
+"""
+组件级微基准：在合成中文语料上分别测量分块、BM25、FAISS、混合融合与重排，离线、仅用 CPU 即可运行。
+嵌入模型与重排模型使用桩实现（字符 bigram 哈希向量 / 字符重合度），只衡量检索框架本身的开销与扩展性。
+
+用法（在项目根目录）：
+    python -m benchmarks.component_bench                                  # 1MB 语料，全部组件
+    python -m benchmarks.component_bench --sizes 1 10 100 --output bench.json
+    python -m benchmarks.component_bench --sizes 10 --components bm25 faiss --compare bench.json
+
+每个组件在独立子进程中运行，peak_rss_mb 为该子进程的峰值常驻内存。
+--compare 与基线 JSON 对比：吞吐下降、延迟或内存上升超过 --threshold 即标记为退化，并以退出码 1 结束。
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import multiprocessing
+import numpy as np
+
+from config import CHUNK_SIZE, CHUNK_OVERLAP
+
+COMPONENTS = ("split", "bm25", "faiss", "fusion", "rerank", "hybrid")
+
+# 合成语料字表：常用汉字，按词拼成句子
+CHARS = (
+    "的一是了我不人在他有这个上们来到时大地为子中你说生国年着就那和要她出也得里后自以会家可下而过天去能对小多然于心学么之都好看起发当没成只如事把还用第样道想作种开美总从无情己面最女但现前些所同日手又行意动方期它头经长儿回位分爱老因很给名法间斯知世什两次使身者被高已亲其进此话常与活正感"
+    "见明问力理尔点文几定本公特做外孩相西果走将月十实向声车全信重三机工物气每并别真打太新比才便夫再书部水像眼等体却加电主界门利海受听表德少克代员许先口由死安写性马光白或住难望教命花结乐色更拉东神记处让母父应直字场平报友关放至张认接告入笑内英军候民岁往何度山觉路带万男边风解叫任金快原吃妈变通师立象数四失满战远格士音轻目条呢"
+)
+NAMES = ("汪淼", "叶文洁", "史强", "罗辑", "章北海", "程心", "云天明", "丁仪", "杨冬", "申玉菲")
+PUNCT = ("。", "。", "。", "！", "？", "，")
+
+
+def synthetic_corpus(path, size_mb, seed=0):
+    """生成约 size_mb MB（UTF-8）的合成中文文本：随机词组成句子，句子组成段落"""
+    rng = np.random.default_rng(seed)
+    chars = np.array(list(CHARS))
+    target = int(size_mb * 2 ** 20)
+    written = 0
+    with open(path, "w", encoding="utf-8") as f:
+        while written < target:
+            # 一次生成一批句子，避免逐字符的 Python 循环
+            picked = chars[rng.integers(len(chars), size=4000)]
+            cuts = np.cumsum(rng.integers(1, 5, size=1500))[:-1]
+            words = ["".join(w) for w in np.split(picked, cuts) if len(w)]
+            parts = []
+            n = 0
+            while n < len(words):
+                length = int(rng.integers(4, 20))
+                sentence = words[n:n + length]
+                if rng.random() < 0.3:
+                    sentence.insert(int(rng.integers(len(sentence) + 1)), NAMES[int(rng.integers(len(NAMES)))])
+                parts.append("".join(sentence) + PUNCT[int(rng.integers(len(PUNCT)))])
+                if rng.random() < 0.08:
+                    parts.append("\n\n")
+                n += length
+            block = "".join(parts)
+            f.write(block)
+            written += len(block.encode("utf-8"))
+
+
+class StubEmbedder:
+    """字符 bigram 哈希到固定维度并归一化，代替 SentenceTransformer.encode"""
+
+    def __init__(self, dim=256):
+        self.dim = dim
+
+    def _vector(self, text):
+        codes = np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32).astype(np.int64)
+        ids = (codes[:-1] * 1000003 + codes[1:]) % self.dim if len(codes) > 1 else codes % self.dim
+        v = np.bincount(ids, minlength=self.dim).astype(np.float32)
+        return v / (np.linalg.norm(v) or 1.0)
+
+    def encode(self, texts, convert_to_numpy=True, **kwargs):
+        if isinstance(texts, str):
+            texts = [texts]
+        return np.vstack([self._vector(t) for t in texts]) if len(texts) else np.zeros((0, self.dim), np.float32)
+
+
+class StubCrossEncoder:
+    """以问题与文本的字符重合率作为相关性分数，代替 CrossEncoder.predict"""
+
+    def predict(self, pairs, **kwargs):
+        scores = []
+        for query, text in pairs:
+            q = set(query)
+            scores.append(len(q & set(text)) / (len(q) or 1))
+        return np.asarray(scores, dtype=np.float32)
+
+
+class StaticHandle:
+    def __init__(self, model):
+        self.model = model
+
+    def get(self):
+        return self.model
+
+
+def stub_reranker():
+    from models.reranker import Reranker
+    reranker = Reranker("stub-reranker")
+    reranker.handle = StaticHandle(StubCrossEncoder())
+    return reranker
+
+
+def peak_rss_mb():
+    try:
+        import resource
+        scale = 1 if sys.platform == "darwin" else 1024  # macOS 单位为字节，Linux 为 KB
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / 2 ** 20
+    except ImportError:
+        from models.registry import current_rss
+        rss = current_rss()
+        return rss / 2 ** 20 if rss else None
+
+
+def latency_stats(seconds, prefix=""):
+    ms = np.asarray(seconds) * 1000
+    return {
+        f"{prefix}p50_ms": float(np.percentile(ms, 50)),
+        f"{prefix}p95_ms": float(np.percentile(ms, 95)),
+        f"{prefix}p99_ms": float(np.percentile(ms, 99)),
+        f"{prefix}mean_ms": float(ms.mean()),
+        f"{prefix}qps_per_s": float(len(ms) / (ms.sum() / 1000)) if ms.sum() > 0 else 0.0,
+    }
+
+
+def timed_calls(fn, items):
+    seconds = []
+    for item in items:
+        start = time.perf_counter()
+        fn(item)
+        seconds.append(time.perf_counter() - start)
+    return seconds
+
+
+def sample_queries(chunks, n, seed=1):
+    """从 chunk 中截取片段作为查询，模拟“问题与原文部分重合”"""
+    rng = np.random.default_rng(seed)
+    queries = []
+    for i in rng.integers(len(chunks), size=n):
+        text = chunks[int(i)]
+        start = int(rng.integers(max(1, len(text) - 30)))
+        queries.append(text[start:start + int(rng.integers(12, 30))])
+    return queries
+
+
+def open_chunks(store_path):
+    from retriever.chunk_store import ChunkStore
+    return ChunkStore.open(store_path)
+
+
+# ---------- 各组件基准（在子进程中运行）----------
+
+def bench_split(corpus_path, store_path, work_dir, args):
+    from retriever.chunking import split_text
+    from retriever.chunk_store import ChunkStore
+
+    start = time.perf_counter()
+    with open(corpus_path, "r", encoding="utf-8") as f:
+        text = f.read()
+    read_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    chunks = split_text(text, CHUNK_SIZE, CHUNK_OVERLAP)
+    seconds = time.perf_counter() - start
+    ChunkStore.write(store_path, chunks).close()
+    size_mb = os.path.getsize(corpus_path) / 2 ** 20
+    return {
+        "chunks": len(chunks),
+        "read_seconds": read_seconds,
+        "split_seconds": seconds,
+        "throughput_mb_per_s": size_mb / seconds,
+        "throughput_chunks_per_s": len(chunks) / seconds,
+    }
+
+
+def bench_bm25(corpus_path, store_path, work_dir, args):
+    from retriever.bm25_retriever import BM25Retriever
+
+    import jieba
+    jieba.initialize()  # 词典加载不计入构建时间
+
+    chunks = list(open_chunks(store_path))
+    index_path = os.path.join(work_dir, "bench_bm25.pkl")
+    retriever = BM25Retriever(index_path)
+    start = time.perf_counter()
+    retriever.build_index(chunks)
+    build_seconds = time.perf_counter() - start
+
+    retriever = BM25Retriever(index_path)
+    start = time.perf_counter()
+    retriever.load_index()
+    load_seconds = time.perf_counter() - start
+
+    queries = sample_queries(chunks, args.queries)
+    return {
+        "build_seconds": build_seconds,
+        "build_chunks_per_s": len(chunks) / build_seconds,
+        "load_seconds": load_seconds,
+        **latency_stats(timed_calls(lambda q: retriever.retrieve_ids(q, args.top_k), queries), "retrieve_"),
+    }
+
+
+def bench_faiss(corpus_path, store_path, work_dir, args):
+    from retriever.faiss_retriever import FaissRetriever
+
+    chunks = list(open_chunks(store_path))
+    retriever = FaissRetriever(os.path.join(work_dir, "bench.faiss"))
+    retriever.embedder = StubEmbedder(args.dim)
+    start = time.perf_counter()
+    embeddings = retriever.embedder.encode(chunks)
+    embed_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    retriever._write_index(chunks, embeddings)
+    index_seconds = time.perf_counter() - start
+
+    queries = sample_queries(chunks, args.queries)
+    return {
+        "index_type": retriever.index_meta["type"],
+        "embed_chunks_per_s": len(chunks) / embed_seconds,
+        "index_build_seconds": index_seconds,
+        "index_build_chunks_per_s": len(chunks) / index_seconds,
+        **latency_stats(timed_calls(lambda q: retriever.search(q, args.top_k * 5), queries), "search_"),
+    }
+
+
+def bench_fusion(corpus_path, store_path, work_dir, args):
+    from retriever.fusion import fuse
+
+    n = len(open_chunks(store_path))
+    rng = np.random.default_rng(2)
+    k = max(args.top_k * 2, 10)
+    lists = []
+    for _ in range(args.queries):
+        a, b = rng.choice(n, size=k, replace=False), rng.choice(n, size=k, replace=False)
+        lists.append([(a, np.sort(rng.random(k))[::-1]), (b, np.sort(rng.random(k))[::-1] * 20)])
+    result = {}
+    for method in ("rrf", "linear"):
+        seconds = timed_calls(lambda r: fuse(r, method=method, weights=(1.0, 1.0), rrf_k=60), lists)
+        result.update(latency_stats(seconds, f"{method}_"))
+    return result
+
+
+def bench_rerank(corpus_path, store_path, work_dir, args):
+    chunks = open_chunks(store_path)
+    reranker = stub_reranker()
+    reranker.skip_margin = 2.0  # 关闭级联，测量完整重排
+    queries = sample_queries(chunks, args.queries)
+    rng = np.random.default_rng(3)
+    candidates = [rng.choice(len(chunks), size=args.top_k * 5, replace=False) for _ in queries]
+    items = list(zip(queries, candidates))
+
+    def run(item):
+        query, ids = item
+        reranker.rerank(query, ids, [chunks[int(i)] for i in ids], args.top_k)
+
+    cold = timed_calls(run, items)
+    warm = timed_calls(run, items)  # 第二遍全部命中分数缓存
+    return {**latency_stats(cold, "cold_"), **latency_stats(warm, "cached_")}
+
+
+def bench_hybrid(corpus_path, store_path, work_dir, args):
+    from retriever.hybrid_retriever import HybridRetriever
+
+    chunks = list(open_chunks(store_path))
+    retriever = HybridRetriever(
+        os.path.join(work_dir, "bench_hybrid.faiss"), os.path.join(work_dir, "bench_hybrid.pkl"), use_rerank=True
+    )
+    retriever.faiss.embedder = StubEmbedder(args.dim)
+    retriever.reranker = stub_reranker()
+    retriever.faiss._write_index(chunks, retriever.faiss.embedder.encode(chunks))
+    retriever.bm25.build_index(chunks)
+
+    queries = sample_queries(chunks, args.queries)
+    retriever.retrieve_ids(queries[0], args.top_k)
+    single = timed_calls(lambda q: retriever.retrieve_ids(q, args.top_k), queries)
+    retriever.reranker.clear_cache()
+    start = time.perf_counter()
+    retriever.retrieve_ids_batch(queries, args.top_k)
+    batch_seconds = time.perf_counter() - start
+    return {**latency_stats(single, "retrieve_"), "batch_qps_per_s": len(queries) / batch_seconds}
+
+
+BENCHES = {
+    "split": bench_split, "bm25": bench_bm25, "faiss": bench_faiss,
+    "fusion": bench_fusion, "rerank": bench_rerank, "hybrid": bench_hybrid,
+}
+
+
+def _child(name, corpus_path, store_path, work_dir, args, queue):
+    try:
+        from core import tracing
+        tracing.set_enabled(False)
+        result = BENCHES[name](corpus_path, store_path, work_dir, args)
+        result["peak_rss_mb"] = peak_rss_mb()
+        queue.put(result)
+    except Exception as e:
+        queue.put({"error": f"{type(e).__name__}: {e}"})
+
+
+def run_isolated(name, corpus_path, store_path, work_dir, args):
+    ctx = multiprocessing.get_context("spawn")
+    queue = ctx.Queue()
+    proc = ctx.Process(target=_child, args=(name, corpus_path, store_path, work_dir, args, queue))
+    proc.start()
+    result = queue.get()
+    proc.join()
+    return result
+
+
+# ---------- 基线对比 ----------
+
+def _direction(metric):
+    """1 表示越大越好，-1 表示越小越好，0 表示不比较"""
+    if metric.endswith("_per_s"):
+        return 1
+    if metric.endswith(("_ms", "_seconds", "_mb")):
+        return -1
+    return 0
+
+
+def compare(baseline, current, threshold):
+    regressions = []
+    print(f"\n{'语料':<8}{'组件':<8}{'指标':<28}{'基线':>12}{'当前':>12}{'变化':>10}")
+    for size, components in current["results"].items():
+        for comp, metrics in components.items():
+            base = baseline.get("results", {}).get(size, {}).get(comp, {})
+            for metric, value in metrics.items():
+                direction = _direction(metric)
+                old = base.get(metric)
+                if not direction or not isinstance(value, (int, float)) or not isinstance(old, (int, float)) or old == 0:
+                    continue
+                change = (value - old) / old
+                worse = -change * direction > threshold
+                flag = " ⚠️" if worse else ""
+                print(f"{size:<8}{comp:<8}{metric:<28}{old:>12.3f}{value:>12.3f}{change:>+10.1%}{flag}")
+                if worse:
+                    regressions.append((size, comp, metric, change))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="检索组件微基准（合成语料，离线运行）")
+    parser.add_argument("--sizes", type=float, nargs="+", default=[1.0], help="语料大小（MB），如 1 10 100")
+    parser.add_argument("--components", nargs="+", default=list(COMPONENTS), choices=COMPONENTS)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--dim", type=int, default=256, help="桩嵌入向量维度")
+    parser.add_argument("--work-dir", default=None, help="语料与索引存放目录，默认临时目录（可复用已生成的语料）")
+    parser.add_argument("--output", default=None, help="结果 JSON 路径（可作为下次 --compare 的基线）")
+    parser.add_argument("--compare", default=None, help="基线 JSON 路径")
+    parser.add_argument("--threshold", type=float, default=0.15, help="判定退化的相对变化阈值")
+    args = parser.parse_args()
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="rag_bench_")
+    os.makedirs(work_dir, exist_ok=True)
+    report = {
+        "meta": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "chunk_size": CHUNK_SIZE,
+            "chunk_overlap": CHUNK_OVERLAP,
+            "queries": args.queries,
+            "top_k": args.top_k,
+            "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+        },
+        "results": {},
+    }
+
+    for size in args.sizes:
+        label = f"{size:g}MB"
+        corpus_path = os.path.join(work_dir, f"corpus_{label}.txt")
+        store_path = os.path.join(work_dir, f"corpus_{label}.chunks")
+        if not os.path.exists(corpus_path):
+            print(f"生成 {label} 合成语料...")
+            synthetic_corpus(corpus_path, size)
+
+        results = report["results"][label] = {}
+        # 其余组件依赖分块结果
+        names = ["split"] + [c for c in args.components if c != "split"]
+        for name in names:
+            print(f"[{label}] {name} ...", flush=True)
+            results[name] = run_isolated(name, corpus_path, store_path, work_dir, args)
+            print("    " + ", ".join(
+                f"{k}={v:.3f}" if isinstance(v, float) else f"{k}={v}" for k, v in results[name].items()
+            ))
+        if "split" not in args.components:
+            results.pop("split")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\n结果已保存至 {args.output}")
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(baseline, report, args.threshold)
+        if regressions:
+            print(f"\n⚠️ 发现 {len(regressions)} 项退化（阈值 {args.threshold:.0%}）")
+            raise SystemExit(1)
+        print(f"\n✅ 未发现超过 {args.threshold:.0%} 的退化")
+
+
+if __name__ == "__main__":
+    main()
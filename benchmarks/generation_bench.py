@@ -0,0 +1,176 @@
+"""
+本地 LLM（QuantizedLLM）生成路径的一致性与耗时对比，prompt 取自评估题目的真实检索结果。
+
+用法（在项目根目录，需 USE_LOCAL_LLM = True）：
+    python -m benchmarks.generation_bench prefix [--questions data/TBP30.json] [--max-new-tokens 16]
+    python -m benchmarks.generation_bench batch [--batch-size 8] [--max-new-tokens 500]
+    python -m benchmarks.generation_bench lookup [--questions data/TBP161.json] [--max-new-tokens 500]
+
+- prefix：复用固定开头的 KV cache 与每次完整预填充，贪心解码结果应逐字一致
+- batch：逐题 generate 与按长度分桶、遇停止符提前结束的 generate_batch 的吞吐；
+  填充后的数值误差可能让个别回答不同，只报告一致的题数
+- lookup：普通贪心解码与 prompt lookup 解码的 tokens/s、每次前向产出的 token 数与草稿接受率，
+  输出应逐字一致
+不一致时以非零状态码退出。
+"""
+import sys
+import json
+import time
+import argparse
+
+from config import NOVEL_PATH, USE_LOCAL_LLM, MAX_NEW_TOKENS
+from core.rag_engine import RAGEngine, STOP_SEQUENCES, clean_answer
+from evaluate_rag import build_question
+
+
+def load_prompts(engine, questions_file, limit):
+    with open(questions_file, "r", encoding="utf-8") as f:
+        questions = [build_question(q) for q in json.load(f)]
+    if limit > 0:
+        questions = questions[:limit]
+    contexts = engine.retrieve_batch(questions)
+    return [engine.build_prompt(q, c) for q, c in zip(questions, contexts)]
+
+
+def bench_prefix(llm, prompts, max_new_tokens):
+    if not llm.prefix_stats()["prefixes"]:
+        print("未登记固定前缀（PREFIX_CACHE_ENABLED = False？）")
+        return False
+    llm.generate(prompts[0], max_new_tokens=max_new_tokens)  # 预热
+    plain = cached = 0.0
+    mismatches = 0
+    for prompt in prompts:
+        start = time.perf_counter()
+        expected = llm.generate(prompt, max_new_tokens=max_new_tokens, use_prefix_cache=False)
+        middle = time.perf_counter()
+        got = llm.generate(prompt, max_new_tokens=max_new_tokens)
+        plain += middle - start
+        cached += time.perf_counter() - middle
+        mismatches += got != expected
+    n = len(prompts)
+    print(f"完整预填充: 平均 {plain / n * 1000:.0f}ms/题")
+    print(f"复用前缀:   平均 {cached / n * 1000:.0f}ms/题（加速 {plain / max(cached, 1e-9):.2f}x）")
+    print(f"前缀统计: {llm.prefix_stats()}")
+    print(f"{'✅' if mismatches == 0 else '❌'} {n - mismatches}/{n} 题输出一致")
+    return mismatches == 0
+
+
+def bench_batch(llm, prompts, max_new_tokens, batch_size):
+    start = time.perf_counter()
+    sequential = [clean_answer(llm.generate(p, max_new_tokens=max_new_tokens)) for p in prompts]
+    sequential_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    raw = llm.generate_batch(prompts, max_new_tokens=max_new_tokens, stop=STOP_SEQUENCES, batch_size=batch_size)
+    batched = [clean_answer(r) for r in raw]
+    batched_seconds = time.perf_counter() - start
+
+    n = len(prompts)
+    same = sum(a == b for a, b in zip(sequential, batched))
+    print(f"逐题生成: {sequential_seconds:.1f}s，{n / sequential_seconds:.2f} 题/s")
+    print(
+        f"批量生成: {batched_seconds:.1f}s，{n / batched_seconds:.2f} 题/s"
+        f"（batch_size={batch_size}，加速 {sequential_seconds / max(batched_seconds, 1e-9):.2f}x）"
+    )
+    print(f"{'✅' if same == n else '⚠️'} {same}/{n} 题回答一致")
+    return True
+
+
+class ForwardCounter:
+    """统计模型前向次数与输入的 token 数（挂在模型的 forward 上）"""
+
+    def __init__(self, model):
+        self.calls = self.tokens = 0
+        self._handle = model.register_forward_pre_hook(self._hook, with_kwargs=True)
+
+    def _hook(self, module, args, kwargs):
+        input_ids = kwargs.get("input_ids", args[0] if args else None)
+        if input_ids is not None:
+            self.calls += 1
+            self.tokens += input_ids.shape[1]
+
+    def reset(self):
+        self.calls = self.tokens = 0
+
+    def remove(self):
+        self._handle.remove()
+
+
+def bench_lookup(llm, prompts, max_new_tokens):
+    """
+    关闭前缀缓存以便统计：普通解码每次前向产出 1 个 token，前向次数即生成的 token 数 n；
+    prompt lookup 第一步输入整个 prompt 加草稿，之后每步输入 1 个 token 加草稿，
+    因此 草稿数 = 输入 token 数 - prompt 长度 - 步数 + 1，接受数 = n - 步数
+    """
+    if not llm.prompt_lookup_tokens:
+        print("未开启 prompt lookup（PROMPT_LOOKUP_TOKENS = 0）")
+        return False
+    counter = ForwardCounter(llm.model)
+    plain_seconds = lookup_seconds = 0.0
+    generated = steps = drafted = 0
+    mismatches = 0
+    try:
+        for prompt in prompts:
+            prompt_len = len(llm.tokenizer(prompt)["input_ids"])
+            counter.reset()
+            start = time.perf_counter()
+            expected = llm.generate(
+                prompt, max_new_tokens=max_new_tokens, stop=STOP_SEQUENCES,
+                use_prefix_cache=False, use_prompt_lookup=False
+            )
+            plain_seconds += time.perf_counter() - start
+            n = counter.calls
+
+            counter.reset()
+            start = time.perf_counter()
+            got = llm.generate(prompt, max_new_tokens=max_new_tokens, stop=STOP_SEQUENCES, use_prefix_cache=False)
+            lookup_seconds += time.perf_counter() - start
+            generated += n
+            steps += counter.calls
+            drafted += counter.tokens - prompt_len - counter.calls + 1
+            mismatches += got != expected
+    finally:
+        counter.remove()
+
+    accepted = generated - steps
+    print(f"普通解码:    {generated / plain_seconds:.1f} tokens/s")
+    print(
+        f"prompt lookup: {generated / lookup_seconds:.1f} tokens/s"
+        f"（加速 {plain_seconds / max(lookup_seconds, 1e-9):.2f}x，每次前向 {generated / max(steps, 1):.2f} 个 token）"
+    )
+    print(f"草稿 {drafted} 个 token，接受 {accepted} 个，接受率 {accepted / max(drafted, 1):.1%}")
+    n = len(prompts)
+    print(f"{'✅' if mismatches == 0 else '❌'} {n - mismatches}/{n} 题输出一致")
+    return mismatches == 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地 LLM 生成路径对比")
+    parser.add_argument("mode", choices=["prefix", "batch", "lookup"], help="对比项")
+    parser.add_argument("--questions", default="data/TBP30.json", help="评估题目文件")
+    parser.add_argument("--limit", type=int, default=0, help="最多使用多少题，0 表示全部")
+    parser.add_argument("--max-new-tokens", type=int, default=None, help="每题最多生成的 token 数（prefix 默认 16，batch 默认 MAX_NEW_TOKENS）")
+    parser.add_argument("--batch-size", type=int, default=8, help="batch 模式每批的 prompt 数")
+    args = parser.parse_args()
+
+    if not USE_LOCAL_LLM:
+        print("需要本地 LLM（config.USE_LOCAL_LLM = True）")
+        sys.exit(1)
+    engine = RAGEngine(novel_path=NOVEL_PATH)
+    prompts = load_prompts(engine, args.questions, args.limit)
+    if args.mode == "prefix":
+        max_new_tokens = args.max_new_tokens or 16
+        print(f"{len(prompts)} 个 prompt，max_new_tokens={max_new_tokens}")
+        passed = bench_prefix(engine.llm, prompts, max_new_tokens)
+    else:
+        max_new_tokens = args.max_new_tokens or MAX_NEW_TOKENS
+        print(f"{len(prompts)} 个 prompt，max_new_tokens={max_new_tokens}")
+        if args.mode == "batch":
+            passed = bench_batch(engine.llm, prompts, max_new_tokens, args.batch_size)
+        else:
+            passed = bench_lookup(engine.llm, prompts, max_new_tokens)
+    sys.exit(0 if passed else 1)
+
+
+if __name__ == "__main__":
+    main()
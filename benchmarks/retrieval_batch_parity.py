@@ -0,0 +1,111 @@
+"""
+检索器批量接口（retrieve_batch）与逐题 retrieve 的一致性与吞吐对比。
+
+用法（在项目根目录）：
+    python -m benchmarks.retrieval_batch_parity [--chars 300000] [--questions data/TBP161.json] [--batch-size 16]
+
+对小说前若干字符切分出的 chunk 在临时目录中建 FAISS 与 BM25 索引，FAISS / BM25 / 混合检索器
+分别在关闭、开启重排时比较逐题调用与整批调用的结果（每次运行前清空重排缓存），并报告两种方式的 题/s；
+另外逐位比较 SparseBM25 整批打分与逐题打分的分数矩阵。
+嵌入与重排模型按批推理时填充长度不同，数值上可能有极小差异，近乎并列的候选若因此交换位置也会列为不一致。
+不一致时以非零状态码退出。
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+import numpy as np
+
+from config import (
+    NOVEL_PATH, QUESTIONS_FILE, CHUNK_SIZE, CHUNK_OVERLAP, TOP_K, RERANK_MODEL_NAME,
+    HYBRID_FUSION, HYBRID_WEIGHTS, RRF_K
+)
+from retriever.chunking import split_text
+from retriever.faiss_retriever import FaissRetriever
+from retriever.bm25_retriever import BM25Retriever
+from retriever.hybrid_retriever import HybridRetriever
+from evaluate_rag import build_question, load_questions
+
+
+def make_retrievers(directory, use_rerank):
+    faiss_path = os.path.join(directory, "index.faiss")
+    bm25_path = os.path.join(directory, "index.pkl")
+    retrievers = [
+        ("faiss", FaissRetriever(faiss_path, reranker_model_name=RERANK_MODEL_NAME, use_rerank=use_rerank)),
+        ("bm25", BM25Retriever(bm25_path, reranker_model_name=RERANK_MODEL_NAME, use_rerank=use_rerank)),
+        ("hybrid", HybridRetriever(
+            faiss_path=faiss_path, bm25_path=bm25_path, use_rerank=use_rerank, reranker_model_name=RERANK_MODEL_NAME,
+            fusion=HYBRID_FUSION, weights=HYBRID_WEIGHTS, rrf_k=RRF_K
+        )),
+    ]
+    for _, retriever in retrievers:
+        retriever.load_index()
+    return retrievers
+
+
+def compare(name, retriever, queries, top_k, batch_size):
+    retriever.retrieve(queries[0], top_k)  # 预热：加载模型与分词词典
+
+    retriever._clear_rerank_cache()
+    start = time.perf_counter()
+    single = [retriever.retrieve(q, top_k) for q in queries]
+    single_seconds = time.perf_counter() - start
+
+    retriever._clear_rerank_cache()
+    start = time.perf_counter()
+    batched = []
+    for b in range(0, len(queries), batch_size):
+        batched.extend(retriever.retrieve_batch(queries[b:b + batch_size], top_k))
+    batched_seconds = time.perf_counter() - start
+
+    n = len(queries)
+    mismatches = [i for i, (a, b) in enumerate(zip(single, batched)) if a != b]
+    print(
+        f"{name:<16} 逐题 {n / single_seconds:8.1f} 题/s | 整批 {n / batched_seconds:8.1f} 题/s"
+        f"（加速 {single_seconds / max(batched_seconds, 1e-9):.2f}x）| "
+        f"{'✅' if not mismatches else '❌'} {n - len(mismatches)}/{n} 题一致"
+    )
+    for i in mismatches[:3]:
+        print(f"    第 {i + 1} 题不一致：{queries[i][:30]!r}")
+    return not mismatches
+
+
+def main():
+    parser = argparse.ArgumentParser(description="批量检索与逐题检索的一致性与吞吐对比")
+    parser.add_argument("--chars", type=int, default=300000, help="使用小说前多少个字符")
+    parser.add_argument("--questions", default=QUESTIONS_FILE)
+    parser.add_argument("--top-k", type=int, default=TOP_K)
+    parser.add_argument("--batch-size", type=int, default=16, help="每批的问题数")
+    parser.add_argument("--no-rerank", action="store_true", help="只比较不重排的情况")
+    args = parser.parse_args()
+
+    with open(NOVEL_PATH, "r", encoding="utf-8") as f:
+        text = f.read(args.chars)
+    chunks = split_text(text, CHUNK_SIZE, CHUNK_OVERLAP)
+    queries = [build_question(q) for q in load_questions(args.questions)]
+    print(f"{len(chunks)} 个 chunk，{len(queries)} 道题，top_k={args.top_k}，batch_size={args.batch_size}")
+
+    passed = True
+    with tempfile.TemporaryDirectory() as directory:
+        FaissRetriever(os.path.join(directory, "index.faiss")).build_index(chunks)
+        bm25 = BM25Retriever(os.path.join(directory, "index.pkl"))
+        bm25.build_index(chunks)
+
+        tokenized = [bm25._tokenize(q) for q in queries]
+        same = np.array_equal(
+            bm25.bm25.get_scores_batch(tokenized), np.stack([bm25.bm25.get_scores(t) for t in tokenized])
+        )
+        print(f"{'✅' if same else '❌'} SparseBM25 整批打分与逐题打分逐位{'一致' if same else '不一致'}")
+        passed &= same
+
+        for use_rerank in ([False] if args.no_rerank else [False, True]):
+            for name, retriever in make_retrievers(directory, use_rerank):
+                passed &= compare(name + (" + rerank" if use_rerank else ""), retriever, queries, args.top_k, args.batch_size)
+                if isinstance(retriever, HybridRetriever):
+                    retriever._pool.shutdown()
+    sys.exit(0 if passed else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+"""
+离线建索引：多进程编码与分词、分片断点续跑，建好后 RAGEngine / Web 服务启动时直接加载。
+
+用法（在项目根目录）：
+    python build_index.py                         # 默认小说 data/novel.txt
+    python build_index.py --collection santi-2    # data/collections/<名称>/novel.txt，可重复指定
+    python build_index.py --all                   # 所有 collection
+    python build_index.py --workers 8 --shard-size 4096 --fp16
+
+中断后重新运行同一命令即从断点继续；--fresh 丢弃断点重新开始，--force 在索引已是最新时也重建。
+"""
+import sys
+import argparse
+
+from config import INDEX_BUILD_WORKERS, INDEX_BUILD_SHARD_SIZE, INDEX_BUILD_FP16, DEFAULT_COLLECTION
+from core.collection_manager import CollectionManager
+from retriever.index_builder import IndexBuilder
+
+
+def main():
+    parser = argparse.ArgumentParser(description="离线并行建索引（可断点续跑）")
+    parser.add_argument("--collection", action="append", default=[], help="要建索引的 collection，可重复指定")
+    parser.add_argument("--all", action="store_true", help="为所有 collection 建索引")
+    parser.add_argument("--workers", type=int, default=INDEX_BUILD_WORKERS, help="编码与分词的进程数，0 表示 CPU 核数")
+    parser.add_argument("--shard-size", type=int, default=INDEX_BUILD_SHARD_SIZE, help="每个分片（断点粒度）的 chunk 数")
+    parser.add_argument("--batch-size", type=int, default=32, help="嵌入模型每次前向的 chunk 数")
+    parser.add_argument("--fp16", action="store_true", default=INDEX_BUILD_FP16, help="分片向量以 fp16 落盘")
+    parser.add_argument("--fresh", action="store_true", help="丢弃已有断点，重新开始")
+    parser.add_argument("--force", action="store_true", help="索引已是最新时也重建")
+    args = parser.parse_args()
+
+    manager = CollectionManager()
+    names = manager.available() if args.all else (args.collection or [DEFAULT_COLLECTION])
+    targets = []
+    for name in names:
+        paths = manager.paths(name)
+        if paths is None:
+            print(f"❌ 未找到 collection：{name}")
+            sys.exit(1)
+        targets.append((name, paths))
+
+    for name, (novel_path, index_path) in targets:
+        print(f"🔧 {name}: {novel_path} -> {index_path}")
+        builder = IndexBuilder(
+            index_path, workers=args.workers, shard_size=args.shard_size, batch_size=args.batch_size, fp16=args.fp16
+        )
+        builder.build(novel_path, resume=not args.fresh, force=args.force)
+
+
+if __name__ == "__main__":
+    main()
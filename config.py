@@ -17,16 +17,99 @@ EMBEDDING_MODEL_NAME = "BAAI/bge-small-zh-v1.5"
 
 RETRIEVER_TYPE = "faiss"  # 可选：faiss, bm25，hybrid
 
+# ========== CPU 推理后端（嵌入模型与重排模型）==========
+# torch: PyTorch fp32；torch_int8: PyTorch 动态 int8 量化；onnx: ONNX Runtime（需 optimum[onnxruntime]）
+# 切换前可用 python -m benchmarks.backend_check 对比精度与吞吐
+EMBEDDING_BACKEND = "torch"
+RERANK_BACKEND = "torch"
+CPU_NUM_THREADS = 0         # 推理线程数，0 表示使用库默认值
+
+# ========== 混合检索配置（RETRIEVER_TYPE = "hybrid" 时生效）==========
+HYBRID_FUSION = "rrf"       # 可选：rrf（加权倒数排名融合）, linear（min-max 归一化后线性加权）
+HYBRID_WEIGHTS = (1.0, 1.0) # (FAISS, BM25) 两路权重
+RRF_K = 60                  # RRF 平滑常数
+
+# ========== FAISS 索引配置 ==========
+# flat_l2: 精确 L2（旧版默认）；flat_ip: 精确内积（向量归一化后即余弦相似度）
+# hnsw: HNSW 图索引；ivfpq: 倒排 + 乘积量化（需训练，内存占用最小）
+FAISS_INDEX_TYPE = "flat_ip"
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 200
+HNSW_EF_SEARCH = 128        # 查询时参数，修改后无需重建
+IVF_NLIST = 1024            # 实际聚类数不超过 向量数 / 39
+IVF_NPROBE = 32             # 查询时参数，修改后无需重建
+PQ_M = 64                   # 子量化器个数，需整除向量维度（bge-small-zh 为 512 维）
+PQ_NBITS = 8
+FAISS_MMAP = True           # 以 mmap 方式打开索引（Flat/HNSW 向量、IVF 倒排表），冷门小说只占页缓存
+
+# ========== 离线建索引（python build_index.py）==========
+INDEX_BUILD_WORKERS = 0         # 编码与分词的进程数，0 表示 CPU 核数；每个进程各加载一份嵌入模型
+INDEX_BUILD_SHARD_SIZE = 2048   # 每个分片的 chunk 数；每完成一个分片落盘并记入断点，中断后从断点继续
+INDEX_BUILD_FP16 = False        # 分片向量以 fp16 落盘（磁盘减半，加入索引的向量有舍入误差）
+
 USE_RERANK = True
 RERANK_MODEL_NAME = "BAAI/bge-reranker-base"
+RERANK_CACHE_SIZE = 4096    # (问题, chunk id) -> 重排分数 的 LRU 容量，0 表示关闭缓存
+# 级联重排：首阶段第 k 名与第 k+1 名的分差（按候选分数跨度归一化到 0~1）；默认关闭，可尝试 0.5 / 0.2
+RERANK_SKIP_MARGIN = 1.01   # 分差 ≥ 此值时跳过重排，直接取首阶段前 k 个；设为大于 1 即关闭
+RERANK_SHRINK_MARGIN = 1.01 # 分差 ≥ 此值时只重排前 k * RERANK_SHRINK_FACTOR 个候选；设为大于 1 即关闭
+RERANK_SHRINK_FACTOR = 2    # 只对 faiss / bm25 检索生效：混合检索本来就只重排融合后的前 k * 2 个
+
+# ========== 上下文打包 ==========
+# 按原文位置合并相邻/重叠的 chunk、去掉重复句子，并按 token 预算（而不是固定 TOP_K 个）取舍
+CONTEXT_PACKING = True
+CONTEXT_TOKEN_BUDGET = 2048       # 上下文的 token 上限；本地模式用 LLM 分词器计数，API 模式按字符估算
+CONTEXT_TOP_K = 8                 # 打包时按相关性依次考虑的候选 chunk 数（关闭打包时仍取 TOP_K 个）
+
+# ========== 生成配置 ==========
+# 按任务选择回答长度上限与追加的停止符（通用停止符见 core/rag_engine.py 的 STOP_SEQUENCES）
+GENERATION_PROFILES = {
+    "free": {"max_new_tokens": MAX_NEW_TOKENS, "stop": []},  # 自由问答
+    "choice": {"max_new_tokens": 8, "stop": []},             # 选择题：只需输出选项字母
+}
+DEFAULT_GENERATION_PROFILE = "free"
+
+# ========== 问答缓存 ==========
+ANSWER_CACHE_ENABLED = True
+ANSWER_CACHE_SIZE = 1024          # 精确层：规范化问题 -> 回答
+ANSWER_CACHE_TTL = 3600           # 回答过期时间（秒），0 表示不过期
+SEMANTIC_CACHE_SIZE = 512         # 语义层：近似重复问题 -> 回答
+SEMANTIC_CACHE_THRESHOLD = 1.01   # 问题向量余弦相似度阈值（如 0.97），大于 1 表示关闭语义层（默认关闭）
+RETRIEVAL_CACHE_SIZE = 2048       # 检索层：规范化问题 -> chunk id
+RETRIEVAL_CACHE_TTL = 3600
+
+# ========== Web 请求微批处理 ==========
+BATCH_WINDOW_MS = 20              # 收到第一个请求后最多再等待的时间（毫秒）
+MAX_BATCH_SIZE = 8                # 单批最多合并的请求数，设为 1 即逐个处理
+
+# ========== 多部小说（collection）服务 ==========
+# 每部小说一个目录：<COLLECTIONS_DIR>/<id>/novel.txt，索引文件写在同一目录；/ask 通过 collection 参数选择
+COLLECTIONS_DIR = os.path.join(DATA_DIR, "collections")
+DEFAULT_COLLECTION = "default"      # 未指定时使用；没有同名目录时对应 NOVEL_PATH 与原有索引
+COLLECTION_MEMORY_BUDGET_MB = 2048  # 已加载 collection 的内存预算（不含共享的模型），超出时卸载最久未用的
+MAX_LOADED_COLLECTIONS = 8
+
+# ========== 埋点 ==========
+TRACING_ENABLED = True            # 记录各阶段耗时与计数器，供 /metrics 导出；关闭后几乎无开销
 
 # ========== 本地 配置（当 USE_LOCAL_LLM=True 时生效）==========
 
 LOCAL_LLM_MODEL_NAME = "Qwen/Qwen2-1.5B-Instruct"
+LOCAL_LLM_BATCH_SIZE = 8     # 批量生成时每批最多的 prompt 数（按 token 数分桶，桶内左填充）
+PREFIX_CACHE_ENABLED = True  # 预先计算 prompt 固定开头（系统指令）的 KV cache，每次请求只预填充其余部分
+# prompt lookup 解码：用 prompt（检索片段）中的 n-gram 匹配起草后续 token，一次前向验证多个，贪心下输出不变
+PROMPT_LOOKUP_TOKENS = 10    # 每步起草的 token 数，0 表示关闭
+PROMPT_LOOKUP_NGRAM = 3      # 匹配时使用的最长 n-gram
 
 # ========== API 配置（当 USE_LOCAL_LLM=False 时生效）==========
 
 LLM_API_KEY = os.getenv("LLM_API_KEY", "") # 请在环境变量中设置您的 API Key
 LLM_BASE_URL = "https://ark.cn-beijing.volces.com/api/v3"   
-API_LLM_MODEL_NAME = "doubao-seed-1-6-251015"          
+API_LLM_MODEL_NAME = "doubao-seed-1-6-251015"
+API_CONNECT_TIMEOUT = 5     # 建立连接超时（秒）
+API_READ_TIMEOUT = 60       # 等待响应超时（秒）
+API_MAX_RETRIES = 3         # 连接错误、超时、429 与 5xx 的最大重试次数
+API_BACKOFF_BASE = 0.5      # 指数退避基数（秒），实际等待带随机抖动
+API_BACKOFF_MAX = 8
+API_MAX_CONCURRENCY = 8     # 并发请求上限（连接池大小、批量/异步调用的并发数）
 
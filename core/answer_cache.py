@@ -0,0 +1,180 @@
+"""
+问答缓存，三层均带容量上限（LRU）与过期时间：
+1. 精确层：规范化后的问题 -> (回答, 上下文)
+2. 语义层：问题向量 -> 近似重复问题的回答（FAISS 内积索引 + 相似度阈值）
+3. 检索层：规范化后的问题 -> 检索到的 chunk id
+
+缓存属于单个 RAGEngine，记录其加载时的索引版本（version）；索引只在创建引擎时同步，
+重建或增量更新后会创建新的引擎与缓存，旧回答不会被复用。
+"""
+import time
+import threading
+import unicodedata
+import numpy as np
+from collections import OrderedDict
+from typing import Dict, Hashable, List, Optional, Tuple
+from core import tracing
+
+
+def normalize_question(question: str) -> str:
+    # 全角/半角统一、忽略多余空白
+    return " ".join(unicodedata.normalize("NFKC", question).split())
+
+
+class TTLCache:
+    """线程安全的 LRU 缓存，条目超过 ttl 秒后失效（ttl <= 0 表示不过期）"""
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, Tuple[float, object]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _expired(self, stored_at: float) -> bool:
+        return self.ttl > 0 and time.monotonic() - stored_at > self.ttl
+
+    def get(self, key: Hashable):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            if self._expired(item[0]):
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return item[1]
+
+    def put(self, key: Hashable, value):
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._data[key] = (time.monotonic(), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class SemanticCache:
+    """
+    近似重复问题缓存：在历史问题向量上做内积检索，相似度达到阈值即命中。
+    faiss 在首次读写时才导入，关闭语义层的部署（如只用 BM25）启动时不必加载
+    """
+
+    def __init__(self, max_size: int, ttl: float, threshold: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.threshold = threshold
+        self.index = None
+        self._vectors: List[np.ndarray] = []
+        self._entries: List[Tuple[float, object]] = []  # 与 index 中的行一一对应
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_size > 0 and self.threshold <= 1
+
+    @staticmethod
+    def _normalize(vector) -> np.ndarray:
+        import faiss
+        v = np.asarray(vector, dtype=np.float32).reshape(1, -1).copy()
+        faiss.normalize_L2(v)
+        return v
+
+    def _rebuild(self):
+        import faiss
+        self.index = faiss.IndexFlatIP(self._vectors[0].shape[1]) if self._vectors else None
+        if self.index is not None:
+            self.index.add(np.vstack(self._vectors))
+
+    def _evict(self):
+        # 容量很小，淘汰时整体重建索引即可
+        now = time.monotonic()
+        keep = [
+            n for n, (stored_at, _) in enumerate(self._entries)
+            if not (self.ttl > 0 and now - stored_at > self.ttl)
+        ][-self.max_size:]
+        if len(keep) == len(self._entries):
+            return
+        self._vectors = [self._vectors[n] for n in keep]
+        self._entries = [self._entries[n] for n in keep]
+        self._rebuild()
+
+    def get(self, vector):
+        if not self.enabled:
+            return None
+        q = self._normalize(vector)
+        with self._lock:
+            if self.index is None or self.index.ntotal == 0:
+                return None
+            scores, ids = self.index.search(q, min(4, self.index.ntotal))
+            now = time.monotonic()
+            for score, i in zip(scores[0], ids[0]):
+                if i < 0 or score < self.threshold:
+                    break
+                stored_at, value = self._entries[i]
+                if not (self.ttl > 0 and now - stored_at > self.ttl):
+                    return value
+        return None
+
+    def put(self, vector, value):
+        if not self.enabled:
+            return
+        v = self._normalize(vector)
+        with self._lock:
+            if self.index is None:
+                import faiss
+                self.index = faiss.IndexFlatIP(v.shape[1])
+            self._vectors.append(v)
+            self._entries.append((time.monotonic(), value))
+            self.index.add(v)
+            if len(self._entries) > self.max_size:
+                self._evict()
+
+    def clear(self):
+        with self._lock:
+            self._vectors, self._entries, self.index = [], [], None
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class AnswerCache:
+    def __init__(
+        self,
+        answer_size: int,
+        answer_ttl: float,
+        semantic_size: int,
+        semantic_threshold: float,
+        retrieval_size: int,
+        retrieval_ttl: float,
+        version: Optional[str] = None
+    ):
+        self.exact = TTLCache(answer_size, answer_ttl)
+        self.semantic = SemanticCache(semantic_size, answer_ttl, semantic_threshold)
+        self.retrieval = TTLCache(retrieval_size, retrieval_ttl)
+        self.version = version
+        self._counters = {"exact_hits": 0, "semantic_hits": 0, "retrieval_hits": 0, "misses": 0}
+        self._counter_lock = threading.Lock()
+
+    def clear(self):
+        self.exact.clear()
+        self.semantic.clear()
+        self.retrieval.clear()
+
+    def count(self, name: str):
+        with self._counter_lock:
+            self._counters[name] += 1
+        tracing.incr("rag_cache_events_total", event=name)
+
+    def stats(self) -> Dict[str, int]:
+        with self._counter_lock:
+            stats = dict(self._counters)
+        stats.update(exact_size=len(self.exact), semantic_size=len(self.semantic), retrieval_size=len(self.retrieval))
+        return stats
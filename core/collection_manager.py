@@ -0,0 +1,220 @@
+"""
+多部小说（collection）共用一个进程：
+- 每部小说一个目录 <COLLECTIONS_DIR>/<id>/novel.txt，索引文件写在同一目录
+- 首次请求时加载（必要时构建索引）为 RAGEngine；嵌入、重排模型经注册表共享，LLM 只加载一份
+- 已加载的 collection 按最近使用排序，超出内存预算或数量上限时卸载最久未用的
+- warm_up() 在后台先并行加载 LLM 与嵌入/重排模型，再加载索引
+"""
+import gc
+import os
+import re
+import time
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from config import (
+    COLLECTIONS_DIR, DEFAULT_COLLECTION, COLLECTION_MEMORY_BUDGET_MB, MAX_LOADED_COLLECTIONS,
+    NOVEL_PATH, RETRIEVER_TYPE, EMBEDDING_MODEL_NAME, USE_RERANK, RERANK_MODEL_NAME,
+    ANSWER_CACHE_ENABLED, SEMANTIC_CACHE_SIZE, SEMANTIC_CACHE_THRESHOLD
+)
+from models.registry import current_rss, registry
+
+NOVEL_FILE = "novel.txt"
+INDEX_NAME = "index"
+DEFAULT_INDEX_PATH = "novel_index"  # 单小说模式下的原有索引位置
+_ID_PATTERN = re.compile(r"^[\w\-]+$")
+
+
+def _loaded_models() -> Dict[tuple, int]:
+    return {
+        (r["kind"], r["model"], r["device"], r["dtype"], r["backend"]): r["rss_bytes"] or 0
+        for r in registry.memory_report() if r["loaded"]
+    }
+
+
+def _register_models():
+    """按配置登记检索器会用到的嵌入/重排模型（与检索器创建的是同一个共享句柄），以便提前并行加载"""
+    from models.embedding import EmbeddingModel
+    from models.reranker import Reranker
+
+    if RETRIEVER_TYPE != "bm25" or (
+        ANSWER_CACHE_ENABLED and SEMANTIC_CACHE_SIZE > 0 and SEMANTIC_CACHE_THRESHOLD <= 1
+    ):
+        EmbeddingModel(EMBEDDING_MODEL_NAME)
+    if USE_RERANK:
+        Reranker(RERANK_MODEL_NAME)
+
+
+class _SharedLLM:
+    """转发到管理器共享的 LLM：首次生成时才等待其加载完成，索引加载不必等 LLM"""
+
+    def __init__(self, manager: "CollectionManager"):
+        self._manager = manager
+
+    def __getattr__(self, name):
+        return getattr(self._manager.shared_llm(), name)
+
+
+class CollectionManager:
+    def __init__(
+        self,
+        root: str = COLLECTIONS_DIR,
+        default_id: str = DEFAULT_COLLECTION,
+        memory_budget_mb: float = COLLECTION_MEMORY_BUDGET_MB,
+        max_loaded: int = MAX_LOADED_COLLECTIONS,
+        llm=None
+    ):
+        self.root = root
+        self.default_id = default_id
+        self.memory_budget = memory_budget_mb * 2 ** 20
+        self.max_loaded = max(1, max_loaded)
+        self._llm = llm
+        self._engines: "OrderedDict[str, object]" = OrderedDict()  # 最近使用的在末尾
+        self._memory: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        # 加载串行进行：既避免同一 collection 重复加载，也让常驻内存增量归属明确
+        self._load_lock = threading.Lock()
+        self._loads = 0
+        self._evictions = 0
+
+    def paths(self, collection_id: str) -> Optional[Tuple[str, str]]:
+        """返回 (小说路径, 索引路径前缀)；collection 不存在时返回 None"""
+        if not collection_id or not _ID_PATTERN.match(collection_id):
+            return None
+        directory = os.path.join(self.root, collection_id)
+        novel_path = os.path.join(directory, NOVEL_FILE)
+        if os.path.isfile(novel_path):
+            return novel_path, os.path.join(directory, INDEX_NAME)
+        if collection_id == self.default_id and os.path.isfile(NOVEL_PATH):
+            return NOVEL_PATH, DEFAULT_INDEX_PATH
+        return None
+
+    def available(self) -> List[str]:
+        ids = set()
+        if os.path.isdir(self.root):
+            ids.update(name for name in os.listdir(self.root) if self.paths(name) is not None)
+        if self.paths(self.default_id) is not None:
+            ids.add(self.default_id)
+        return sorted(ids)
+
+    def loaded(self) -> List[str]:
+        with self._lock:
+            return list(self._engines)
+
+    def shared_llm(self):
+        if self._llm is not None:
+            return self._llm
+        from core.rag_engine import llm_handle
+        return llm_handle().get()
+
+    def warm_up(self, collection_ids: Optional[List[str]] = None):
+        """
+        预热：LLM 与检索用到的嵌入/重排模型并行加载，全部加载完后再加载各 collection 的索引。
+        索引不与模型同时加载：_load 按前后常驻内存之差估算 collection 的内存，模型同时加载会被计入。
+        默认只预热默认 collection，其余在首次被请求时加载
+        """
+        from core.rag_engine import llm_handle
+
+        if collection_ids is None:
+            collection_ids = [self.default_id] if self.default_id in self.available() else []
+        if self._llm is None:
+            llm_handle()
+        _register_models()
+        registry.load_all()
+        for collection_id in collection_ids:
+            self.get(collection_id)
+        registry.load_all()  # 加载索引时才登记的模型
+
+    def get(self, collection_id: Optional[str] = None):
+        """返回 collection 对应的 RAGEngine，未加载时加载；collection 不存在时抛出 KeyError"""
+        collection_id = collection_id or self.default_id
+        with self._lock:
+            engine = self._engines.get(collection_id)
+            if engine is not None:
+                self._engines.move_to_end(collection_id)
+                return engine
+        paths = self.paths(collection_id)
+        if paths is None:
+            raise KeyError(collection_id)
+
+        with self._load_lock:
+            with self._lock:
+                engine = self._engines.get(collection_id)
+                if engine is not None:
+                    self._engines.move_to_end(collection_id)
+                    return engine
+            engine, size = self._load(collection_id, *paths)
+            with self._lock:
+                self._engines[collection_id] = engine
+                self._memory[collection_id] = size
+                self._loads += 1
+                evicted = self._evict(keep=collection_id)
+        if evicted:
+            # 正在处理的请求仍持有引擎引用，处理完后随引用计数释放
+            del evicted
+            gc.collect()
+        return engine
+
+    def _load(self, collection_id: str, novel_path: str, index_path: str):
+        from core.rag_engine import RAGEngine
+
+        if RETRIEVER_TYPE != "faiss":
+            # jieba 词典是进程级共享的，先加载以免计入第一部小说
+            import jieba
+            jieba.initialize()
+        models_before = _loaded_models()
+        rss_before = current_rss()
+        start = time.perf_counter()
+        print(f"加载小说 [{collection_id}]：{novel_path}")
+        engine = RAGEngine(novel_path=novel_path, index_path=index_path, llm=_SharedLLM(self))
+        rss_after = current_rss()
+
+        size = 0
+        if rss_before is not None and rss_after is not None:
+            # 扣除本次顺带加载的共享模型；mmap 打开的索引只占页缓存，计入的主要是 BM25 词表、HNSW 图等
+            new_models = sum(v for k, v in _loaded_models().items() if k not in models_before)
+            size = max(0, rss_after - rss_before - new_models)
+        print(f"小说 [{collection_id}] 加载完成，用时 {time.perf_counter() - start:.1f}s，约占内存 {size / 2 ** 20:.0f}MB")
+        return engine, size
+
+    def _evict(self, keep: str) -> list:
+        evicted = []
+        while len(self._engines) > 1 and (
+            len(self._engines) > self.max_loaded or sum(self._memory.values()) > self.memory_budget
+        ):
+            collection_id = next(iter(self._engines))
+            if collection_id == keep:
+                break
+            evicted.append(self._engines.pop(collection_id))
+            self._memory.pop(collection_id)
+            self._evictions += 1
+            print(f"卸载小说 [{collection_id}]")
+        return evicted
+
+    def unload(self, collection_id: str) -> bool:
+        with self._lock:
+            engine = self._engines.pop(collection_id, None)
+            self._memory.pop(collection_id, None)
+        if engine is None:
+            return False
+        del engine
+        gc.collect()
+        return True
+
+    def stats(self) -> dict:
+        with self._lock:
+            loaded = [
+                {"id": cid, "memory_mb": round(self._memory[cid] / 2 ** 20, 1)} for cid in self._engines
+            ]
+            total = sum(self._memory.values())
+            loads, evictions = self._loads, self._evictions
+        return {
+            "available": self.available(),
+            "loaded": loaded,  # 按最近使用排序，最后一个最新
+            "memory_mb": round(total / 2 ** 20, 1),
+            "memory_budget_mb": round(self.memory_budget / 2 ** 20, 1),
+            "max_loaded": self.max_loaded,
+            "loads": loads,
+            "evictions": evictions,
+        }
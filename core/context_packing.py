@@ -0,0 +1,116 @@
+"""
+上下文打包：把检索到的 chunk 整理成 prompt 中的上下文段落。
+- 按原文位置排序，原文中相邻或重叠的 chunk 合并为一段，重叠的句子只保留一次
+- 不同段落中重复出现的句子只保留第一次
+- 按相关性依次加入 chunk，直到达到 token 预算（而不是固定取 TOP_K 个）
+"""
+import re
+from typing import Callable, List, Optional, Sequence, Tuple
+
+# 与切分时的断句规则一致：chunk 文本按此规则切开即得到组成它的句子
+SENTENCE_PATTERN = re.compile(r'(?<=[。！？.!?])\s*')
+DEDUP_MIN_CHARS = 8  # 短句（如“是。”）在不同位置重复出现很正常，不做跨段去重
+_CJK = re.compile(r'[　-〿㐀-鿿豈-﫿＀-￯]')
+
+
+def split_sentences(text: str) -> List[str]:
+    return [s for s in SENTENCE_PATTERN.split(text) if s]
+
+
+def estimate_tokens(text: str) -> int:
+    """没有本地分词器（API 模式）时的估算：中日文字符按 1 个 token，其余约 4 个字符 1 个 token"""
+    cjk = len(_CJK.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+class PackedContext:
+    """passages 为打包后的段落（按原文顺序），chunk_ids 为实际用到的 chunk；
+    tokens 为段落拼接后的 token 数，naive_tokens 为这些 chunk 直接拼接的 token 数"""
+
+    __slots__ = ("passages", "chunk_ids", "tokens", "naive_tokens")
+
+    def __init__(self, passages: List[str], chunk_ids: List[int], tokens: int, naive_tokens: int):
+        self.passages = passages
+        self.chunk_ids = chunk_ids
+        self.tokens = tokens
+        self.naive_tokens = naive_tokens
+
+
+def _assemble(
+    ids: Sequence[int],
+    texts: dict,
+    spans: Optional[Sequence[Tuple[int, int]]]
+) -> List[str]:
+    # chunk id 本身就是原文顺序；有偏移时按偏移排序并据此判断重叠
+    order = sorted(ids, key=lambda i: (int(spans[i][0]), i) if spans is not None else (i, i))
+    passages: List[List[str]] = []
+    prev_id, prev_end = None, -1
+    for i in order:
+        sentences = split_sentences(texts[i])
+        start, end = (int(spans[i][0]), int(spans[i][1])) if spans is not None else (None, None)
+        adjacent = prev_id is not None and (i == prev_id + 1 or (start is not None and start < prev_end))
+        if adjacent:
+            passage = passages[-1]
+            # 后一个 chunk 以前一个 chunk 末尾的若干整句开头，找出最长的重叠部分
+            overlap = 0
+            for k in range(min(len(passage), len(sentences)), 0, -1):
+                if passage[-k:] == sentences[:k]:
+                    overlap = k
+                    break
+            passage.extend(sentences[overlap:])
+        else:
+            passages.append(list(sentences))
+        prev_id = i
+        if end is not None:
+            prev_end = max(prev_end, end) if adjacent else end
+
+    seen = set()
+    result = []
+    for passage in passages:
+        kept = []
+        for sentence in passage:
+            if len(sentence) >= DEDUP_MIN_CHARS:
+                if sentence in seen:
+                    continue
+                seen.add(sentence)
+            kept.append(sentence)
+        if kept:
+            result.append(" ".join(kept))
+    return result
+
+
+def pack_context(
+    ids: Sequence[int],
+    get_text: Callable[[int], str],
+    count_tokens: Callable[[str], int],
+    budget: int,
+    spans: Optional[Sequence[Tuple[int, int]]] = None
+) -> PackedContext:
+    """
+    ids 按相关性降序。依次尝试加入每个 chunk，整理后的上下文不超过 budget 个 token 才保留；
+    排名第一的 chunk 单独就超出预算时按句截断，保证上下文不为空
+    """
+    ids = list(dict.fromkeys(int(i) for i in ids))
+    texts = {i: get_text(i) for i in ids}
+    selected: List[int] = []
+    passages: List[str] = []
+    tokens = 0
+    for i in ids:
+        trial = _assemble(selected + [i], texts, spans)
+        trial_tokens = count_tokens("\n".join(trial))
+        if trial_tokens <= budget:
+            selected.append(i)
+            passages, tokens = trial, trial_tokens
+
+    if not selected and ids:
+        kept = []
+        for sentence in split_sentences(texts[ids[0]]):
+            if kept and count_tokens(" ".join(kept + [sentence])) > budget:
+                break
+            kept.append(sentence)
+        passages = [" ".join(kept)]
+        selected = [ids[0]]
+        tokens = count_tokens(passages[0])
+
+    naive_tokens = count_tokens("\n".join(texts[i] for i in selected)) if selected else 0
+    return PackedContext(passages, selected, tokens, naive_tokens)
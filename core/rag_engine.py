@@ -1,53 +1,455 @@
 from config import (
-    API_LLM_MODEL_NAME, LOCAL_LLM_MODEL_NAME, MAX_NEW_TOKENS, TOP_K,
-    USE_LOCAL_LLM, LLM_API_KEY, LLM_BASE_URL
+    API_LLM_MODEL_NAME, LOCAL_LLM_MODEL_NAME, TOP_K,
+    USE_LOCAL_LLM, LLM_API_KEY, LLM_BASE_URL, PREFIX_CACHE_ENABLED, LOCAL_LLM_BATCH_SIZE,
+    PROMPT_LOOKUP_TOKENS, PROMPT_LOOKUP_NGRAM,
+    CONTEXT_PACKING, CONTEXT_TOKEN_BUDGET, CONTEXT_TOP_K, GENERATION_PROFILES, DEFAULT_GENERATION_PROFILE
 )
+import os
 import re
+import threading
+import numpy as np
+from typing import Iterable, Iterator, List, Optional, Sequence, Tuple, Union
+from models.registry import registry
+from core.answer_cache import AnswerCache, normalize_question
+from core.context_packing import estimate_tokens, pack_context
+from core import tracing
 
-# 动态导入 LLM
-if USE_LOCAL_LLM:
-    LLM_MODEL_NAME = LOCAL_LLM_MODEL_NAME
-    from models.llm_local import QuantizedLLM  # 保留原本地模型为 llm_local.py
-    LLMClass = QuantizedLLM
-else:
-    LLM_MODEL_NAME = API_LLM_MODEL_NAME
+LLM_MODEL_NAME = LOCAL_LLM_MODEL_NAME if USE_LOCAL_LLM else API_LLM_MODEL_NAME
+
+# 所有 prompt 共同的开头；本地模型预先计算其 KV cache
+PROMPT_PREAMBLE = (
+    "你是一个专注于分析小说内容的智能助手。\n"
+    "请严格参考以下提供的小说片段回答问题，不要编造信息。\n"
+    "【相关小说片段】\n"
+)
+
+
+def load_llm():
+    """按配置创建 LLM；torch / transformers 到这时才导入，导入本模块本身很快"""
+    if USE_LOCAL_LLM:
+        from models.llm_local import QuantizedLLM  # 保留原本地模型为 llm_local.py
+        llm = QuantizedLLM(
+            LLM_MODEL_NAME, batch_size=LOCAL_LLM_BATCH_SIZE,
+            prompt_lookup_tokens=PROMPT_LOOKUP_TOKENS, prompt_lookup_ngram=PROMPT_LOOKUP_NGRAM
+        )
+        if PREFIX_CACHE_ENABLED:
+            llm.register_prefix(PROMPT_PREAMBLE)
+        return llm
     from models.llm_api import APILLM
-    LLMClass = lambda _: APILLM(LLM_API_KEY, LLM_BASE_URL, LLM_MODEL_NAME)
+    return APILLM(LLM_API_KEY, LLM_BASE_URL, LLM_MODEL_NAME)
+
+
+def llm_handle():
+    """进程内共享的 LLM 句柄，登记在模型注册表中，可与嵌入/重排模型并行预热"""
+    if USE_LOCAL_LLM:
+        return registry.handle("llm", LLM_MODEL_NAME, load_llm, dtype="nf4", backend="transformers")
+    return registry.handle("llm", LLM_MODEL_NAME, load_llm, device="remote", dtype="-", backend="api")
+
+# 模型续写出新的问答轮次时截断
+STOP_SEQUENCES = ("\n\n", "\n【问题】", "\n用户：")
+STOP_PATTERN = re.compile("|".join(re.escape(s) for s in STOP_SEQUENCES))
+
+
+class GenerationProfile:
+    """一种生成配置：回答的 token 上限，以及停止符（通用停止符加上配置中追加的）"""
+
+    __slots__ = ("name", "max_new_tokens", "stop", "pattern")
+
+    def __init__(self, name: str, max_new_tokens: int, stop: Sequence[str] = ()):
+        self.name = name
+        self.max_new_tokens = max_new_tokens
+        self.stop = tuple(dict.fromkeys(STOP_SEQUENCES + tuple(stop)))
+        self.pattern = re.compile("|".join(re.escape(s) for s in self.stop))
+
+
+PROFILES = {
+    name: GenerationProfile(name, profile["max_new_tokens"], profile.get("stop", ()))
+    for name, profile in GENERATION_PROFILES.items()
+}
+
+
+def generation_profile(name: Optional[str] = None) -> GenerationProfile:
+    """按名称取生成配置，name 为空时取默认配置；未知名称抛出 KeyError"""
+    return PROFILES[name or DEFAULT_GENERATION_PROFILE]
+
+
+def clean_answer(raw_answer: str, pattern: re.Pattern = STOP_PATTERN) -> str:
+    return pattern.split(raw_answer.strip())[0].strip()
+
+
+def stream_until_stop(pieces: Iterable[str], stop: Sequence[str] = STOP_SEQUENCES) -> Iterator[str]:
+    """
+    clean_answer 的增量版本：去掉开头空白，遇到停止符即结束并关闭上游生成。
+    可能构成停止符前缀的结尾字符和末尾空白会暂缓输出，直到能确定它们属于回答。
+    """
+    pattern = re.compile("|".join(re.escape(s) for s in stop))
+    hold = max(len(s) for s in stop) - 1
+    buffer = ""
+    started = False
+    try:
+        for piece in pieces:
+            buffer += piece
+            if not started:
+                buffer = buffer.lstrip()
+                if not buffer:
+                    continue
+                started = True
+            match = pattern.search(buffer)
+            if match:
+                tail = buffer[:match.start()].rstrip()
+                if tail:
+                    yield tail
+                return
+            ready = buffer[:max(0, len(buffer) - hold)].rstrip()
+            if ready:
+                yield ready
+                buffer = buffer[len(ready):]
+        tail = buffer.rstrip()
+        if tail:
+            yield tail
+    finally:
+        close = getattr(pieces, "close", None)
+        if close is not None:
+            close()
+
 
 class RAGEngine:
-    def __init__(self, novel_text: str, index_path: str = "novel_index"):
-        from retriever import get_retriever
-        from retriever.chunking import split_text
-        from config import CHUNK_SIZE, CHUNK_OVERLAP
+    def __init__(
+        self,
+        novel_text: Optional[str] = None,
+        index_path: str = "novel_index",
+        novel_path: Optional[str] = None,
+        llm=None
+    ):
+        from retriever import get_retriever, current_index_settings
+        from retriever.manifest import (
+            load_manifest, save_manifest, settings_match, source_unchanged,
+            source_stat, manifest_path_for, spans_path_for, index_version
+        )
+
+        if novel_text is None and novel_path is None:
+            raise ValueError("novel_text 和 novel_path 至少需要提供一个")
 
         self.retriever = get_retriever(index_path)
-        self.chunks = split_text(novel_text, CHUNK_SIZE, CHUNK_OVERLAP, show_progress=True)
+        self.spans_path = spans_path_for(index_path)
+
+        # 对比索引清单，判断是否需要（增量）重建
+        manifest_path = manifest_path_for(index_path)
+        settings = current_index_settings()
+        old_manifest = load_manifest(manifest_path)
+        index_ready = self.retriever.exists() and settings_match(old_manifest, settings)
+
+        if index_ready and source_unchanged(old_manifest, novel_path):
+            # 热启动：源文件大小与修改时间均未变，不读取也不切分小说
+            print(f"加载已有的索引...")
+            self.retriever.load_index()
+            manifest = old_manifest
+        else:
+            if novel_text is None:
+                with open(novel_path, "r", encoding="utf-8") as f:
+                    novel_text = f.read()
+            manifest = self._sync_index(novel_text, settings, old_manifest, index_ready)
+            if novel_path:
+                manifest.update(source_stat(novel_path))
+            save_manifest(manifest_path, manifest)
+
+        self.chunks = self.retriever.chunks
+        self.chunk_spans = self._load_spans(novel_text, novel_path, settings, len(self.chunks))
+        self._packing_stats = {"requests": 0, "chunks": 0, "passages": 0, "tokens": 0, "naive_tokens": 0}
+        self._stats_lock = threading.Lock()
+        self.index_version = index_version(manifest)
+        self.cache = self._init_cache(self.index_version)
+
+        # 动态初始化 LLM；多部小说共用一个进程时由调用方传入同一个实例
+        self.llm = llm if llm is not None else llm_handle().get()
+
+        print(f"共切分为 {manifest['num_chunks']} 个 chunk")
+        print(f"最长 chunk 长度: {manifest['max_chunk_len']}")
+
+    def _sync_index(self, novel_text: str, settings: dict, old_manifest, index_ready: bool) -> dict:
+        from tqdm import tqdm
+        from retriever.chunking import iter_chunks
+        from retriever.manifest import build_manifest, text_hash
 
-        if self.retriever.exists():
+        source_hash = text_hash(novel_text)
+        if index_ready and old_manifest.get("source_hash") == source_hash:
+            # 仅修改时间变化，内容未变
             print(f"加载已有的索引...")
             self.retriever.load_index()
+            return dict(old_manifest)
+
+        pieces = list(tqdm(
+            iter_chunks(novel_text, settings["chunk_size"], settings["chunk_overlap"]), desc="Splitting text"
+        ))
+        chunks = [c.text for c in pieces]
+        self._save_spans(np.array([(c.start, c.end) for c in pieces], dtype=np.int64).reshape(-1, 2))
+        manifest = build_manifest(source_hash, chunks, settings)
+
+        if index_ready and old_manifest.get("chunks_hash") == manifest["chunks_hash"]:
+            # 原文有改动但切分结果不变（如仅空白字符变化）
+            print(f"加载已有的索引...")
+            self.retriever.load_index()
+        elif self.retriever.exists():
+            print(f"检测到小说或配置变化，增量更新索引...")
+            # 清单缺失（旧版本索引）时默认嵌入模型未变
+            reuse_embeddings = old_manifest is None or (
+                old_manifest.get("embedding_model") == settings["embedding_model"]
+                and old_manifest.get("embedding_backend", "torch") == settings["embedding_backend"]
+            )
+            self.retriever.update_index(chunks, reuse_embeddings=reuse_embeddings)
         else:
             print(f"构建索引...")
-            self.retriever.build_index(self.chunks)
-        
-        # 动态初始化 LLM
-        self.llm = LLMClass(LLM_MODEL_NAME)
+            self.retriever.build_index(chunks)
+        return manifest
+
+    def _save_spans(self, spans: np.ndarray):
+        tmp_path = self.spans_path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            np.save(f, spans)
+        os.replace(tmp_path, self.spans_path)
+
+    def _load_spans(self, novel_text, novel_path, settings: dict, num_chunks: int) -> Optional[np.ndarray]:
+        """各 chunk 在原文中的 [start, end) 字符偏移，供上下文打包判断相邻/重叠；旧索引没有时重新切分一次补上"""
+        if os.path.exists(self.spans_path):
+            spans = np.load(self.spans_path)
+            if len(spans) == num_chunks:
+                return spans
+        if not CONTEXT_PACKING or (novel_text is None and not novel_path):
+            return None
+        from retriever.chunking import iter_chunks, iter_file_chunks
+
+        if novel_text is not None:
+            pieces = iter_chunks(novel_text, settings["chunk_size"], settings["chunk_overlap"])
+        else:
+            pieces = iter_file_chunks(novel_path, settings["chunk_size"], settings["chunk_overlap"])
+        spans = np.array([(c.start, c.end) for c in pieces], dtype=np.int64).reshape(-1, 2)
+        if len(spans) != num_chunks:
+            # 索引与当前原文不一致，退回按 chunk id 判断相邻
+            return None
+        self._save_spans(spans)
+        return spans
+
+    def _init_cache(self, version: str) -> Optional[AnswerCache]:
+        from config import (
+            ANSWER_CACHE_ENABLED, ANSWER_CACHE_SIZE, ANSWER_CACHE_TTL, SEMANTIC_CACHE_SIZE,
+            SEMANTIC_CACHE_THRESHOLD, RETRIEVAL_CACHE_SIZE, RETRIEVAL_CACHE_TTL, EMBEDDING_MODEL_NAME
+        )
+        if not ANSWER_CACHE_ENABLED:
+            return None
+        cache = AnswerCache(
+            ANSWER_CACHE_SIZE, ANSWER_CACHE_TTL, SEMANTIC_CACHE_SIZE, SEMANTIC_CACHE_THRESHOLD,
+            RETRIEVAL_CACHE_SIZE, RETRIEVAL_CACHE_TTL, version=version
+        )
+        if cache.semantic.enabled:
+            from models.embedding import EmbeddingModel
+            # 与 FAISS 检索器共用注册表中的嵌入模型
+            self.question_embedder = EmbeddingModel(EMBEDDING_MODEL_NAME)
+        return cache
+
+    def retrieve(self, question: str, key: Optional[str] = None, q_emb=None) -> List[str]:
+        """检索上下文，命中检索层缓存时跳过向量检索与重排"""
+        return self.retrieve_batch([question], [key or normalize_question(question)], [q_emb])[0]
+
+    def retrieve_batch(
+        self, questions: List[str], keys: Optional[List[str]] = None, q_embs: Optional[list] = None
+    ) -> List[List[str]]:
+        """
+        多个问题一起检索：未命中检索层缓存的问题合并为一次批量编码、检索与重排。
+        q_embs 为语义缓存查询时已算好的问题向量，全部齐备时向量检索不再重复编码
+        """
+        keys = keys or [normalize_question(q) for q in questions]
+        ids_list = [None] * len(questions)
+        if self.cache is not None:
+            for n, key in enumerate(keys):
+                ids_list[n] = self.cache.retrieval.get(key)
+                if ids_list[n] is not None:
+                    self.cache.count("retrieval_hits")
+
+        missing = [n for n, ids in enumerate(ids_list) if ids is None]
+        if missing:
+            top_k = CONTEXT_TOP_K if CONTEXT_PACKING else TOP_K
+            query_embeddings = None
+            if q_embs is not None and all(q_embs[n] is not None for n in missing):
+                query_embeddings = np.stack([q_embs[n] for n in missing])
+            with tracing.span("retrieval"):
+                found = self.retriever.retrieve_ids_batch(
+                    [questions[n] for n in missing], top_k=top_k, query_embeddings=query_embeddings
+                )
+            for n, ids in zip(missing, found):
+                ids_list[n] = ids
+                if self.cache is not None:
+                    self.cache.retrieval.put(keys[n], ids)
+        if not CONTEXT_PACKING:
+            return [[self.chunks[i] for i in ids] for ids in ids_list]
+        with tracing.span("packing"):
+            return [self.pack_context(ids) for ids in ids_list]
+
+    def count_tokens(self, text: str) -> int:
+        """本地 LLM 用其分词器计数；API 模式没有分词器，按字符估算"""
+        counter = getattr(self.llm, "count_tokens", None)
+        return counter(text) if counter is not None else estimate_tokens(text)
+
+    def pack_context(self, ids: List[int]) -> List[str]:
+        """把按相关性排序的 chunk 整理为按原文顺序、去重且不超过 token 预算的段落"""
+        packed = pack_context(ids, self.chunks.__getitem__, self.count_tokens, CONTEXT_TOKEN_BUDGET, self.chunk_spans)
+        with self._stats_lock:
+            stats = self._packing_stats
+            stats["requests"] += 1
+            stats["chunks"] += len(packed.chunk_ids)
+            stats["passages"] += len(packed.passages)
+            stats["tokens"] += packed.tokens
+            stats["naive_tokens"] += packed.naive_tokens
+        tracing.incr("rag_context_tokens_total", packed.tokens, kind="packed")
+        tracing.incr("rag_context_tokens_saved_total", packed.naive_tokens - packed.tokens)
+        return packed.passages
 
-        print(f"共切分为 {len(self.chunks)} 个 chunk")
-        print(f"最长 chunk 长度: {max(len(c) for c in self.chunks)}")
+    def packing_stats(self) -> dict:
+        """上下文打包统计：平均每次用到的 chunk 数、段落数、上下文 token 数，以及合并去重省下的 token"""
+        with self._stats_lock:
+            stats = dict(self._packing_stats)
+        requests = max(stats["requests"], 1)
+        saved = stats["naive_tokens"] - stats["tokens"]
+        return {
+            "requests": stats["requests"],
+            "avg_chunks": round(stats["chunks"] / requests, 2),
+            "avg_passages": round(stats["passages"] / requests, 2),
+            "avg_context_tokens": round(stats["tokens"] / requests, 1),
+            "tokens_saved": saved,
+            "saved_ratio": round(saved / stats["naive_tokens"], 4) if stats["naive_tokens"] else 0.0,
+        }
 
-    def answer(self, question: str) -> str:
-        context = self.retriever.retrieve(question, top_k=TOP_K)
+    @staticmethod
+    def _answer_key(key: str, profile: GenerationProfile):
+        # 不同生成配置的回答分开缓存；默认配置沿用原有的键
+        return key if profile.name == DEFAULT_GENERATION_PROFILE else (profile.name, key)
+
+    def _cache_lookup(self, question: str, key: str, profile: GenerationProfile):
+        """返回 (缓存的回答, 问题向量)；未命中时回答为 None，问题向量留给检索与写回语义层"""
+        cached, q_embs = self._cache_lookup_batch([question], [key], profile)
+        return cached[0], q_embs[0]
+
+    def _cache_lookup_batch(self, questions: List[str], keys: List[str], profile: GenerationProfile):
+        cached = [None] * len(keys)
+        q_embs = [None] * len(keys)
+        if self.cache is None:
+            return cached, q_embs
+
+        with tracing.span("cache_lookup"):
+            for n, key in enumerate(keys):
+                cached[n] = self.cache.exact.get(self._answer_key(key, profile))
+                if cached[n] is not None:
+                    self.cache.count("exact_hits")
+
+            missing = [n for n, c in enumerate(cached) if c is None]
+            # 语义层只存默认配置的回答
+            if missing and self.cache.semantic.enabled and profile.name == DEFAULT_GENERATION_PROFILE:
+                # 未命中精确层的问题一次编码；编码原问题（与向量检索相同的文本），未命中时向量直接交给检索复用
+                embeddings = self.question_embedder.encode([questions[n] for n in missing], convert_to_numpy=True)
+                for n, q_emb in zip(missing, embeddings):
+                    q_embs[n] = q_emb
+                    cached[n] = self.cache.semantic.get(q_emb)
+                    if cached[n] is not None:
+                        self.cache.count("semantic_hits")
+                        self.cache.exact.put(keys[n], cached[n])
+
+            for c in cached:
+                if c is None:
+                    self.cache.count("misses")
+        return cached, q_embs
+
+    def _cache_store(self, key: str, q_emb, result, profile: GenerationProfile):
+        if self.cache is None:
+            return
+        self.cache.exact.put(self._answer_key(key, profile), result)
+        if q_emb is not None:
+            self.cache.semantic.put(q_emb, result)
+
+    def build_prompt(self, question: str, context: List[str]) -> str:
         context_text = "\n".join(context)
-        prompt = (
-            "你是一个专注于分析小说内容的智能助手。\n"
-            "请严格参考以下提供的小说片段回答问题，不要编造信息。\n"
-            "【相关小说片段】\n"
+        return (
+            PROMPT_PREAMBLE +
             f"{context_text}\n\n"
             f"【问题】\n{question}\n\n"
             "【回答】\n"
         )
 
-        raw_answer = self.llm.generate(prompt, max_new_tokens=MAX_NEW_TOKENS)
-        clean_answer = re.split(r'\n\n|\n【问题】|\n用户：', raw_answer)[0].strip()
-        return clean_answer, context
\ No newline at end of file
+    def answer(self, question: str, profile: Optional[str] = None) -> Tuple[str, List[str]]:
+        """profile 为生成配置名（见 config.GENERATION_PROFILES），决定回答长度上限与停止符"""
+        profile = generation_profile(profile)
+        key = normalize_question(question)
+        cached, q_emb = self._cache_lookup(question, key, profile)
+        if cached is not None:
+            return cached
+
+        context = self.retrieve(question, key, q_emb)
+        with tracing.span("prompt"):
+            prompt = self.build_prompt(question, context)
+        with tracing.span("generation"):
+            raw_answer = self.llm.generate(prompt, max_new_tokens=profile.max_new_tokens, stop=profile.stop)
+        result = (clean_answer(raw_answer, profile.pattern), context)
+        self._cache_store(key, q_emb, result, profile)
+        return result
+
+    def answer_batch(
+        self, questions: List[str], profile: Optional[str] = None
+    ) -> List[Union[Tuple[str, List[str]], Exception]]:
+        """
+        多个问题一起回答：缓存查询、检索、重排与生成均按批进行，返回顺序与输入一致。
+        同一批内规范化后相同的问题只计算一次。某个问题生成失败时，该位置为异常对象，不影响其他问题
+        """
+        profile = generation_profile(profile)
+        keys = [normalize_question(q) for q in questions]
+        first = {}
+        for n, key in enumerate(keys):
+            first.setdefault(key, n)
+        unique = sorted(first.values())
+
+        cached, q_embs = self._cache_lookup_batch([questions[n] for n in unique], [keys[n] for n in unique], profile)
+        results = {keys[n]: c for n, c in zip(unique, cached) if c is not None}
+        todo = [(n, q_emb) for n, c, q_emb in zip(unique, cached, q_embs) if c is None]
+
+        if todo:
+            todo_questions = [questions[n] for n, _ in todo]
+            contexts = self.retrieve_batch(todo_questions, [keys[n] for n, _ in todo], [q_emb for _, q_emb in todo])
+            with tracing.span("prompt"):
+                prompts = [self.build_prompt(q, c) for q, c in zip(todo_questions, contexts)]
+            with tracing.span("generation"):
+                raw_answers = self.llm.generate_batch(
+                    prompts, max_new_tokens=profile.max_new_tokens, stop=profile.stop, return_exceptions=True
+                )
+            for (n, q_emb), context, raw_answer in zip(todo, contexts, raw_answers):
+                if isinstance(raw_answer, Exception):
+                    results[keys[n]] = raw_answer  # 失败的回答不写入缓存
+                    continue
+                result = (clean_answer(raw_answer, profile.pattern), context)
+                self._cache_store(keys[n], q_emb, result, profile)
+                results[keys[n]] = result
+        return [results[key] for key in keys]
+
+    def answer_stream(self, question: str, profile: Optional[str] = None) -> Tuple[List[str], Iterator[str]]:
+        """
+        流式回答：先完成检索，返回 (上下文, 回答片段迭代器)。
+        片段在遇到停止符时截断，拼接结果与 answer() 的回答一致；完整读完后写入缓存。
+        """
+        profile = generation_profile(profile)
+        key = normalize_question(question)
+        cached, q_emb = self._cache_lookup(question, key, profile)
+        if cached is not None:
+            answer, context = cached
+            return context, iter([answer] if answer else [])
+
+        context = self.retrieve(question, key, q_emb)
+        with tracing.span("prompt"):
+            prompt = self.build_prompt(question, context)
+        pieces = stream_until_stop(
+            self.llm.generate_stream(prompt, max_new_tokens=profile.max_new_tokens, stop=profile.stop), profile.stop
+        )
+
+        def record():
+            parts = []
+            for piece in pieces:
+                parts.append(piece)
+                yield piece
+            self._cache_store(key, q_emb, ("".join(parts), context), profile)
+
+        return context, record()
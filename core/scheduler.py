@@ -0,0 +1,122 @@
+"""
+Web 请求微批调度器：在很短的时间窗口内收集并发请求，合并为一次 RAGEngine.answer_batch
+（批量编码、多行 FAISS 检索、一次重排 predict、一次填充后的批量生成），再把结果分发回各请求。
+多部小说共用一个调度器时，请求携带各自的引擎，同一批内按引擎与生成配置分组处理。
+"""
+import queue
+import time
+import threading
+from collections import Counter
+from concurrent.futures import Future
+from typing import Dict, List, Optional, Tuple
+from core import tracing
+
+
+class MicroBatchScheduler:
+    def __init__(self, engine=None, window_ms: float = 20, max_batch_size: int = 8):
+        self.engine = engine
+        self.window = window_ms / 1000
+        self.max_batch_size = max(1, max_batch_size)
+        self._queue: "queue.Queue[Optional[Tuple[str, Future, float, object, Optional[str]]]]" = queue.Queue()
+        self._lock = threading.Lock()
+        self._batch_sizes = Counter()
+        self._max_queue_depth = 0
+        self._wait_seconds = 0.0
+        self._closed = False
+        self._worker = threading.Thread(target=self._run, name="rag-batcher", daemon=True)
+        self._worker.start()
+
+    def submit(self, question: str, engine=None, profile: Optional[str] = None) -> Future:
+        """engine 为空时使用构造时传入的默认引擎；profile 为生成配置名，空表示默认配置"""
+        if self._closed:
+            raise RuntimeError("调度器已关闭")
+        engine = engine or self.engine
+        if engine is None:
+            raise ValueError("未指定 RAG 引擎")
+        future = Future()
+        self._queue.put((question, future, time.monotonic(), engine, profile))
+        with self._lock:
+            self._max_queue_depth = max(self._max_queue_depth, self._queue.qsize())
+        return future
+
+    def answer(self, question: str, timeout: Optional[float] = None, engine=None, profile: Optional[str] = None):
+        """与 RAGEngine.answer 相同的返回值，阻塞直到所在批次完成"""
+        return self.submit(question, engine, profile).result(timeout)
+
+    def close(self):
+        self._closed = True
+        self._queue.put(None)
+        self._worker.join()
+
+    def _collect(self) -> Optional[List[tuple]]:
+        # 阻塞等待第一个请求，之后最多再等一个窗口或攒满一批
+        first = self._queue.get()
+        if first is None:
+            return None
+        batch = [first]
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is None:
+                self._queue.put(None)  # 处理完本批后再退出
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            if batch is None:
+                return
+            start = time.monotonic()
+            with self._lock:
+                self._batch_sizes[len(batch)] += 1
+                self._wait_seconds += sum(start - item[2] for item in batch)
+            tracing.incr("rag_batches_total")
+            tracing.incr("rag_batched_requests_total", len(batch))
+
+            groups: Dict[tuple, list] = {}
+            for item in batch:
+                groups.setdefault((id(item[3]), item[4]), []).append(item)
+            for group in groups.values():
+                self._run_group(group, start)
+
+    def _run_group(self, group: List[tuple], start: float):
+        engine, profile = group[0][3], group[0][4]
+        questions = [item[0] for item in group]
+        try:
+            with tracing.collect() as trace:
+                results = engine.answer_batch(questions, profile)
+        except Exception as e:
+            for item in group:
+                item[1].set_exception(e)
+            return
+        for (_, future, submitted, _, _), result in zip(group, results):
+            # 同一批请求共享各阶段耗时，另外记录各自的排队时间
+            future.timing = dict(trace, queue_wait=start - submitted, batch_size=len(group))
+            if isinstance(result, Exception):
+                # 只有生成失败的请求报错，同批其他请求照常返回
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    def stats(self) -> dict:
+        with self._lock:
+            sizes = dict(sorted(self._batch_sizes.items()))
+            requests = sum(size * count for size, count in sizes.items())
+            batches = sum(sizes.values())
+            return {
+                "queue_depth": self._queue.qsize(),
+                "max_queue_depth": self._max_queue_depth,
+                "requests": requests,
+                "batches": batches,
+                "mean_batch_size": requests / batches if batches else 0.0,
+                "batch_size_histogram": sizes,
+                "mean_queue_wait_ms": 1000 * self._wait_seconds / requests if requests else 0.0,
+            }
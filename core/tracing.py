@@ -0,0 +1,157 @@
+"""
+轻量级流水线埋点：
+- span(name)：记录一个阶段的耗时，进入进程级直方图；在 collect() 内还会累加到本次请求的耗时明细
+- incr(name, value, **labels)：累加计数器（缓存命中、候选数、token 数等）
+- set_gauge(name, value)：瞬时值（队列深度等）
+- render_prometheus()：导出为 Prometheus 文本格式
+
+关闭时 span() 返回共享的空上下文，incr() 直接返回，开销只有一次函数调用与布尔判断。
+"""
+import time
+import threading
+import contextvars
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional, Tuple
+
+from config import TRACING_ENABLED
+
+# 阶段耗时直方图的桶上界（秒）
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_enabled = TRACING_ENABLED
+_lock = threading.Lock()
+_histograms: Dict[str, list] = {}  # 阶段 -> [各桶计数..., 总和, 次数]
+_counters: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], float] = {}
+_gauges: Dict[str, float] = {}
+_current_trace: "contextvars.ContextVar[Optional[Dict[str, float]]]" = contextvars.ContextVar(
+    "rag_trace", default=None
+)
+
+
+def enabled() -> bool:
+    return _enabled
+
+
+def set_enabled(flag: bool):
+    global _enabled
+    _enabled = flag
+
+
+def _observe(stage: str, seconds: float):
+    with _lock:
+        hist = _histograms.get(stage)
+        if hist is None:
+            hist = _histograms[stage] = [0] * (len(BUCKETS) + 2)
+        for n, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                hist[n] += 1
+        hist[-2] += seconds
+        hist[-1] += 1
+    trace = _current_trace.get()
+    if trace is not None:
+        trace[stage] = trace.get(stage, 0.0) + seconds
+
+
+class _Span:
+    __slots__ = ("stage", "start")
+
+    def __init__(self, stage: str):
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        _observe(self.stage, time.perf_counter() - self.start)
+        return False
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NOOP = _NoopSpan()
+
+
+def span(stage: str):
+    return _Span(stage) if _enabled else _NOOP
+
+
+def incr(name: str, value: float = 1, **labels):
+    if not _enabled:
+        return
+    key = (name, tuple(sorted((k, str(v)) for k, v in labels.items())))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def set_gauge(name: str, value: float):
+    if not _enabled:
+        return
+    with _lock:
+        _gauges[name] = value
+
+
+@contextmanager
+def collect() -> Iterator[Dict[str, float]]:
+    """收集本上下文内各阶段耗时（秒），用于单次请求的耗时明细"""
+    trace: Dict[str, float] = {}
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _current_trace.reset(token)
+
+
+def run_in_context(pool, fn, *args):
+    """向线程池提交任务并携带当前上下文，使子线程中的 span 也计入本次请求"""
+    return pool.submit(contextvars.copy_context().run, fn, *args)
+
+
+def reset():
+    with _lock:
+        _histograms.clear()
+        _counters.clear()
+        _gauges.clear()
+
+
+def _labels(pairs) -> str:
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}"
+
+
+def render_prometheus() -> str:
+    with _lock:
+        histograms = {k: list(v) for k, v in _histograms.items()}
+        counters = dict(_counters)
+        gauges = dict(_gauges)
+
+    lines = []
+    if histograms:
+        lines += ["# HELP rag_stage_seconds RAG 流水线各阶段耗时", "# TYPE rag_stage_seconds histogram"]
+        for stage, hist in sorted(histograms.items()):
+            for bound, count in zip(BUCKETS, hist):
+                lines.append(f'rag_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {count}')
+            lines.append(f'rag_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {hist[-1]}')
+            lines.append(f'rag_stage_seconds_sum{{stage="{stage}"}} {hist[-2]}')
+            lines.append(f'rag_stage_seconds_count{{stage="{stage}"}} {hist[-1]}')
+
+    declared = set()
+    for (name, labels), value in sorted(counters.items()):
+        if name not in declared:
+            lines.append(f"# TYPE {name} counter")
+            declared.add(name)
+        lines.append(f"{name}{_labels(labels)} {value}")
+
+    for name, value in sorted(gauges.items()):
+        lines.append(f"# TYPE {name} gauge")
+        lines.append(f"{name} {value}")
+    return "\n".join(lines) + "\n"
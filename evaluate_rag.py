@@ -1,10 +1,23 @@
 import os
 import json
 import re
+import time
+import asyncio
+import hashlib
+import argparse
+import numpy as np
 
 from tqdm import tqdm
-from config import NOVEL_PATH, QUESTIONS_FILE
-from core.rag_engine import RAGEngine
+from concurrent.futures import ThreadPoolExecutor
+from config import (
+    NOVEL_PATH, QUESTIONS_FILE, TOP_K, USE_RERANK, RERANK_MODEL_NAME, RETRIEVER_TYPE,
+    API_MAX_CONCURRENCY, GENERATION_PROFILES, CONTEXT_PACKING, CONTEXT_TOKEN_BUDGET, CONTEXT_TOP_K,
+    EMBEDDING_MODEL_NAME, EMBEDDING_BACKEND, RERANK_BACKEND, FAISS_INDEX_TYPE, HNSW_EF_SEARCH, IVF_NPROBE,
+    HYBRID_FUSION, HYBRID_WEIGHTS, RRF_K, RERANK_SKIP_MARGIN, RERANK_SHRINK_MARGIN, RERANK_SHRINK_FACTOR,
+    USE_LOCAL_LLM, LOCAL_LLM_BATCH_SIZE, PREFIX_CACHE_ENABLED, PROMPT_LOOKUP_TOKENS, PROMPT_LOOKUP_NGRAM
+)
+from core.rag_engine import RAGEngine, LLM_MODEL_NAME, clean_answer, generation_profile
+from models.registry import registry
 
 
 def extract_option_letter(answer_text):
@@ -26,73 +39,226 @@ def extract_option_letter(answer_text):
         return match2.group(1)
     return None
 
-def load_questions():
-    with open(QUESTIONS_FILE, "r", encoding="utf-8") as f:
+def load_questions(path=QUESTIONS_FILE):
+    with open(path, "r", encoding="utf-8") as f:
         return json.load(f)
 
+def build_question(q):
+    options = "\n".join(q["options"])
+    return f"{q['question']}\n{options}\n请直接回答选项字母（A/B/C/D）。"
+
+def config_fingerprint(engine, questions_file, profile):
+    """索引、检索与生成配置的指纹：凡是可能改变回答的设置都计入，配置不同的评估写入不同的断点文件"""
+    settings = {
+        "index_version": engine.index_version,
+        "retriever_type": RETRIEVER_TYPE,
+        "top_k": TOP_K,
+        "embedding": (EMBEDDING_MODEL_NAME, EMBEDDING_BACKEND) if RETRIEVER_TYPE != "bm25" else None,
+        "faiss_search": (FAISS_INDEX_TYPE, HNSW_EF_SEARCH, IVF_NPROBE) if RETRIEVER_TYPE != "bm25" else None,
+        "hybrid": (HYBRID_FUSION, list(HYBRID_WEIGHTS), RRF_K) if RETRIEVER_TYPE == "hybrid" else None,
+        "use_rerank": USE_RERANK,
+        "rerank_model": (RERANK_MODEL_NAME, RERANK_BACKEND) if USE_RERANK else None,
+        "rerank_cascade": (
+            (RERANK_SKIP_MARGIN, RERANK_SHRINK_MARGIN, RERANK_SHRINK_FACTOR) if USE_RERANK else None
+        ),
+        "context_packing": (CONTEXT_TOKEN_BUDGET, CONTEXT_TOP_K) if CONTEXT_PACKING else None,
+        "llm": LLM_MODEL_NAME,
+        "local_llm": (
+            (LOCAL_LLM_BATCH_SIZE, PREFIX_CACHE_ENABLED, PROMPT_LOOKUP_TOKENS, PROMPT_LOOKUP_NGRAM)
+            if USE_LOCAL_LLM else None
+        ),
+        "max_new_tokens": profile.max_new_tokens,
+        "stop": profile.stop,
+        "questions": os.path.abspath(questions_file),
+    }
+    return hashlib.sha1(json.dumps(settings, sort_keys=True).encode("utf-8")).hexdigest()[:12]
+
+def load_checkpoint(path):
+    """读取 JSONL 断点，返回 题号 -> 结果；最后一行写到一半时忽略，调用失败的记录（旧版断点会写入）丢弃以便重试"""
+    done = {}
+    if not os.path.exists(path):
+        return done
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if record.get("error"):
+                done.pop(record["id"], None)
+                continue
+            done[record["id"]] = record
+    return done
+
+def generate_all(llm, prompts, concurrency, profile):
+    """
+    生成一批回答，返回 [(原始回答, 错误信息, 耗时秒)]，顺序与输入一致。
+    API 模式用 asyncio 并发请求，本地模式一次批量生成（耗时按批均摊）。
+    回答长度上限与停止符取自生成配置 profile。
+    """
+    max_new_tokens, stop = profile.max_new_tokens, profile.stop
+    if hasattr(llm, "agenerate"):
+        async def one(prompt, semaphore):
+            async with semaphore:
+                start = time.perf_counter()
+                result = await llm.agenerate(prompt, max_new_tokens=max_new_tokens, stop=stop)
+                error = None if result.ok else str(result.error)
+                return result.text, error, time.perf_counter() - start
+
+        async def run():
+            semaphore = asyncio.Semaphore(concurrency)
+            return await asyncio.gather(*(one(p, semaphore) for p in prompts))
+        return asyncio.run(run())
+
+    start = time.perf_counter()
+    if hasattr(llm, "generate_batch"):
+        # 出错的桶只影响其中的题目，各题带上各自的错误
+        raw_answers = llm.generate_batch(prompts, max_new_tokens=max_new_tokens, stop=stop, return_exceptions=True)
+        seconds = (time.perf_counter() - start) / len(prompts)
+        return [
+            ("", str(raw), seconds) if isinstance(raw, Exception) else (raw, None, seconds) for raw in raw_answers
+        ]
+
+    def one(prompt):
+        begin = time.perf_counter()
+        try:
+            return llm.generate(prompt, max_new_tokens=max_new_tokens, stop=stop), None, time.perf_counter() - begin
+        except Exception as e:
+            return "", str(e), time.perf_counter() - begin
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        return list(pool.map(one, prompts))
+
+def percentiles(values):
+    if not values:
+        return "无数据"
+    p50, p90, p99 = np.percentile(values, [50, 90, 99])
+    return f"均值 {np.mean(values):.3f}s | p50 {p50:.3f}s | p90 {p90:.3f}s | p99 {p99:.3f}s"
+
 def main():
+    parser = argparse.ArgumentParser(description="RAG 选择题评估（批量检索、并发生成、断点续跑）")
+    parser.add_argument("--questions", default=QUESTIONS_FILE)
+    parser.add_argument("--batch-size", type=int, default=16, help="每批检索与生成的题目数")
+    parser.add_argument("--concurrency", type=int, default=API_MAX_CONCURRENCY, help="API 模式并发请求数")
+    parser.add_argument("--checkpoint", default=None, help="JSONL 断点文件，默认按配置指纹命名")
+    parser.add_argument("--fresh", action="store_true", help="忽略已有断点，重新评估")
+    parser.add_argument(
+        "--profile", default="choice", choices=sorted(GENERATION_PROFILES),
+        help="生成配置：选择题只需几个 token（choice），free 为完整回答长度"
+    )
+    args = parser.parse_args()
+    profile = generation_profile(args.profile)
+
     # 检查小说文件
     if not os.path.exists(NOVEL_PATH):
         print(f"❌ 小说文件未找到！请将《三体》全文保存为：{NOVEL_PATH}")
         return
 
-    # 加载小说
-    with open(NOVEL_PATH, "r", encoding="utf-8") as f:
-        novel_text = f.read()
-
     # 初始化引擎
     print("🔧 正在加载 RAG 引擎...")
-    engine = RAGEngine(novel_text)
-    print("✅ RAG 引擎加载完成。\n")
+    engine = RAGEngine(novel_path=NOVEL_PATH)
+    registry.load_all()  # 先加载惰性的嵌入/重排模型，第一批题目的耗时不含模型加载
+    print(f"✅ RAG 引擎加载完成。模型加载情况：\n{registry.format_memory_report()}\n")
 
-    # 加载问题
-    questions = load_questions()
+    # 加载问题与断点
+    questions = load_questions(args.questions)
     total = len(questions)
-    correct = 0
-    results = []
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+    checkpoint = args.checkpoint or os.path.join(
+        base_dir, f"evaluation_checkpoint.{config_fingerprint(engine, args.questions, profile)}.jsonl"
+    )
+    if args.fresh and os.path.exists(checkpoint):
+        os.remove(checkpoint)
+    done = load_checkpoint(checkpoint)
+    todo = [(i, q) for i, q in enumerate(questions, 1) if i not in done]
+    if done:
+        print(f"♻️ 从断点恢复：已完成 {len(done)} 题，剩余 {len(todo)} 题（{checkpoint}）")
 
-    print(f"📊 开始评估 {total} 道选择题...\n")
+    print(f"📊 开始评估 {total} 道选择题（生成配置 {profile.name}，最多 {profile.max_new_tokens} 个 token）...\n")
+    wall_start = time.perf_counter()
 
-    for i, q in enumerate(tqdm(questions, desc="处理题目", unit="题"), 1):
-        question = q["question"]
-        options = "\n".join(q["options"])
-        full_prompt = f"{question}\n{options}\n请直接回答选项字母（A/B/C/D）。"
+    with open(checkpoint, "a", encoding="utf-8") as ckpt, tqdm(total=len(todo), desc="处理题目", unit="题") as bar:
+        for b in range(0, len(todo), args.batch_size):
+            batch = todo[b:b + args.batch_size]
+            full_prompts = [build_question(q) for _, q in batch]
 
-        model_answer, contexts = engine.answer(full_prompt)
-        pred = extract_option_letter(model_answer)
-        gold = q["answer"].strip().upper()
+            # 整批检索：一次编码、一次多行检索、一次重排
+            start = time.perf_counter()
+            contexts = engine.retrieve_batch(full_prompts)
+            retrieval_seconds = (time.perf_counter() - start) / len(batch)
 
-        is_correct = (pred == gold)
-        if is_correct:
-            correct += 1
+            llm_prompts = [engine.build_prompt(p, c) for p, c in zip(full_prompts, contexts)]
+            prompt_tokens = [engine.count_tokens(p) for p in llm_prompts]
+            generations = generate_all(engine.llm, llm_prompts, args.concurrency, profile)
 
-        results.append({
-            "id": i,
-            "question": question,
-            "options": " ".join(q["options"]),
-            "gold": gold,
-            "predicted": pred,
-            "model_output": model_answer,
-            "correct": is_correct,
-            "contexts": contexts
-        })
+            for (i, q), context, tokens, (raw_answer, error, gen_seconds) in zip(
+                batch, contexts, prompt_tokens, generations
+            ):
+                # 调用失败（如 API 重试耗尽）单独统计，不把错误信息当作回答评分
+                model_answer = clean_answer(raw_answer, profile.pattern) if error is None else ""
+                pred = extract_option_letter(model_answer)
+                gold = q["answer"].strip().upper()
+                record = {
+                    "id": i,
+                    "question": q["question"],
+                    "options": " ".join(q["options"]),
+                    "gold": gold,
+                    "predicted": pred,
+                    "model_output": model_answer,
+                    "correct": pred == gold,
+                    "contexts": context,
+                    "prompt_tokens": tokens,
+                    "error": error,
+                    "latency": {
+                        "retrieval": retrieval_seconds,
+                        "generation": gen_seconds,
+                        "total": retrieval_seconds + gen_seconds,
+                    },
+                }
+                # 调用失败的题目不写入断点，下次运行时重试；本次仍计入统计
+                if error is None:
+                    ckpt.write(json.dumps(record, ensure_ascii=False) + "\n")
+                done[i] = record
 
-        status = "✅" if is_correct else "❌"
-        tqdm.write(f"{status} 第 {i} 题 | 预测: {pred} | 真实: {gold}")
+                status = "✅" if record["correct"] else ("⚠️" if error else "❌")
+                tqdm.write(f"{status} 第 {i} 题 | 预测: {pred} | 真实: {gold}" + (f" | 出错: {error}" if error else ""))
+            ckpt.flush()
+            bar.update(len(batch))
 
-    print(f"\n准确率: {correct}/{total} ({100 * correct / total:.2f}%)")
+    wall_seconds = time.perf_counter() - wall_start
+    results = [done[i] for i in sorted(done)]
+    correct = sum(r["correct"] for r in results)
+    errors = sum(1 for r in results if r.get("error"))
 
     # 输出总结
     accuracy = correct / total * 100
     print("\n" + "="*60)
     print(f"🎯 总体准确率: {correct}/{total} = {accuracy:.2f}%")
+    if errors:
+        print(f"⚠️ 调用失败: {errors} 题（本次计为错误，未写入断点，重新运行即重试）")
+    print(f"⏱️ 本次耗时: {wall_seconds:.1f}s（评估 {len(todo)} 题，{len(todo) / max(wall_seconds, 1e-9):.2f} 题/s）")
+    for stage, name in (("retrieval", "检索(按批均摊)"), ("generation", "生成"), ("total", "单题合计")):
+        print(f"   {name}: {percentiles([r['latency'][stage] for r in results if 'latency' in r])}")
+    prompt_tokens = [r["prompt_tokens"] for r in results if "prompt_tokens" in r]
+    if prompt_tokens:
+        print(f"🧾 Prompt token 数: 平均 {sum(prompt_tokens) / len(prompt_tokens):.0f}，最多 {max(prompt_tokens)}")
     print("="*60)
+    usage = getattr(engine.llm, "usage", None)
+    if usage is not None:
+        print(f"🔢 API 用量: {usage()}")
+
+    reranker = getattr(engine.retriever, "reranker", None)
+    if reranker is not None:
+        print(f"🔁 重排统计: {reranker.stats()}")
+    if CONTEXT_PACKING:
+        print(f"📦 上下文打包统计（本次运行）: {engine.packing_stats()}")
+    if engine.cache is not None:
+        print(f"🗃️ 问答缓存统计: {engine.cache.stats()}")
 
-    # 可选：保存详细结果
-    output_file = os.path.join(os.path.dirname(__file__), "evaluation_results.json")
+    # 保存详细结果
+    output_file = os.path.join(base_dir, "evaluation_results.json")
     with open(output_file, "w", encoding="utf-8") as f:
         json.dump(results, f, ensure_ascii=False, indent=2)
     print(f"📝 详细结果已保存至: {output_file}")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,82 @@
+"""
+嵌入模型 / 重排模型的 CPU 推理后端：
+- torch:      PyTorch fp32（原有行为）
+- torch_int8: PyTorch 动态 int8 量化（只量化 Linear 层，无需校准数据）
+- onnx:       导出为 ONNX 图，由 ONNX Runtime 执行（需要 optimum[onnxruntime]，
+              且 sentence-transformers 嵌入模型 ≥ 3.2、重排模型 ≥ 4.1）
+"""
+from typing import Optional
+from config import CPU_NUM_THREADS
+
+BACKENDS = ("torch", "torch_int8", "onnx")
+# sentence-transformers 从这些版本起才支持 backend 参数
+ONNX_MIN_VERSION = {"SentenceTransformer": (3, 2), "CrossEncoder": (4, 1)}
+
+
+def check_backend(backend: str):
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown inference backend: {backend}（可选：{', '.join(BACKENDS)}）")
+
+
+def _set_torch_threads():
+    if CPU_NUM_THREADS:
+        import torch
+        torch.set_num_threads(CPU_NUM_THREADS)
+
+
+def _check_onnx_support(cls_name: str):
+    import sentence_transformers
+
+    version = sentence_transformers.__version__
+    parts = tuple(int(p) for p in version.split(".")[:2] if p.isdigit())
+    required = ONNX_MIN_VERSION[cls_name]
+    if parts < required:
+        raise RuntimeError(
+            f"{cls_name} 的 onnx 后端需要 sentence-transformers>={required[0]}.{required[1]}，"
+            f"当前为 {version}；请升级，或改用 torch / torch_int8 后端"
+        )
+
+
+def _onnx_model_kwargs() -> dict:
+    kwargs = {"provider": "CPUExecutionProvider"}
+    if CPU_NUM_THREADS:
+        import onnxruntime
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = CPU_NUM_THREADS
+        kwargs["session_options"] = options
+    return kwargs
+
+
+def _quantize_int8(module):
+    import torch
+    # 动态量化：权重离线转 int8，激活在推理时按 batch 量化
+    return torch.quantization.quantize_dynamic(module, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+
+
+def load_sentence_transformer(model_name: str, device: Optional[str] = "cpu", backend: str = "torch"):
+    from sentence_transformers import SentenceTransformer
+
+    check_backend(backend)
+    if backend == "onnx":
+        _check_onnx_support("SentenceTransformer")
+        return SentenceTransformer(model_name, device="cpu", backend="onnx", model_kwargs=_onnx_model_kwargs())
+    _set_torch_threads()
+    if backend == "torch_int8":
+        # 量化内核只支持 CPU
+        return _quantize_int8(SentenceTransformer(model_name, device="cpu"))
+    return SentenceTransformer(model_name, device=device)
+
+
+def load_cross_encoder(model_name: str, device: Optional[str] = None, backend: str = "torch"):
+    from sentence_transformers import CrossEncoder
+
+    check_backend(backend)
+    if backend == "onnx":
+        _check_onnx_support("CrossEncoder")
+        return CrossEncoder(model_name, device="cpu", backend="onnx", model_kwargs=_onnx_model_kwargs())
+    _set_torch_threads()
+    if backend == "torch_int8":
+        model = CrossEncoder(model_name, device="cpu")
+        model.model = _quantize_int8(model.model)
+        return model
+    return CrossEncoder(model_name, device=device)
@@ -1,9 +1,15 @@
-from sentence_transformers import SentenceTransformer
+from typing import Optional
+from config import EMBEDDING_BACKEND
+from models.registry import get_embedder
 
 class EmbeddingModel:
-    def __init__(self, model_name: str):
-        # 强制使用 CPU 避免与 LLM 抢显存
-        self.model = SentenceTransformer(model_name, device="cpu")
+    def __init__(self, model_name: str, backend: Optional[str] = None):
+        # 强制使用 CPU 避免与 LLM 抢显存；模型由注册表共享，首次 encode 时才加载
+        self.handle = get_embedder(model_name, device="cpu", backend=backend or EMBEDDING_BACKEND)
+
+    @property
+    def model(self):
+        return self.handle.get()
 
     def encode(self, texts, **kwargs):
-        return self.model.encode(texts, **kwargs)
\ No newline at end of file
+        return self.model.encode(texts, **kwargs)
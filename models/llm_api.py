@@ -1,10 +1,58 @@
 import os
-import requests
+import time
 import json
-from typing import Dict, Any, List, Union
+import random
+import asyncio
+import functools
+import threading
+import weakref
+import requests
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, Iterator, List, Optional, Sequence, Tuple, Union
+from core import tracing
+from config import (
+    API_CONNECT_TIMEOUT, API_READ_TIMEOUT, API_MAX_RETRIES, API_BACKOFF_BASE, API_BACKOFF_MAX,
+    API_MAX_CONCURRENCY
+)
+
+# 限流与服务端临时错误可以重试，其余 4xx 直接失败
+RETRY_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+
+class APILLMError(Exception):
+    def __init__(self, message: str, status: Optional[int] = None, body: str = ""):
+        super().__init__(message)
+        self.status = status
+        self.body = body
+
+
+class GenerationResult:
+    """一次 API 调用的结构化结果：成功时 error 为 None，失败时 text 为空"""
+
+    def __init__(self, text: str = "", usage: Optional[Dict[str, int]] = None, error: Optional[APILLMError] = None):
+        self.text = text
+        self.usage = usage or {}
+        self.error = error
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+    def __repr__(self):
+        return f"GenerationResult(text={self.text!r}, usage={self.usage}, error={self.error!r})"
+
 
 class APILLM:
-    def __init__(self, api_key: str, base_url: str, model_name: str):
+    def __init__(
+        self,
+        api_key: str,
+        base_url: str,
+        model_name: str,
+        timeout: Optional[Tuple[float, float]] = None,
+        max_retries: Optional[int] = None,
+        max_concurrency: Optional[int] = None
+    ):
         """
         支持 OpenAI 兼容的多模态 API（包括火山方舟 vision 模型）
         """
@@ -15,44 +63,212 @@ class APILLM:
             "Authorization": f"Bearer {self.api_key}",
             "Content-Type": "application/json"
         }
+        self.timeout = timeout or (API_CONNECT_TIMEOUT, API_READ_TIMEOUT)  # (连接, 读取) 秒
+        self.max_retries = API_MAX_RETRIES if max_retries is None else max_retries
+        self.max_concurrency = max_concurrency or API_MAX_CONCURRENCY
 
-    def generate(
-        self,
-        messages: Union[str, List[Dict[str, Any]]],
-        max_new_tokens: int = 150,
-        temperature: float = 0.0
-    ) -> str:
-        """
-        支持两种输入：
-        - 纯文本：传入字符串 prompt
-        - 多模态：传入 OpenAI 格式的 messages 列表（含 image_url）
-        """
+        # 复用 keep-alive 连接，避免每次请求重新握手 TCP + TLS
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.max_concurrency)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        self._usage = {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0, "requests": 0}
+        self._usage_lock = threading.Lock()
+        self._semaphores: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]" = (
+            weakref.WeakKeyDictionary()
+        )
+
+    def _payload(
+        self, messages, max_new_tokens: int, temperature: float, stream: bool, stop: Optional[Sequence[str]] = None
+    ) -> dict:
         if isinstance(messages, str):
             payload_messages = [{"role": "user", "content": messages}]
         else:
             payload_messages = messages
-
         payload = {
             "model": self.model_name,
             "messages": payload_messages,
             "max_tokens": max_new_tokens,
             "temperature": temperature,
-            "stream": False
+            "stream": stream
         }
+        # 服务端遇到停止符即结束生成，返回的文本不含停止符。服务端不会跳过回答开头的空白，
+        # 以空白开头的停止符（如 "\n\n"）可能在回答开头就命中而返回空文本，这类停止符不下发，
+        # 由调用方的 clean_answer / stream_until_stop 去掉开头空白后再截断
+        server_stop = [s for s in (stop or ()) if s and not s[0].isspace()]
+        if server_stop:
+            payload["stop"] = server_stop
+        if stream:
+            # 让流式响应在最后一个事件中附带 token 用量
+            payload["stream_options"] = {"include_usage": True}
+        return payload
+
+    def _backoff(self, attempt: int, retry_after: Optional[str] = None) -> float:
+        if retry_after:
+            try:
+                return min(float(retry_after), API_BACKOFF_MAX)
+            except ValueError:
+                pass
+        # 指数退避 + 随机抖动，避免并发请求同时重试
+        return min(API_BACKOFF_MAX, API_BACKOFF_BASE * 2 ** attempt) * random.uniform(0.5, 1.5)
+
+    def _post(self, payload: dict, stream: bool = False) -> requests.Response:
+        """发送请求，连接错误、超时、429 与 5xx 按退避策略重试；最终失败抛出 APILLMError"""
+        url = f"{self.base_url}/chat/completions"
+        for attempt in range(self.max_retries + 1):
+            last = attempt == self.max_retries
+            try:
+                response = self.session.post(
+                    url, headers=self.headers, json=payload, timeout=self.timeout, stream=stream
+                )
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if last:
+                    raise APILLMError(f"API 请求失败: {e}") from e
+                time.sleep(self._backoff(attempt))
+                continue
+
+            if response.status_code < 400:
+                return response
+            body = response.text
+            response.close()
+            if response.status_code not in RETRY_STATUS or last:
+                raise APILLMError(f"API 返回错误状态 {response.status_code}", response.status_code, body)
+            time.sleep(self._backoff(attempt, response.headers.get("Retry-After")))
 
+    def _record_usage(self, usage: Optional[dict]) -> Dict[str, int]:
+        usage = {k: int(usage.get(k, 0)) for k in ("prompt_tokens", "completion_tokens", "total_tokens")} if usage else {}
+        with self._usage_lock:
+            self._usage["requests"] += 1
+            for k, v in usage.items():
+                self._usage[k] += v
+        tracing.incr("rag_tokens_total", usage.get("prompt_tokens", 0), kind="prompt")
+        tracing.incr("rag_tokens_total", usage.get("completion_tokens", 0), kind="completion")
+        return usage
+
+    def usage(self) -> Dict[str, int]:
+        """进程内累计的请求数与 token 用量"""
+        with self._usage_lock:
+            return dict(self._usage)
+
+    def complete(
+        self,
+        messages: Union[str, List[Dict[str, Any]]],
+        max_new_tokens: int = 150,
+        temperature: float = 0.0,
+        stop: Optional[Sequence[str]] = None
+    ) -> GenerationResult:
+        """非流式调用，出错时不抛异常，而是返回带 error 的结果"""
+        payload = self._payload(messages, max_new_tokens, temperature, stream=False, stop=stop)
         try:
-            response = requests.post(
-                f"{self.base_url}/chat/completions",
-                headers=self.headers,
-                json=payload,
-                timeout=60
+            data = self._post(payload).json()
+            text = data["choices"][0]["message"]["content"].strip()
+        except APILLMError as e:
+            return GenerationResult(error=e)
+        except (ValueError, KeyError, IndexError, TypeError) as e:
+            return GenerationResult(error=APILLMError(f"API 响应格式错误: {e}"))
+        return GenerationResult(text, self._record_usage(data.get("usage")))
+
+    def generate(
+        self,
+        messages: Union[str, List[Dict[str, Any]]],
+        max_new_tokens: int = 150,
+        temperature: float = 0.0,
+        stop: Optional[Sequence[str]] = None
+    ) -> str:
+        """
+        支持两种输入：
+        - 纯文本：传入字符串 prompt
+        - 多模态：传入 OpenAI 格式的 messages 列表（含 image_url）
+        重试后仍失败时抛出 APILLMError
+        """
+        result = self.complete(messages, max_new_tokens, temperature, stop)
+        if not result.ok:
+            raise result.error
+        return result.text
+
+    def generate_batch(
+        self,
+        prompts: List[str],
+        max_new_tokens: int = 150,
+        temperature: float = 0.0,
+        stop: Optional[Sequence[str]] = None,
+        return_exceptions: bool = False
+    ) -> List[Union[str, APILLMError]]:
+        """
+        并发调用 API（并发数不超过 max_concurrency），返回顺序与输入一致。
+        各条请求互不影响；return_exceptions=True 时失败的位置为 APILLMError，否则全部完成后抛出第一个错误
+        """
+        if not prompts:
+            return []
+        with ThreadPoolExecutor(max_workers=min(self.max_concurrency, len(prompts))) as pool:
+            results = list(pool.map(lambda p: self.complete(p, max_new_tokens, temperature, stop), prompts))
+        if not return_exceptions:
+            for result in results:
+                if not result.ok:
+                    raise result.error
+        return [result.text if result.ok else result.error for result in results]
+
+    def _semaphore(self) -> asyncio.Semaphore:
+        # 信号量绑定事件循环，按循环分别创建
+        loop = asyncio.get_running_loop()
+        if loop not in self._semaphores:
+            self._semaphores[loop] = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphores[loop]
+
+    async def agenerate(
+        self,
+        messages: Union[str, List[Dict[str, Any]]],
+        max_new_tokens: int = 150,
+        temperature: float = 0.0,
+        stop: Optional[Sequence[str]] = None
+    ) -> GenerationResult:
+        """异步调用：在线程池中执行 complete，同时进行的请求数不超过 max_concurrency"""
+        async with self._semaphore():
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(
+                None, functools.partial(self.complete, messages, max_new_tokens, temperature, stop)
             )
-            response.raise_for_status()
-            data = response.json()
-            return data["choices"][0]["message"]["content"].strip()
-        except Exception as e:
-            error_msg = f"API 调用失败: {e}"
-            print(error_msg)
-            if hasattr(e, 'response') and e.response is not None:
-                print("响应内容:", e.response.text)
-            return "抱歉，模型调用出错，请检查网络或 API 配置。"
+
+    async def agenerate_batch(
+        self,
+        prompts: List[Union[str, List[Dict[str, Any]]]],
+        max_new_tokens: int = 150,
+        temperature: float = 0.0,
+        stop: Optional[Sequence[str]] = None
+    ) -> List[GenerationResult]:
+        return await asyncio.gather(*(self.agenerate(p, max_new_tokens, temperature, stop) for p in prompts))
+
+    def generate_stream(
+        self,
+        messages: Union[str, List[Dict[str, Any]]],
+        max_new_tokens: int = 150,
+        temperature: float = 0.0,
+        stop: Optional[Sequence[str]] = None
+    ) -> Iterator[str]:
+        """
+        流式生成：解析 OpenAI 兼容接口的 SSE 响应（data: {...} / data: [DONE]），逐段产出文本。
+        建立连接前的错误按非流式相同的策略重试，最终失败抛出 APILLMError
+        """
+        payload = self._payload(messages, max_new_tokens, temperature, stream=True, stop=stop)
+        usage = None
+        # 调用方提前关闭迭代器时，with 退出会关闭连接
+        with self._post(payload, stream=True) as response:
+            try:
+                # text/event-stream 未声明编码时 requests 会按 ISO-8859-1 解码，这里按 UTF-8 自行解码
+                for raw_line in response.iter_lines():
+                    line = raw_line.decode("utf-8")
+                    if not line.startswith("data:"):
+                        continue
+                    data = line[len("data:"):].strip()
+                    if data == "[DONE]":
+                        break
+                    chunk = json.loads(data)
+                    usage = chunk.get("usage") or usage
+                    choices = chunk.get("choices") or []
+                    delta = choices[0].get("delta", {}).get("content") if choices else None
+                    if delta:
+                        yield delta
+            except (requests.RequestException, ValueError) as e:
+                raise APILLMError(f"API 流式响应中断: {e}") from e
+        self._record_usage(usage)
@@ -1,13 +1,102 @@
+import re
+import copy
+import threading
 import torch
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple, Union
 from transformers import (
     AutoTokenizer,
     AutoModelForCausalLM,
     BitsAndBytesConfig,
-    pipeline
+    DynamicCache,
+    StoppingCriteria,
+    StoppingCriteriaList,
+    TextIteratorStreamer
 )
+from core import tracing
+
+
+class _EventStoppingCriteria(StoppingCriteria):
+    """调用方提前结束流式读取时，通知后台 generate 停止"""
+
+    def __init__(self, event: threading.Event):
+        self.event = event
+
+    def __call__(self, input_ids, scores, **kwargs) -> bool:
+        return self.event.is_set()
+
+
+class _StopSequenceCriteria(StoppingCriteria):
+    """
+    生成的文本（去掉开头空白后）出现任一停止符时结束该序列，批量生成时逐行判断。
+    开始输出内容后只解码末尾 window 个 token，每步开销与已生成长度无关；
+    window 需大于单步新增的 token 数（prompt lookup 一步可接受多个 token）加上停止符的长度
+    """
+
+    def __init__(self, tokenizer, stop: Sequence[str], prompt_len: int, window: int = 16):
+        self.tokenizer = tokenizer
+        self.pattern = re.compile("|".join(re.escape(s) for s in stop))
+        self.prompt_len = prompt_len
+        self.window = window
+        self.begin: Dict[int, int] = {}  # 行号 -> 第一个含非空白字符的 token 位置
+
+    def _find_begin(self, ids) -> Optional[int]:
+        # 回答开头的空白 token 通常只有几个，逐个累加解码找到内容开始的位置
+        for k in range(self.prompt_len, ids.shape[0]):
+            if self.tokenizer.decode(ids[self.prompt_len:k + 1], skip_special_tokens=True).strip():
+                return k
+        return None
+
+    def __call__(self, input_ids, scores, **kwargs):
+        done = []
+        for row, ids in enumerate(input_ids):
+            n = ids.shape[0]
+            begin = self.begin.get(row)
+            if begin is None:
+                begin = self._find_begin(ids)
+                if begin is None:
+                    done.append(False)
+                    continue
+                self.begin[row] = begin
+            start = max(begin, n - self.window)
+            text = self.tokenizer.decode(ids[start:], skip_special_tokens=True)
+            if start == begin:
+                text = text.lstrip()
+            done.append(self.pattern.search(text) is not None)
+        return torch.tensor(done, dtype=torch.bool, device=input_ids.device)
+
+
+class _LimitedStreamer(TextIteratorStreamer):
+    """prompt lookup 一步可能接受超出 max_new_tokens 的草稿，只转发前 max_new_tokens 个生成的 token"""
+
+    def __init__(self, tokenizer, max_new_tokens: int, **kwargs):
+        super().__init__(tokenizer, **kwargs)
+        self.remaining = max_new_tokens
+
+    def put(self, value):
+        if self.skip_prompt and self.next_tokens_are_prompt:
+            return super().put(value)
+        if len(value.shape) > 1:
+            value = value[0]
+        if self.remaining <= 0:
+            return
+        value = value[:self.remaining]
+        self.remaining -= len(value)
+        super().put(value)
+
 
 class QuantizedLLM:
-    def __init__(self, model_name: str):
+    def __init__(
+        self,
+        model_name: str,
+        batch_size: int = 8,
+        prompt_lookup_tokens: int = 0,
+        prompt_lookup_ngram: int = 3
+    ):
+        """
+        batch_size: generate_batch 每桶的 prompt 数
+        prompt_lookup_tokens: 大于 0 时单条与流式生成使用 prompt lookup 解码（批量生成不支持），每步从
+            prompt 中按最长 prompt_lookup_ngram 元组匹配起草这么多 token，一次前向验证（贪心下输出不变）
+        """
 
         print("Loading 4-bit quantized LLM...")
         bnb_config = BitsAndBytesConfig(
@@ -17,8 +106,8 @@ class QuantizedLLM:
         )
         self.tokenizer = AutoTokenizer.from_pretrained(model_name, trust_remote_code=True)
 
-        if "qwen" in model_name.lower():
-            self.tokenizer.padding_side = "left"
+        # 仅解码器模型批量生成需要左填充
+        self.tokenizer.padding_side = "left"
             
         if self.tokenizer.pad_token is None:
             self.tokenizer.pad_token = self.tokenizer.eos_token
@@ -31,22 +120,213 @@ class QuantizedLLM:
             low_cpu_mem_usage=True,
         )
 
-        self.pipeline = pipeline(
-            "text-generation",
-            model=self.model,
-            tokenizer=self.tokenizer,
-            torch_dtype=torch.float16,
-            device_map="auto",
-            batch_size=1,
-        )
+        self.batch_size = max(1, batch_size)
+        self.prompt_lookup_tokens = max(0, prompt_lookup_tokens)
+        self.prompt_lookup_ngram = max(1, prompt_lookup_ngram)
+
+        # 已登记的固定前缀：前缀文本 -> (token id, 预填充得到的 KV cache)
+        self._prefixes: Dict[str, Tuple[List[int], DynamicCache]] = {}
+        self._prefix_stats = {"hits": 0, "misses": 0, "reused_tokens": 0}
+        self._stats_lock = threading.Lock()
+        # 同一时刻只允许一次前向/生成占用模型：调度器的批量生成、/ask/stream 的流式生成与终端问答共用同一个模型，
+        # 并发调用会争抢显存。已登记前缀的 KV cache 只读，每个请求各自深拷贝一份，不需要加锁
+        self._generate_lock = threading.Lock()
+
+    def register_prefix(self, prefix: str):
+        """预先计算固定前缀（如系统指令）的 KV cache；以它开头的 prompt 只需预填充其余部分"""
+        input_ids = self.tokenizer(prefix, return_tensors="pt")["input_ids"].to(self.model.device)
+        with self._generate_lock, torch.no_grad():
+            cache = self.model(input_ids=input_ids, use_cache=True).past_key_values
+        if not isinstance(cache, DynamicCache):
+            cache = DynamicCache.from_legacy_cache(cache)
+        self._prefixes[prefix] = (input_ids[0].tolist(), cache)
+
+    def _prefix_cache(self, input_ids: List[int]) -> Optional[DynamicCache]:
+        """
+        返回与 prompt 开头匹配的前缀 KV cache 副本（每个请求各用一份，生成时会被追加）。
+        按 token 比较：分词在前缀边界处与单独分词不同时，只复用相同的部分
+        """
+        best, best_len = None, 0
+        for prefix_ids, cache in self._prefixes.values():
+            # 至少留一个 token 交给 generate 计算，才能得到下一个 token 的分布
+            limit = min(len(prefix_ids), len(input_ids) - 1)
+            n = 0
+            while n < limit and prefix_ids[n] == input_ids[n]:
+                n += 1
+            if n > best_len:
+                best, best_len = cache, n
+        with self._stats_lock:
+            self._prefix_stats["hits" if best is not None else "misses"] += 1
+            self._prefix_stats["reused_tokens"] += best_len
+        if best is None:
+            return None
+        tracing.incr("rag_prefix_cache_tokens_total", best_len)
+        cache = copy.deepcopy(best)
+        if best_len < cache.get_seq_length():
+            cache.crop(best_len)
+        return cache
 
-    def generate(self, prompt: str, max_new_tokens: int = 150) -> str:
-        outputs = self.pipeline(
-            prompt,
+    def prefix_stats(self) -> dict:
+        with self._stats_lock:
+            return dict(self._prefix_stats, prefixes=len(self._prefixes))
+
+    def _prepare(self, prompt: str, use_prefix_cache: bool = True, use_prompt_lookup: bool = True) -> dict:
+        """分词并组装单条生成的 generate 参数：命中已登记前缀时带上其 KV cache，按配置开启 prompt lookup"""
+        inputs = self.tokenizer(prompt, return_tensors="pt").to(self.model.device)
+        kwargs = dict(
+            input_ids=inputs["input_ids"],
+            attention_mask=inputs["attention_mask"],
             do_sample=False,
-            max_new_tokens=max_new_tokens,
-            return_full_text=False,
             eos_token_id=self.tokenizer.eos_token_id,
             pad_token_id=self.tokenizer.pad_token_id,
         )
-        return outputs[0]["generated_text"].strip()
\ No newline at end of file
+        if use_prefix_cache and self._prefixes:
+            cache = self._prefix_cache(inputs["input_ids"][0].tolist())
+            if cache is not None:
+                kwargs["past_key_values"] = cache
+        if use_prompt_lookup and self.prompt_lookup_tokens:
+            # 回答常原样引用检索片段中的人名与句子，草稿从 prompt 中匹配，无需额外的草稿模型
+            kwargs["prompt_lookup_num_tokens"] = self.prompt_lookup_tokens
+            kwargs["max_matching_ngram_size"] = self.prompt_lookup_ngram
+        return kwargs
+
+    def generate(
+        self,
+        prompt: str,
+        max_new_tokens: int = 150,
+        stop: Optional[Sequence[str]] = None,
+        use_prefix_cache: bool = True,
+        use_prompt_lookup: bool = True
+    ) -> str:
+        """贪心生成；给出 stop 时输出内容中出现任一停止符即结束（返回文本包含该停止符）"""
+        kwargs = self._prepare(prompt, use_prefix_cache, use_prompt_lookup)
+        prompt_len = kwargs["input_ids"].shape[1]
+        with self._generate_lock, torch.no_grad():
+            outputs = self.model.generate(
+                **kwargs, max_new_tokens=max_new_tokens, stopping_criteria=self._stopping(stop, prompt_len)
+            )
+        # prompt lookup 最后一步可能多接受几个草稿 token，截到上限才与普通贪心解码一致
+        new_tokens = outputs[0, prompt_len:prompt_len + max_new_tokens]
+        self._count_tokens(prompt_len, int((new_tokens != self.tokenizer.pad_token_id).sum()))
+        return self.tokenizer.decode(new_tokens, skip_special_tokens=True).strip()
+
+    def _stopping(
+        self, stop: Optional[Sequence[str]], prompt_len: int, *extra: StoppingCriteria
+    ) -> StoppingCriteriaList:
+        criteria = list(extra)
+        if stop:
+            window = 16 + self.prompt_lookup_tokens
+            criteria.append(_StopSequenceCriteria(self.tokenizer, stop, prompt_len, window))
+        return StoppingCriteriaList(criteria)
+
+    def count_tokens(self, text: str) -> int:
+        """用模型自身的分词器计数，供上下文打包控制 token 预算"""
+        return len(self.tokenizer(text, add_special_tokens=False)["input_ids"])
+
+    def _count_tokens(self, prompt_tokens: int, completion_tokens: int):
+        tracing.incr("rag_tokens_total", prompt_tokens, kind="prompt")
+        tracing.incr("rag_tokens_total", completion_tokens, kind="completion")
+
+    def _pad_left(self, ids_list: List[List[int]]) -> dict:
+        """
+        左填充为等长的 input_ids / attention_mask。不用 tokenizer(padding=True)：它会切换共享 fast tokenizer
+        的填充状态，与其他线程（流式生成、上下文打包计数）同时分词时报 "Already borrowed"
+        """
+        width = max(len(ids) for ids in ids_list)
+        pad = self.tokenizer.pad_token_id
+        input_ids = [[pad] * (width - len(ids)) + ids for ids in ids_list]
+        attention_mask = [[0] * (width - len(ids)) + [1] * len(ids) for ids in ids_list]
+        return {
+            "input_ids": torch.tensor(input_ids, device=self.model.device),
+            "attention_mask": torch.tensor(attention_mask, device=self.model.device),
+        }
+
+    def generate_batch(
+        self,
+        prompts: List[str],
+        max_new_tokens: int = 150,
+        stop: Optional[Sequence[str]] = None,
+        batch_size: Optional[int] = None,
+        return_exceptions: bool = False
+    ) -> List[Union[str, Exception]]:
+        """
+        批量生成，返回顺序与输入一致。prompt 按长度排序后每 batch_size 个一桶，
+        桶内长度相近，左填充浪费的计算少；各序列遇到 EOS 或停止符即结束，整桶全部结束后提前返回。
+        return_exceptions=True 时某桶出错（如显存不足）只把该桶的位置置为异常，其余桶照常生成
+        """
+        if not prompts:
+            return []
+        batch_size = batch_size or self.batch_size
+        # 按字符数排序即可让桶内 token 数相近，不必为排序先分词一遍
+        order = sorted(range(len(prompts)), key=lambda i: len(prompts[i]))
+        results: List[Union[str, Exception, None]] = [None] * len(prompts)
+        for b in range(0, len(order), batch_size):
+            bucket = order[b:b + batch_size]
+            inputs = self._pad_left(self.tokenizer([prompts[i] for i in bucket])["input_ids"])
+            try:
+                # 逐桶加锁，批量生成期间到达的流式请求最多等一桶
+                with self._generate_lock, torch.no_grad():
+                    outputs = self.model.generate(
+                        input_ids=inputs["input_ids"],
+                        attention_mask=inputs["attention_mask"],
+                        do_sample=False,
+                        max_new_tokens=max_new_tokens,
+                        eos_token_id=self.tokenizer.eos_token_id,
+                        pad_token_id=self.tokenizer.pad_token_id,
+                        stopping_criteria=self._stopping(stop, inputs["input_ids"].shape[1]),
+                    )
+            except Exception as e:
+                if not return_exceptions:
+                    raise
+                for i in bucket:
+                    results[i] = e
+                continue
+            new_tokens = outputs[:, inputs["input_ids"].shape[1]:]
+            self._count_tokens(
+                int(inputs["attention_mask"].sum()), int((new_tokens != self.tokenizer.pad_token_id).sum())
+            )
+            texts = self.tokenizer.batch_decode(new_tokens, skip_special_tokens=True)
+            for i, text in zip(bucket, texts):
+                results[i] = text.strip()
+        return results
+
+    def generate_stream(
+        self, prompt: str, max_new_tokens: int = 150, stop: Optional[Sequence[str]] = None
+    ) -> Iterator[str]:
+        """逐段产出生成的文本；生成在后台线程中进行"""
+        kwargs = self._prepare(prompt)
+        prompt_len = kwargs["input_ids"].shape[1]
+        streamer = _LimitedStreamer(self.tokenizer, max_new_tokens, skip_prompt=True, skip_special_tokens=True)
+        cancel = threading.Event()
+        errors = []
+
+        def run():
+            try:
+                with self._generate_lock:
+                    self.model.generate(
+                        **kwargs,
+                        streamer=streamer,
+                        max_new_tokens=max_new_tokens,
+                        stopping_criteria=self._stopping(stop, prompt_len, _EventStoppingCriteria(cancel)),
+                    )
+            except Exception as e:
+                # 生成出错（如显存不足）时 generate 不会结束 streamer，需手动结束，否则读取方一直阻塞
+                errors.append(e)
+                streamer.end()
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        pieces = []
+        try:
+            for text in streamer:
+                if text:
+                    pieces.append(text)
+                    yield text
+        finally:
+            # 调用方提前关闭时让后台生成在下一步结束，释放显存与算力
+            cancel.set()
+            thread.join()
+            if tracing.enabled():
+                self._count_tokens(prompt_len, len(self.tokenizer("".join(pieces))["input_ids"]))
+        if errors:
+            raise errors[0]
@@ -0,0 +1,152 @@
+import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+
+
+def current_rss() -> Optional[int]:
+    """当前进程常驻内存（字节），无法获取时返回 None"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        return None
+
+
+def _param_bytes(model) -> Optional[int]:
+    # SentenceTransformer 本身是 nn.Module；CrossEncoder 把 HF 模型放在 .model 上
+    module = model if hasattr(model, "parameters") else getattr(model, "model", None)
+    if module is None or not hasattr(module, "parameters"):
+        return None
+    tensors = list(module.parameters()) + list(getattr(module, "buffers", lambda: [])())
+    return sum(t.numel() * t.element_size() for t in tensors)
+
+
+class ModelHandle:
+    """共享的惰性模型句柄：首次 get() 时加载，多线程并发调用只会加载一次"""
+
+    def __init__(self, key: Tuple[str, str, str, str, str], loader: Callable[[], object]):
+        self.key = key
+        self._loader = loader
+        self._model = None
+        self._lock = threading.Lock()
+        self.rss_bytes: Optional[int] = None
+        self.param_bytes: Optional[int] = None
+        self.load_seconds: Optional[float] = None
+
+    @property
+    def loaded(self) -> bool:
+        return self._model is not None
+
+    def get(self):
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    rss_before = current_rss()
+                    start = time.perf_counter()
+                    model = self._loader()
+                    self.load_seconds = time.perf_counter() - start
+                    rss_after = current_rss()
+                    if rss_before is not None and rss_after is not None:
+                        # 并行加载时增量会互相叠加，仅作参考；参数内存更准确
+                        self.rss_bytes = max(0, rss_after - rss_before)
+                    self.param_bytes = _param_bytes(model)
+                    self._model = model
+        return self._model
+
+
+class ModelRegistry:
+    """进程级模型注册表，按 (类型, 模型名, 设备, 精度, 推理后端) 共享模型实例"""
+
+    def __init__(self):
+        self._handles: Dict[Tuple[str, str, str, str, str], ModelHandle] = {}
+        self._lock = threading.Lock()
+
+    def handle(
+        self,
+        kind: str,
+        model_name: str,
+        loader: Callable[[], object],
+        device: Optional[str] = None,
+        dtype: str = "float32",
+        backend: str = "torch"
+    ) -> ModelHandle:
+        key = (kind, model_name, device or "auto", dtype, backend)
+        with self._lock:
+            if key not in self._handles:
+                self._handles[key] = ModelHandle(key, loader)
+            return self._handles[key]
+
+    def load_all(self):
+        """并行加载所有已登记但尚未加载的模型（后台预热用；推理库加载时大多释放 GIL）"""
+        with self._lock:
+            pending = [h for h in self._handles.values() if not h.loaded]
+        if not pending:
+            return
+        with ThreadPoolExecutor(max_workers=len(pending), thread_name_prefix="model-warmup") as pool:
+            for future in [pool.submit(h.get) for h in pending]:
+                future.result()
+
+    def loaded(self) -> bool:
+        with self._lock:
+            return all(h.loaded for h in self._handles.values())
+
+    def memory_report(self) -> List[dict]:
+        with self._lock:
+            handles = list(self._handles.values())
+        return [
+            {
+                "kind": h.key[0],
+                "model": h.key[1],
+                "device": h.key[2],
+                "dtype": h.key[3],
+                "backend": h.key[4],
+                "loaded": h.loaded,
+                "rss_bytes": h.rss_bytes,
+                "param_bytes": h.param_bytes,
+                "load_seconds": h.load_seconds,
+            }
+            for h in handles
+        ]
+
+    def format_memory_report(self) -> str:
+        lines = []
+        for r in self.memory_report():
+            if not r["loaded"]:
+                status = "未加载"
+            else:
+                rss = "?" if r["rss_bytes"] is None else f"{r['rss_bytes'] / 2 ** 20:.0f}MB"
+                params = "?" if r["param_bytes"] is None else f"{r['param_bytes'] / 2 ** 20:.0f}MB"
+                status = f"常驻内存 +{rss}，参数 {params}，加载 {r['load_seconds']:.1f}s"
+            lines.append(f"  [{r['kind']}] {r['model']} ({r['device']}, {r['dtype']}, {r['backend']}): {status}")
+        return "\n".join(lines)
+
+
+# 进程内唯一的注册表
+registry = ModelRegistry()
+
+
+def _dtype(backend: str) -> str:
+    return "int8" if backend.endswith("int8") else "float32"
+
+
+def get_embedder(model_name: str, device: str = "cpu", backend: str = "torch") -> ModelHandle:
+    def load():
+        from models.backends import load_sentence_transformer
+        return load_sentence_transformer(model_name, device=device, backend=backend)
+    return registry.handle("embedder", model_name, load, device=device, dtype=_dtype(backend), backend=backend)
+
+
+def get_cross_encoder(model_name: str, device: Optional[str] = None, backend: str = "torch") -> ModelHandle:
+    def load():
+        from models.backends import load_cross_encoder
+        return load_cross_encoder(model_name, device=device, backend=backend)
+    return registry.handle(
+        "cross_encoder", model_name, load, device=device, dtype=_dtype(backend), backend=backend
+    )
@@ -0,0 +1,181 @@
+import hashlib
+import threading
+import numpy as np
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence, Tuple
+from models.registry import get_cross_encoder
+from core import tracing
+from config import (
+    RERANK_BACKEND, RERANK_CACHE_SIZE, RERANK_SKIP_MARGIN, RERANK_SHRINK_MARGIN, RERANK_SHRINK_FACTOR
+)
+
+DEFAULT_RERANKER = "BAAI/bge-reranker-base"  # 默认使用支持中英双语的 reranker
+
+
+def query_key(query: str) -> str:
+    # 忽略多余空白，重复提问即可命中
+    return hashlib.sha1(" ".join(query.split()).encode("utf-8")).hexdigest()
+
+
+class ScoreCache:
+    """线程安全的 LRU：(问题哈希, chunk id) -> 重排分数"""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._data: "OrderedDict[Tuple[str, int], float]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_many(self, keys: List[Tuple[str, int]]) -> Dict[Tuple[str, int], float]:
+        found = {}
+        with self._lock:
+            for key in keys:
+                if key in self._data:
+                    self._data.move_to_end(key)
+                    found[key] = self._data[key]
+        return found
+
+    def put_many(self, items: Dict[Tuple[str, int], float]):
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            for key, score in items.items():
+                self._data[key] = score
+                self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class Reranker:
+    def __init__(
+        self,
+        model_name: Optional[str] = None,
+        device: Optional[str] = None,
+        backend: Optional[str] = None,
+        cache_size: Optional[int] = None,
+        skip_margin: Optional[float] = None,
+        shrink_margin: Optional[float] = None,
+        shrink_factor: Optional[int] = None
+    ):
+        # 模型由注册表共享，首次重排时才加载
+        self.handle = get_cross_encoder(
+            model_name or DEFAULT_RERANKER, device=device, backend=backend or RERANK_BACKEND
+        )
+        # 缓存以 chunk id 为键，索引重建后需调用 clear_cache()
+        self.cache = ScoreCache(RERANK_CACHE_SIZE if cache_size is None else cache_size)
+        self.skip_margin = RERANK_SKIP_MARGIN if skip_margin is None else skip_margin
+        self.shrink_margin = RERANK_SHRINK_MARGIN if shrink_margin is None else shrink_margin
+        self.shrink_factor = shrink_factor or RERANK_SHRINK_FACTOR
+        self._counters = {
+            "full": 0, "shrunk": 0, "skipped": 0, "cache_hits": 0, "cache_misses": 0
+        }
+        self._counter_lock = threading.Lock()
+
+    @property
+    def model(self):
+        return self.handle.get()
+
+    def predict(self, pairs, **kwargs):
+        return self.model.predict(pairs, **kwargs)
+
+    def clear_cache(self):
+        self.cache.clear()
+
+    def stats(self) -> Dict[str, int]:
+        with self._counter_lock:
+            return dict(self._counters)
+
+    def _count(self, **deltas):
+        with self._counter_lock:
+            for name, delta in deltas.items():
+                self._counters[name] += delta
+        for name, delta in deltas.items():
+            tracing.incr("rag_rerank_events_total", delta, event=name)
+
+    def _margin(self, scores: Sequence[float], top_k: int) -> float:
+        """第 top_k 名与第 top_k+1 名的首阶段分差，按候选分数跨度归一化到 [0, 1]"""
+        s = np.asarray(scores, dtype=np.float64)
+        span = s[0] - s[-1]
+        if span <= 0:
+            return 0.0
+        return float((s[top_k - 1] - s[top_k]) / span)
+
+    def rerank(
+        self,
+        query: str,
+        ids: Sequence[int],
+        texts: Sequence[str],
+        top_k: int,
+        first_stage_scores: Optional[Sequence[float]] = None
+    ) -> List[int]:
+        """
+        Cross-Encoder 重排，返回分数最高的 top_k 个候选的 chunk id。
+        传入首阶段分数（降序）时启用级联：前 top_k 与其余候选分差足够大则跳过重排，
+        较大则只重排排名靠前的一部分候选。
+        """
+        return self.rerank_batch([query], [ids], [texts], top_k, [first_stage_scores])[0]
+
+    def rerank_batch(
+        self,
+        queries: Sequence[str],
+        ids_list: Sequence[Sequence[int]],
+        texts_list: Sequence[Sequence[str]],
+        top_k: int,
+        first_stage_scores_list: Optional[Sequence[Optional[Sequence[float]]]] = None
+    ) -> List[List[int]]:
+        """多个问题的重排：级联与缓存逐题判断，未命中缓存的 (问题, chunk) 对合并为一次 predict"""
+        if first_stage_scores_list is None:
+            first_stage_scores_list = [None] * len(queries)
+
+        results: List[Optional[List[int]]] = [None] * len(queries)
+        pending = []  # (题号, 问题, 候选 id, 候选文本, 缓存键, 已有分数)
+        for n, (query, ids, texts, first_stage_scores) in enumerate(
+            zip(queries, ids_list, texts_list, first_stage_scores_list)
+        ):
+            if len(ids) == 0:
+                results[n] = []
+                continue
+            ids = [int(i) for i in ids]
+
+            path = "full"
+            if first_stage_scores is not None and len(ids) > top_k:
+                margin = self._margin(first_stage_scores, top_k)
+                if margin >= self.skip_margin:
+                    self._count(skipped=1)
+                    results[n] = ids[:top_k]
+                    continue
+                keep = top_k * self.shrink_factor
+                if margin >= self.shrink_margin and keep < len(ids):
+                    ids, texts = ids[:keep], texts[:keep]
+                    path = "shrunk"
+            self._count(**{path: 1})
+
+            qkey = query_key(query)
+            keys = [(qkey, i) for i in ids]
+            pending.append((n, query, ids, texts, keys, self.cache.get_many(keys)))
+
+        pairs, owners = [], []
+        for n, query, ids, texts, keys, scores in pending:
+            missing = [m for m, key in enumerate(keys) if key not in scores]
+            self._count(cache_hits=len(keys) - len(missing), cache_misses=len(missing))
+            pairs.extend([query, texts[m]] for m in missing)
+            owners.extend(keys[m] for m in missing)
+        if pairs:
+            with tracing.span("rerank"):
+                predicted = self.predict(pairs)
+            tracing.incr("rag_rerank_pairs_total", len(pairs))
+            new_scores = {key: float(s) for key, s in zip(owners, predicted)}
+            self.cache.put_many(new_scores)
+            for *_, keys, scores in pending:
+                scores.update((key, new_scores[key]) for key in keys if key in new_scores)
+
+        for n, _, ids, _, keys, scores in pending:
+            order = sorted(range(len(ids)), key=lambda m: scores[keys[m]], reverse=True)
+            results[n] = [ids[m] for m in order[:top_k]]
+        return results
@@ -1,21 +1,53 @@
-from config import RETRIEVER_TYPE, USE_RERANK, RERANK_MODEL_NAME
-from .faiss_retriever import FaissRetriever
-from .bm25_retriever import BM25Retriever
-from .hybrid_retriever import HybridRetriever
+import importlib
+from config import (
+    RETRIEVER_TYPE, USE_RERANK, RERANK_MODEL_NAME, HYBRID_FUSION, HYBRID_WEIGHTS, RRF_K,
+    CHUNK_SIZE, CHUNK_OVERLAP, EMBEDDING_MODEL_NAME, EMBEDDING_BACKEND
+)
+
+# 检索器按需导入：只用 BM25 时不加载 faiss，只用 FAISS 时不加载 jieba
+_RETRIEVERS = {
+    "FaissRetriever": ".faiss_retriever",
+    "BM25Retriever": ".bm25_retriever",
+    "HybridRetriever": ".hybrid_retriever",
+}
+
+
+def __getattr__(name):
+    if name in _RETRIEVERS:
+        return getattr(importlib.import_module(_RETRIEVERS[name], __name__), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def current_index_settings() -> dict:
+    """当前配置对应的索引设置，与索引清单比较即可判断已有索引能否直接加载"""
+    from .manifest import index_settings
+    faiss_index = None
+    if RETRIEVER_TYPE != "bm25":
+        from .faiss_index import build_config
+        faiss_index = build_config()
+    return index_settings(
+        CHUNK_SIZE, CHUNK_OVERLAP, EMBEDDING_MODEL_NAME, RETRIEVER_TYPE,
+        faiss_index=faiss_index, embedding_backend=EMBEDDING_BACKEND
+    )
+
 
 def get_retriever(index_path: str = "index"):
     if RETRIEVER_TYPE == "faiss":
+        from .faiss_retriever import FaissRetriever
         return FaissRetriever(index_path + ".faiss", use_rerank=USE_RERANK, reranker_model_name=RERANK_MODEL_NAME)
     elif RETRIEVER_TYPE == "bm25":
+        from .bm25_retriever import BM25Retriever
         return BM25Retriever(index_path + ".pkl", use_rerank=USE_RERANK, reranker_model_name=RERANK_MODEL_NAME)
     elif RETRIEVER_TYPE == "hybrid":
+        from .hybrid_retriever import HybridRetriever
         return HybridRetriever(
             faiss_path=index_path + ".faiss",
             bm25_path=index_path + ".pkl",
             use_rerank=USE_RERANK,
-            reranker_model_name=RERANK_MODEL_NAME
+            reranker_model_name=RERANK_MODEL_NAME,
+            fusion=HYBRID_FUSION,
+            weights=HYBRID_WEIGHTS,
+            rrf_k=RRF_K
         )
     else:
         raise ValueError(f"Unknown retriever type: {RETRIEVER_TYPE}")
-    
-    
\ No newline at end of file
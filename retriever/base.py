@@ -1,5 +1,5 @@
 from abc import ABC, abstractmethod
-from typing import List
+from typing import List, Optional
 
 class BaseRetriever(ABC):
     @abstractmethod
@@ -10,12 +10,37 @@ class BaseRetriever(ABC):
     @abstractmethod
     def load_index(self):
         pass
+
+    def update_index(self, chunks: List[str], reuse_embeddings: bool = True):
+        """增量更新索引：只重新处理新增或变更的 chunk（默认全量重建）"""
+        self.build_index(chunks)
     
     @abstractmethod
-    def retrieve(self, query: str, top_k: int = 3) -> List[str]:
-        """检索并返回拼接后的上下文"""
+    def retrieve_ids(self, query: str, top_k: int = 3) -> List[int]:
+        """检索并返回 top_k 个 chunk id（按相关性降序）"""
         pass
 
+    def retrieve_ids_batch(self, queries: List[str], top_k: int = 3, query_embeddings=None) -> List[List[int]]:
+        """
+        多个问题一起检索，结果与逐个调用 retrieve_ids 相同（子类可合并编码、检索与重排）。
+        query_embeddings 为调用方已用同一嵌入模型算好的问题向量（如语义缓存），向量检索据此跳过编码
+        """
+        return [self.retrieve_ids(q, top_k) for q in queries]
+
+    def retrieve(self, query: str, top_k: int = 3) -> List[str]:
+        """检索并返回 top_k 个 chunk 文本"""
+        return [self.chunks[i] for i in self.retrieve_ids(query, top_k)]
+
+    def retrieve_batch(self, queries: List[str], top_k: int = 3) -> List[List[str]]:
+        """多个问题一起检索并返回 chunk 文本，结果与逐个调用 retrieve 相同"""
+        return [[self.chunks[i] for i in ids] for ids in self.retrieve_ids_batch(queries, top_k)]
+
+    def _clear_rerank_cache(self):
+        # 重排缓存以 chunk id 为键，索引变化后必须清空
+        reranker = getattr(self, "reranker", None)
+        if reranker is not None:
+            reranker.clear_cache()
+
     @abstractmethod
     def exists(self) -> bool:
         """判断索引是否已存在"""
@@ -0,0 +1,213 @@
+import os
+import pickle
+import numpy as np
+from collections import Counter
+from typing import Dict, Iterable, List, Tuple
+
+# 与 rank_bm25.BM25Okapi 默认参数保持一致，保证分数可对齐
+DEFAULT_K1 = 1.5
+DEFAULT_B = 0.75
+DEFAULT_EPSILON = 0.25
+
+_ARRAYS = ("doc_indptr", "doc_terms", "doc_tfs", "term_indptr", "term_docs", "term_weights")
+
+
+class SparseBM25:
+    """
+    基于稀疏矩阵的 BM25（Okapi）实现，打分公式与 rank_bm25.BM25Okapi 相同。
+
+    - 词表：term -> term id
+    - 按文档存储的词频矩阵（CSR：doc_indptr / doc_terms / doc_tfs），用于增量更新
+    - 按词存储的权重矩阵（CSR：term_indptr / term_docs / term_weights），
+      预先算好 idf * tf 饱和项，查询时只需一次稀疏矩阵-向量乘
+    """
+
+    def __init__(self, k1: float = DEFAULT_K1, b: float = DEFAULT_B, epsilon: float = DEFAULT_EPSILON):
+        self.k1 = k1
+        self.b = b
+        self.epsilon = epsilon
+        self.terms: List[str] = []
+        self.vocab: Dict[str, int] = {}
+        self.num_docs = 0
+        self.avgdl = 0.0
+        for name in _ARRAYS:
+            setattr(self, name, None)
+
+    # ---------- 构建 ----------
+
+    @classmethod
+    def from_tokenized(cls, tokenized_docs: Iterable[List[str]], **params) -> "SparseBM25":
+        return cls.from_term_counts((Counter(doc) for doc in tokenized_docs), **params)
+
+    @classmethod
+    def from_term_counts(cls, doc_counts: Iterable[Dict[str, int]], **params) -> "SparseBM25":
+        engine = cls(**params)
+        vocab = engine.vocab
+        doc_terms: List[int] = []
+        doc_tfs: List[int] = []
+        doc_indptr = [0]
+        for counts in doc_counts:
+            for term, tf in counts.items():
+                doc_terms.append(vocab.setdefault(term, len(vocab)))
+                doc_tfs.append(tf)
+            doc_indptr.append(len(doc_terms))
+        engine.terms = list(vocab)
+        engine.doc_indptr = np.asarray(doc_indptr, dtype=np.int64)
+        engine.doc_terms = np.asarray(doc_terms, dtype=np.int32)
+        engine.doc_tfs = np.asarray(doc_tfs, dtype=np.float32)
+        engine._compute_weights()
+        return engine
+
+    def _compute_weights(self):
+        n_docs = len(self.doc_indptr) - 1
+        n_terms = len(self.terms)
+        doc_ids = np.repeat(np.arange(n_docs, dtype=np.int32), np.diff(self.doc_indptr))
+        tfs = self.doc_tfs.astype(np.float64)
+
+        doc_len = np.bincount(doc_ids, weights=tfs, minlength=n_docs)
+        self.num_docs = n_docs
+        self.avgdl = float(doc_len.mean()) if n_docs else 0.0
+
+        # idf 与 rank_bm25 相同：负 idf 用 epsilon * 平均 idf 代替
+        df = np.bincount(self.doc_terms, minlength=n_terms)
+        idf = np.log(n_docs - df + 0.5) - np.log(df + 0.5)
+        if n_terms:
+            idf[idf < 0] = self.epsilon * idf.mean()
+
+        norm = self.k1 * (1 - self.b + self.b * doc_len / self.avgdl) if n_docs else doc_len
+        weights = idf[self.doc_terms] * tfs * (self.k1 + 1) / (tfs + norm[doc_ids])
+
+        order = np.argsort(self.doc_terms, kind="stable")
+        self.term_docs = doc_ids[order]
+        self.term_weights = weights[order].astype(np.float32)
+        self.term_indptr = np.zeros(n_terms + 1, dtype=np.int64)
+        np.cumsum(df, out=self.term_indptr[1:])
+
+    def doc_term_counts(self, doc_id: int) -> Dict[str, int]:
+        """返回某篇文档的词频，用于增量更新时复用分词结果"""
+        start, end = self.doc_indptr[doc_id], self.doc_indptr[doc_id + 1]
+        return {
+            self.terms[t]: int(tf)
+            for t, tf in zip(self.doc_terms[start:end], self.doc_tfs[start:end])
+        }
+
+    # ---------- 查询 ----------
+
+    def get_scores(self, query_tokens: List[str]) -> np.ndarray:
+        counts = Counter(t for t in query_tokens if t in self.vocab)
+        if not counts or not self.num_docs:
+            return np.zeros(self.num_docs)
+        docs, weights = [], []
+        for term, qf in counts.items():
+            t = self.vocab[term]
+            start, end = self.term_indptr[t], self.term_indptr[t + 1]
+            docs.append(self.term_docs[start:end])
+            weights.append(self.term_weights[start:end] * qf)
+        # 查询词向量与权重矩阵的一次稀疏乘法
+        return np.bincount(
+            np.concatenate(docs), weights=np.concatenate(weights), minlength=self.num_docs
+        )
+
+    def get_scores_batch(self, queries: List[List[str]]) -> np.ndarray:
+        """
+        多个查询一次打分，返回 (查询数, 文档数) 的分数矩阵：各查询的倒排项拼接后做一次 bincount，
+        每个 (查询, 文档) 内的累加顺序与 get_scores 相同，分数逐位一致
+        """
+        n = self.num_docs
+        docs, weights = [], []
+        for row, query_tokens in enumerate(queries):
+            counts = Counter(t for t in query_tokens if t in self.vocab)
+            for term, qf in counts.items():
+                t = self.vocab[term]
+                start, end = self.term_indptr[t], self.term_indptr[t + 1]
+                docs.append(self.term_docs[start:end].astype(np.int64) + row * n)
+                weights.append(self.term_weights[start:end] * qf)
+        if not docs or not n:
+            return np.zeros((len(queries), n))
+        return np.bincount(
+            np.concatenate(docs), weights=np.concatenate(weights), minlength=len(queries) * n
+        ).reshape(len(queries), n)
+
+    def top_k(self, query_tokens: List[str], k: int) -> Tuple[np.ndarray, np.ndarray]:
+        scores = self.get_scores(query_tokens)
+        ids = top_k_indices(scores, k)
+        return ids, scores[ids]
+
+    def top_k_batch(self, queries: List[List[str]], k: int) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """结果与逐个调用 top_k 相同"""
+        results = []
+        for scores in self.get_scores_batch(queries):
+            ids = top_k_indices(scores, k)
+            results.append((ids, scores[ids]))
+        return results
+
+    # ---------- 持久化 ----------
+
+    @staticmethod
+    def _array_path(path: str, name: str) -> str:
+        return f"{path}.{name}.npy"
+
+    @classmethod
+    def array_files(cls, path: str) -> List[str]:
+        return [cls._array_path(path, name) for name in _ARRAYS]
+
+    def save(self, path: str):
+        """
+        各文件先写临时文件再替换：其他引擎/进程仍映射着的旧数组不受影响；元数据最后替换，
+        中途崩溃时旧元数据仍指向完整的数组文件，或元数据缺失而被视为没有索引
+        """
+        for name in _ARRAYS:
+            array_path = self._array_path(path, name)
+            with open(array_path + ".tmp", "wb") as f:
+                np.save(f, getattr(self, name))
+            os.replace(array_path + ".tmp", array_path)
+        meta = {
+            "format": "sparse_bm25",
+            "k1": self.k1,
+            "b": self.b,
+            "epsilon": self.epsilon,
+            "num_docs": self.num_docs,
+            "avgdl": self.avgdl,
+            "terms": self.terms,
+        }
+        with open(path + ".tmp", "wb") as f:
+            pickle.dump(meta, f)
+        os.replace(path + ".tmp", path)
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True) -> "SparseBM25":
+        with open(path, "rb") as f:
+            meta = pickle.load(f)
+        if not is_engine_meta(meta):
+            raise ValueError(f"不是 SparseBM25 索引: {path}")
+        engine = cls(k1=meta["k1"], b=meta["b"], epsilon=meta["epsilon"])
+        engine.num_docs = meta["num_docs"]
+        engine.avgdl = meta["avgdl"]
+        engine.terms = meta["terms"]
+        engine.vocab = {term: i for i, term in enumerate(engine.terms)}
+        for name in _ARRAYS:
+            setattr(engine, name, np.load(cls._array_path(path, name), mmap_mode="r" if mmap else None))
+        return engine
+
+
+def is_engine_meta(data) -> bool:
+    return isinstance(data, dict) and data.get("format") == "sparse_bm25"
+
+
+def top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    """
+    用 argpartition 取分数最高的 k 个下标，按分数降序返回；
+    同分时下标小的在前，与 sorted(..., reverse=True) 的稳定排序结果一致。
+    """
+    n = len(scores)
+    k = min(k, n)
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    if k < n:
+        kth = scores[np.argpartition(-scores, k - 1)[k - 1]]
+        above = np.flatnonzero(scores > kth)
+        ties = np.flatnonzero(scores == kth)[:k - len(above)]
+        candidates = np.concatenate([above, ties])
+    else:
+        candidates = np.arange(n)
+    return candidates[np.lexsort((candidates, -scores[candidates]))]
@@ -1,11 +1,21 @@
 import os
 import pickle
 import jieba
-from typing import List, Optional
-from rank_bm25 import BM25Okapi
+import numpy as np
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
 from abc import ABC, abstractmethod
+from models.reranker import Reranker
 from retriever.base import BaseRetriever
-from sentence_transformers import CrossEncoder
+from retriever.bm25_engine import SparseBM25, is_engine_meta
+from retriever.chunk_store import ChunkStore
+from core import tracing
+
+
+def tokenize(text: str) -> List[str]:
+    # 中文分词
+    return list(jieba.cut_for_search(text))
+
 
 class BM25Retriever(BaseRetriever):
     def __init__(
@@ -15,55 +25,125 @@ class BM25Retriever(BaseRetriever):
         use_rerank: bool = False
     ):
         self.index_path = index_path
+        self.chunk_store_path = index_path + ".chunks"
         self.chunks: List[str] = []
         self.bm25 = None
         self.use_rerank = use_rerank
         self.reranker = None
 
         if use_rerank:
-            if CrossEncoder is None:
-                raise ImportError("Please install sentence-transformers to use re-ranking: pip install sentence-transformers")
-            self.reranker = CrossEncoder(reranker_model_name or "BAAI/bge-reranker-base")
+            self.reranker = Reranker(reranker_model_name)
 
     def _tokenize(self, text: str) -> List[str]:
-        # 中文分词
-        return list(jieba.cut_for_search(text))
+        return tokenize(text)
+
+    def build_index(self, chunks: List[str], doc_counts: Optional[List[Dict[str, int]]] = None):
+        """doc_counts 为已统计好的各 chunk 词频（如离线建索引时多进程分词的结果），不给时在本进程分词"""
+        if doc_counts is None:
+            doc_counts = [Counter(self._tokenize(chunk)) for chunk in chunks]
+        self._write_index(chunks, doc_counts)
+
+    def update_index(self, chunks: List[str], reuse_embeddings: bool = True):
+        if not self.exists():
+            self.build_index(chunks)
+            return
+        old_chunks, old_counts = self._load_previous()
 
-    def build_index(self, chunks: List[str]):
-        self.chunks = chunks
-        tokenized_chunks = [self._tokenize(chunk) for chunk in chunks]
-        self.bm25 = BM25Okapi(tokenized_chunks)
-        with open(self.index_path, "wb") as f:
-            pickle.dump((chunks, tokenized_chunks), f)
+        # 按 chunk 内容复用旧词频，只对新增或变更的 chunk 重新分词
+        reusable = dict(zip(old_chunks, old_counts))
+        if isinstance(old_chunks, ChunkStore):
+            old_chunks.close()
+        doc_counts = []
+        changed = 0
+        for chunk in chunks:
+            counts = reusable.get(chunk)
+            if counts is None:
+                counts = Counter(self._tokenize(chunk))
+                changed += 1
+            doc_counts.append(counts)
+        print(f"BM25 增量更新：复用 {len(chunks) - changed} 个 chunk，重新分词 {changed} 个")
+        self._write_index(chunks, doc_counts)
 
-    def retrieve(self, query: str, top_k: int = 3) -> List[str]:
+    def _write_index(self, chunks: List[str], doc_counts: List[Dict[str, int]]):
+        self.bm25 = SparseBM25.from_term_counts(doc_counts)
+        self.bm25.save(self.index_path)
+        if isinstance(self.chunks, ChunkStore):
+            self.chunks.close()  # Windows 下被映射的文件无法替换
+        self.chunks = ChunkStore.write(self.chunk_store_path, chunks)
+        self._clear_rerank_cache()
+
+    def search(self, query: str, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """第一阶段 BM25 召回，返回 (chunk ids, BM25 分数)"""
+        return self.search_batch([query], k)[0]
+
+    def search_batch(self, queries: List[str], k: int) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """多个问题分词后一次打分"""
         if self.bm25 is None:
             raise ValueError("Index not built or loaded. Call build_index() or load_index() first.")
+        with tracing.span("bm25_search"):
+            results = self.bm25.top_k_batch([self._tokenize(q) for q in queries], k)
+        for ids, _ in results:
+            tracing.incr("rag_candidates_total", len(ids), retriever="bm25")
+        return results
 
-        tokenized_query = self._tokenize(query)
-        scores = self.bm25.get_scores(tokenized_query)
-        # 先取稍多一点的候选（比如 top_k * 2），用于重排
-        candidate_k = min(len(scores), top_k * 5 if self.use_rerank else top_k)
-        top_indices = sorted(range(len(scores)), key=lambda i: scores[i], reverse=True)[:candidate_k]
-        candidates = [self.chunks[i] for i in top_indices]
+    def retrieve_ids(self, query: str, top_k: int = 3) -> List[int]:
+        return self.retrieve_ids_batch([query], top_k)[0]
 
-        if self.use_rerank and self.reranker is not None:
-            # 使用 cross-encoder 重排
-            pairs = [[query, doc] for doc in candidates]
-            rerank_scores = self.reranker.predict(pairs)
-            # 按 rerank 分数降序排序
-            reranked = sorted(zip(candidates, rerank_scores), key=lambda x: x[1], reverse=True)
-            results = [doc for doc, _ in reranked[:top_k]]
-        else:
-            results = candidates[:top_k]
+    def retrieve_ids_batch(self, queries: List[str], top_k: int = 3, query_embeddings=None) -> List[List[int]]:
+        # BM25 用不到问题向量，忽略 query_embeddings
+        # 先取稍多一点的候选（比如 top_k * 5），用于重排
+        candidate_k = top_k * 5 if self.use_rerank else top_k
+        results = self.search_batch(queries, candidate_k)
 
-        return results
+        if self.use_rerank and self.reranker is not None:
+            # 使用 cross-encoder 重排，所有问题的候选合并为一次 predict
+            return self.reranker.rerank_batch(
+                queries,
+                [ids for ids, _ in results],
+                [[self.chunks[i] for i in ids] for ids, _ in results],
+                top_k,
+                [scores for _, scores in results]
+            )
+        return [[int(i) for i in ids[:top_k]] for ids, _ in results]
 
     def exists(self) -> bool:
-        return os.path.exists(self.index_path)
+        if not os.path.exists(self.index_path):
+            return False
+        arrays = [os.path.exists(p) for p in SparseBM25.array_files(self.index_path)]
+        if not any(arrays):
+            return True  # 旧版 pickle 格式，load_index 时转换
+        # 数组或 chunk 存储缺失（如写到一半时崩溃）视为没有索引，触发重建而不是加载时报错
+        return all(arrays) and ChunkStore.exists(self.chunk_store_path)
 
-    def load_index(self):
+    def _read_meta(self):
         with open(self.index_path, "rb") as f:
-            self.chunks, _ = pickle.load(f)
-        tokenized = [self._tokenize(c) for c in self.chunks]
-        self.bm25 = BM25Okapi(tokenized)
\ No newline at end of file
+            return pickle.load(f)
+
+    def _load_previous(self):
+        """读取已有索引，返回 (chunks, 每个 chunk 的词频)；兼容旧版 pickle 格式"""
+        data = self._read_meta()
+        if is_engine_meta(data):
+            engine = SparseBM25.load(self.index_path)
+            return ChunkStore.open(self.chunk_store_path), [
+                engine.doc_term_counts(i) for i in range(engine.num_docs)
+            ]
+        if isinstance(data, tuple):
+            # 旧格式：(chunks, tokenized_chunks) 一起存在 pickle 中
+            chunks, tokenized = data
+        else:
+            chunks, tokenized = ChunkStore.open(self.chunk_store_path), data
+        return chunks, [Counter(tokens) for tokens in tokenized]
+
+    def load_index(self):
+        if not is_engine_meta(self._read_meta()):
+            # 旧格式索引：复用其中的分词结果，转存为稀疏矩阵格式
+            print("转换旧版 BM25 索引...")
+            old_chunks, doc_counts = self._load_previous()
+            chunks = list(old_chunks)
+            if isinstance(old_chunks, ChunkStore):
+                old_chunks.close()
+            self._write_index(chunks, doc_counts)
+            return
+        self.bm25 = SparseBM25.load(self.index_path)
+        self.chunks = ChunkStore.open(self.chunk_store_path)
+        self._clear_rerank_cache()
@@ -0,0 +1,81 @@
+import os
+import mmap
+import numpy as np
+from typing import Iterable, List, Union
+
+
+class ChunkStore:
+    """
+    紧凑的 chunk 存储：所有 chunk 的 UTF-8 字节拼成一个 blob，
+    另存一个 int64 偏移数组（长度 N+1）。两者均以 mmap 方式打开，按 chunk id 惰性读取。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._blob = None
+        self._blob_file = None
+        self._offsets = None
+
+    @staticmethod
+    def blob_path(path: str) -> str:
+        return path + ".bin"
+
+    @staticmethod
+    def offsets_path(path: str) -> str:
+        return path + ".offsets.npy"
+
+    @classmethod
+    def exists(cls, path: str) -> bool:
+        return os.path.exists(cls.blob_path(path)) and os.path.exists(cls.offsets_path(path))
+
+    @classmethod
+    def write(cls, path: str, chunks: Iterable[str]) -> "ChunkStore":
+        blob_path, offsets_path = cls.blob_path(path), cls.offsets_path(path)
+        offsets = [0]
+        # 先写临时文件再替换，避免读者看到写了一半的存储
+        with open(blob_path + ".tmp", "wb") as f:
+            for chunk in chunks:
+                data = chunk.encode("utf-8")
+                f.write(data)
+                offsets.append(offsets[-1] + len(data))
+        with open(offsets_path + ".tmp", "wb") as f:
+            np.save(f, np.asarray(offsets, dtype=np.int64))
+        os.replace(blob_path + ".tmp", blob_path)
+        os.replace(offsets_path + ".tmp", offsets_path)
+        return cls.open(path)
+
+    @classmethod
+    def open(cls, path: str) -> "ChunkStore":
+        store = cls(path)
+        store._offsets = np.load(cls.offsets_path(path), mmap_mode="r")
+        if store._offsets[-1] > 0:
+            store._blob_file = open(cls.blob_path(path), "rb")
+            store._blob = mmap.mmap(store._blob_file.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            store._blob = b""  # 空文件无法 mmap
+        return store
+
+    def close(self):
+        if isinstance(self._blob, mmap.mmap):
+            self._blob.close()
+        if self._blob_file is not None:
+            self._blob_file.close()
+        self._blob = self._blob_file = self._offsets = None
+
+    def __len__(self) -> int:
+        return 0 if self._offsets is None else len(self._offsets) - 1
+
+    def __getitem__(self, i: Union[int, slice]) -> Union[str, List[str]]:
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        n = len(self)
+        if i < 0:
+            i += n
+        if not 0 <= i < n:
+            raise IndexError(f"chunk id 越界: {i}")
+        start, end = int(self._offsets[i]), int(self._offsets[i + 1])
+        return self._blob[start:end].decode("utf-8")
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
@@ -1,84 +1,196 @@
+"""
+文本切分：按句子贪心拼接成不超过 chunk_size 的块，相邻块之间以末尾若干整句重叠。
+
+iter_chunks 是流式实现：分块读取原文、逐句推进，重叠句保存在有界队列中，
+时间 O(n)、内存 O(chunk_size)，并给出每个块及其中各句在原文中的字符偏移。
+split_text 是它的列表形式，切分结果与旧实现逐块一致。
+"""
 import re
-from typing import List
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from typing import Deque, Iterable, Iterator, List, Optional, Sequence, Tuple, Union
 from tqdm import tqdm
 
-def split_text(
-    text: str,
-    chunk_size: int = 400,
-    chunk_overlap: int = 60,
-    show_progress: bool = False
-) -> List[str]:
-    if not text or not text.strip():
-        return []
+# 空白串 | 句末标点 | 其余连续字符
+_TOKEN_PATTERN = re.compile(r'(\s+)|([。！？.!?])|[^\s。！？.!?]+')
+
+READ_BLOCK_SIZE = 1 << 20  # 流式读取的块大小（字符）
+
+Sentence = Tuple[str, int, int]  # (句子, 原文起始偏移, 原文结束偏移)
+
+
+class Chunk:
+    """一个切分块：text 为块文本，[start, end) 为其在原文中的字符范围，sentences 为各句的范围"""
 
-    text = re.sub(r'\s+', ' ', text).strip()
+    __slots__ = ("text", "start", "end", "sentences")
+
+    def __init__(self, text: str, start: int, end: int, sentences: List[Tuple[int, int]]):
+        self.text = text
+        self.start = start
+        self.end = end
+        self.sentences = sentences
+
+    def __repr__(self):
+        return f"Chunk(start={self.start}, end={self.end}, sentences={len(self.sentences)}, text={self.text[:20]!r})"
+
+
+def iter_sentences(blocks: Iterable[str]) -> Iterator[Tuple[str, int, int, bool]]:
+    """
+    逐句产出 (句子, 起始偏移, 结束偏移, 句前是否有空白)。
+    句子在每个句末标点后断开，内部连续空白压缩为一个空格、首尾空白去掉，与
+    re.split(r'(?<=[。！？.!?])\\s*', re.sub(r'\\s+', ' ', text).strip()) 的结果一致。
+    """
+    parts: List[str] = []
+    start = end = 0
+    pending_space = space_before = False
+    offset = 0
+    for block in blocks:
+        for m in _TOKEN_PATTERN.finditer(block):
+            if m.group(1) is not None:
+                if parts:
+                    pending_space = True
+                else:
+                    space_before = True
+                continue
+            if parts:
+                if pending_space:
+                    parts.append(" ")
+                    pending_space = False
+            else:
+                start = offset + m.start()
+            parts.append(m.group())
+            end = offset + m.end()
+            if m.group(2) is not None:
+                yield "".join(parts), start, end, space_before
+                parts, pending_space, space_before = [], False, False
+        offset += len(block)
+    if parts:
+        yield "".join(parts), start, end, space_before
+
+
+def _make_chunk(window: Sequence[Sentence]) -> Chunk:
+    return Chunk(
+        " ".join(s for s, _, _ in window), window[0][1], window[-1][2], [(a, b) for _, a, b in window]
+    )
+
+
+def iter_chunks(
+    source: Union[str, Iterable[str]],
+    chunk_size: int = 400,
+    chunk_overlap: int = 60
+) -> Iterator[Chunk]:
+    """流式切分。source 为整段文本，或依次读出的文本块（如文件分块读取）"""
+    if isinstance(source, str):
+        source = (source,)
+    sentences = iter_sentences(source)
 
-    if len(text) <= chunk_size:
-        return [text]
+    # 规范化后的全文不超过 chunk_size 时整体作为一个块（保留原文句间是否有空格）
+    head: List[Tuple[str, int, int, bool]] = []
+    head_len = 0
+    for item in sentences:
+        head_len += len(item[0]) + (1 if head and item[3] else 0)
+        head.append(item)
+        if head_len > chunk_size:
+            break
+    else:
+        if head:
+            text = head[0][0] + "".join((" " if gap else "") + s for s, _, _, gap in head[1:])
+            yield Chunk(text, head[0][1], head[-1][2], [(a, b) for _, a, b, _ in head])
+        return
 
     if chunk_overlap >= chunk_size:
         raise ValueError("chunk_overlap must be less than chunk_size")
 
-    # 1. 按句子分割（基于 . ! ? 等结束标点）
-    # 使用正向先行断言保留分隔符，并过滤空句
-    
-    sentences = [s.strip() for s in re.split(r'(?<=[。！？.!?])\s*', text) if s.strip()]
-
-    if not sentences:
-        return [text[:chunk_size]]  # fallback
-
-    chunks = []
-    current_chunk = ""
-    last_chunk = ""
-
-    i = 0
-    total = len(sentences)
-    sentence_iter = tqdm(enumerate(sentences), total=total, disable=not show_progress, desc="Splitting text")
-    while i < total:
-        sentence = sentences[i]
-        # 如果当前块为空，直接加入
-        if not current_chunk:
-            current_chunk = sentence
-            i += 1
-        else:
-            # 尝试加入下一句
-            test_chunk = current_chunk + " " + sentence
-            if len(test_chunk) <= chunk_size:
-                current_chunk = test_chunk
-                i += 1
-            else:
-                # 无法加入，保存当前块
-                chunks.append(current_chunk)
-                last_chunk = current_chunk
-
-                # 计算重叠部分：从上一块末尾回退，找能放入 overlap 长度的句子子序列
-                overlap_text = ""
-                if chunk_overlap > 0 and chunks:
-                    # 从上一个 chunk 的末尾开始，取最多 chunk_overlap 字符的内容
-                    tail = last_chunk[-chunk_overlap:]
-                    overlap_sentences = []
-                    temp_len = 0
-                    for sent in reversed(sentences[:i]):
-                        if temp_len + len(sent) + 1 > chunk_overlap:
-                            break
-                        overlap_sentences.insert(0, sent)
-                        temp_len += len(sent) + 1  # +1 for space
-                    overlap_text = " ".join(overlap_sentences)
-
-                # 下一块以重叠部分开头（如果有的话）
-                if overlap_text:
-                    current_chunk = overlap_text
-                    if not any(sentences[j] not in overlap_text for j in range(i, min(i+1, total))):
-                        pass
-                else:
-                    current_chunk = ""
+    window: Deque[Sentence] = deque()  # 当前块中的句子
+    window_len = 0                     # 当前块以空格连接后的长度
+    fresh = 0                          # 当前块中不属于上一块重叠部分的句子数
+    last_text: Optional[str] = None
+
+    def pending():
+        for s, a, b, _ in head:
+            yield s, a, b
+        for s, a, b, _ in sentences:
+            yield s, a, b
+
+    for sentence in pending():
+        length = len(sentence[0])
+        while True:
+            if not window:
+                window.append(sentence)
+                window_len, fresh = length, 1
+                break
+            if window_len + 1 + length <= chunk_size:
+                window.append(sentence)
+                window_len += 1 + length
+                fresh += 1
+                break
+            if fresh == 0:
+                # 重叠部分加上该句仍放不下：重叠句已在上一块中，直接从该句重新开始
+                window.clear()
+                continue
+
+            # 放不下：输出当前块，从末尾回退取总长（每句另计 1 个空格）不超过 chunk_overlap 的整句作为重叠
+            chunk = _make_chunk(window)
+            last_text = chunk.text
+            yield chunk
+
+            overlap_len = 0
+            keep = 0
+            if chunk_overlap > 0:
+                for s, _, _ in reversed(window):
+                    if overlap_len + len(s) + 1 > chunk_overlap:
+                        break
+                    overlap_len += len(s) + 1
+                    keep += 1
+            while len(window) > keep:
+                window.popleft()
+            window_len, fresh = max(overlap_len - 1, 0), 0
+
+    if window:
+        chunk = _make_chunk(window)
+        if chunk.text != last_text:
+            yield chunk
+
+
+def iter_file_chunks(
+    path: str,
+    chunk_size: int = 400,
+    chunk_overlap: int = 60,
+    encoding: str = "utf-8",
+    block_size: int = READ_BLOCK_SIZE
+) -> Iterator[Chunk]:
+    """分块读取文件并流式切分，偏移对应 open(path, encoding=encoding).read() 中的字符位置"""
+    with open(path, "r", encoding=encoding) as f:
+        yield from iter_chunks(iter(partial(f.read, block_size), ""), chunk_size, chunk_overlap)
 
-    # 添加最后一个块
-    if current_chunk and (not chunks or current_chunk != chunks[-1]):
-        chunks.append(current_chunk)
 
-    # 边界情况：如果结果为空（极短句子等），兜底返回
-    if not chunks:
-        chunks = [text[:chunk_size]]
+def _chunk_file(path: str, chunk_size: int, chunk_overlap: int, encoding: str) -> List[Chunk]:
+    return list(iter_file_chunks(path, chunk_size, chunk_overlap, encoding))
 
-    return chunks
\ No newline at end of file
+
+def chunk_files(
+    paths: Sequence[str],
+    chunk_size: int = 400,
+    chunk_overlap: int = 60,
+    encoding: str = "utf-8",
+    workers: Optional[int] = None
+) -> Iterator[Tuple[str, List[Chunk]]]:
+    """多文件语料切分，按输入顺序产出 (路径, 块列表)；workers > 1 时每个文件在独立进程中切分"""
+    task = partial(_chunk_file, chunk_size=chunk_size, chunk_overlap=chunk_overlap, encoding=encoding)
+    if (workers is not None and workers <= 1) or len(paths) <= 1:
+        for path in paths:
+            yield path, task(path)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        yield from zip(paths, pool.map(task, paths))
+
+
+def split_text(
+    text: str,
+    chunk_size: int = 400,
+    chunk_overlap: int = 60,
+    show_progress: bool = False
+) -> List[str]:
+    chunks = iter_chunks(text, chunk_size, chunk_overlap)
+    return [c.text for c in tqdm(chunks, disable=not show_progress, desc="Splitting text")]
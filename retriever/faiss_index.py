@@ -0,0 +1,168 @@
+import os
+import json
+import faiss
+import numpy as np
+from typing import List, Optional, Tuple
+from config import (
+    FAISS_INDEX_TYPE, HNSW_M, HNSW_EF_CONSTRUCTION, HNSW_EF_SEARCH,
+    IVF_NLIST, IVF_NPROBE, PQ_M, PQ_NBITS, FAISS_MMAP
+)
+
+INDEX_TYPES = ("flat_l2", "flat_ip", "hnsw", "ivfpq")
+
+# 旧版本没有元数据文件，一律是未归一化向量上的 IndexFlatL2
+LEGACY_META = {"type": "flat_l2", "params": {}}
+
+
+def build_config(index_type: Optional[str] = None) -> dict:
+    """影响索引结构的参数；任一变化都需要重建索引"""
+    index_type = index_type or FAISS_INDEX_TYPE
+    if index_type in ("flat_l2", "flat_ip"):
+        return {"type": index_type}
+    if index_type == "hnsw":
+        return {"type": index_type, "m": HNSW_M, "ef_construction": HNSW_EF_CONSTRUCTION}
+    if index_type == "ivfpq":
+        return {"type": index_type, "nlist": IVF_NLIST, "pq_m": PQ_M, "pq_nbits": PQ_NBITS}
+    raise ValueError(f"Unknown FAISS index type: {index_type}（可选：{', '.join(INDEX_TYPES)}）")
+
+
+def search_config() -> dict:
+    """查询期参数，加载索引时设置，修改后无需重建"""
+    return {"ef_search": HNSW_EF_SEARCH, "nprobe": IVF_NPROBE}
+
+
+def is_inner_product(meta: dict) -> bool:
+    return meta["type"] != "flat_l2"
+
+
+def new_index(dim: int, config: dict, n: int = 0) -> Tuple[faiss.Index, dict]:
+    """按配置创建空索引，返回 (index, 元数据)；IVF-PQ 按将加入的向量数 n 确定聚类数，且尚未训练"""
+    index_type = config["type"]
+    params = {k: v for k, v in config.items() if k != "type"}
+
+    if index_type == "ivfpq":
+        if dim % params["pq_m"] != 0:
+            raise ValueError(f"PQ_M={params['pq_m']} 无法整除向量维度 {dim}")
+        if n < 2 ** params["pq_nbits"]:
+            # 训练 PQ 码本至少需要 2^nbits 个向量，语料太小时退回精确检索
+            print(f"向量数 {n} 不足以训练 IVF-PQ，改用 flat_ip")
+            return new_index(dim, {"type": "flat_ip"})
+        # 每个聚类中心至少需要 39 个训练样本
+        params["nlist"] = max(1, min(params["nlist"], n // 39))
+
+    metric = faiss.METRIC_L2 if index_type == "flat_l2" else faiss.METRIC_INNER_PRODUCT
+    if index_type in ("flat_l2", "flat_ip"):
+        description = "Flat"
+    elif index_type == "hnsw":
+        description = f"HNSW{params['m']}"
+    else:
+        description = f"IVF{params['nlist']},PQ{params['pq_m']}x{params['pq_nbits']}"
+
+    index = faiss.index_factory(dim, description, metric)
+    if index_type == "hnsw":
+        index.hnsw.efConstruction = params["ef_construction"]
+    return index, {"type": index_type, "params": params, "dim": dim}
+
+
+def needs_training(config: dict) -> bool:
+    return config["type"] == "ivfpq"
+
+
+def add_vectors(index: faiss.Index, meta: dict, vectors: np.ndarray):
+    """
+    追加一批向量；未训练的索引先用这批向量训练。
+    内积类索引会先归一化向量；传入连续的 float32 数组时原地归一化，避免大语料复制一份
+    """
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    if is_inner_product(meta):
+        faiss.normalize_L2(vectors)
+    if not index.is_trained:
+        index.train(vectors)
+    index.add(vectors)
+
+
+def create_index(vectors: np.ndarray, config: dict) -> Tuple[faiss.Index, dict]:
+    """按配置创建、训练并填充索引，返回 (index, 元数据)"""
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    index, meta = new_index(vectors.shape[1], config, len(vectors))
+    add_vectors(index, meta, vectors)
+    return index, meta
+
+
+class IncrementalIndex:
+    """
+    按块追加向量建索引（如并行编码的分片依次完成时）：无需训练的索引收到即加入；
+    需要训练的（IVF-PQ）先收集全部向量，finish 时训练后一次加入，与 create_index 结果相同
+    """
+
+    def __init__(self, config: dict):
+        self.config = config
+        self.index = None
+        self.meta = None
+        self.ntotal = 0
+        self._pending: List[np.ndarray] = []
+
+    def add(self, vectors: np.ndarray):
+        if needs_training(self.config):
+            self._pending.append(np.asarray(vectors, dtype=np.float32))
+        else:
+            if self.index is None:
+                self.index, self.meta = new_index(vectors.shape[1], self.config)
+            add_vectors(self.index, self.meta, vectors)
+        self.ntotal += len(vectors)
+
+    def finish(self) -> Tuple[faiss.Index, dict, Optional[np.ndarray]]:
+        """返回 (index, 元数据, 收集的向量)；向量仅在需要训练时收集（已归一化），供另存副本"""
+        if not self.ntotal:
+            raise ValueError("没有可加入索引的向量")
+        if not self._pending:
+            return self.index, self.meta, None
+        vectors = self._pending[0] if len(self._pending) == 1 else np.concatenate(self._pending)
+        self._pending = []
+        self.index, self.meta = create_index(vectors, self.config)
+        return self.index, self.meta, vectors
+
+
+def apply_search_params(index: faiss.Index, meta: dict, params: Optional[dict] = None):
+    params = params or search_config()
+    space = faiss.ParameterSpace()
+    if meta["type"] == "hnsw":
+        space.set_index_parameter(index, "efSearch", params["ef_search"])
+    elif meta["type"] == "ivfpq":
+        space.set_index_parameter(index, "nprobe", params["nprobe"])
+
+
+def read_index(index_path: str, meta: dict, mmap: Optional[bool] = None) -> Tuple[faiss.Index, bool]:
+    """
+    读取索引，返回 (index, 是否以 mmap 方式打开)。
+    IVF 的倒排表用 IO_FLAG_MMAP 映射；Flat/HNSW 的向量用 IO_FLAG_MMAP_IFC 映射（较新的 faiss 才支持），
+    两个标志不能同时使用。不支持时退回完整读入内存
+    """
+    if FAISS_MMAP if mmap is None else mmap:
+        flags = faiss.IO_FLAG_MMAP if meta["type"] == "ivfpq" else getattr(faiss, "IO_FLAG_MMAP_IFC", None)
+        if flags is not None:
+            try:
+                return faiss.read_index(index_path, flags | faiss.IO_FLAG_READ_ONLY), True
+            except RuntimeError:
+                pass
+    return faiss.read_index(index_path), False
+
+
+def meta_path(index_path: str) -> str:
+    return index_path + ".meta.json"
+
+
+def save_meta(index_path: str, meta: dict):
+    # 先写临时文件再替换，崩溃时不会留下写了一半的元数据
+    path = meta_path(index_path)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+    os.replace(path + ".tmp", path)
+
+
+def load_meta(index_path: str) -> dict:
+    path = meta_path(index_path)
+    if not os.path.exists(path):
+        return dict(LEGACY_META)
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
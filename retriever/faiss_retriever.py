@@ -1,11 +1,20 @@
 import os
 import faiss
 import numpy as np
-from typing import List, Optional
+from typing import List, Optional, Tuple
 from models.embedding import EmbeddingModel
+from models.reranker import Reranker
 from retriever.base import BaseRetriever
-from config import EMBEDDING_MODEL_NAME
-from sentence_transformers import CrossEncoder
+from retriever.chunk_store import ChunkStore
+from retriever.faiss_index import (
+    build_config, create_index, apply_search_params, is_inner_product, save_meta, load_meta,
+    read_index, LEGACY_META
+)
+from core import tracing
+from config import EMBEDDING_MODEL_NAME, FAISS_MMAP
+
+# 旧版本写在工作目录下的 chunk 缓存，仅用于迁移
+LEGACY_CHUNKS_PATH = "chunks_cache.txt"
 
 
 class FaissRetriever(BaseRetriever):
@@ -16,69 +25,182 @@ class FaissRetriever(BaseRetriever):
         use_rerank: bool = False
     ):
         self.index_path = index_path
+        self.chunk_store_path = index_path + ".chunks"
+        self.vectors_path = index_path + ".vectors.npy"
         self.embedder = EmbeddingModel(EMBEDDING_MODEL_NAME)
         self.chunks: List[str] = []
         self.index = None
+        self.index_meta = dict(LEGACY_META)
+        self.mmapped = False
         self.use_rerank = use_rerank
         self.reranker = None
 
         if use_rerank:
-            if CrossEncoder is None:
-                raise ImportError(
-                    "Please install sentence-transformers to enable re-ranking: "
-                    "pip install sentence-transformers"
-                )
-            # 默认使用支持中英双语的 reranker
-            model = reranker_model_name or "BAAI/bge-reranker-base"
-            self.reranker = CrossEncoder(model)
+            self.reranker = Reranker(reranker_model_name)
 
     def build_index(self, chunks: List[str]):
-        self.chunks = chunks
         embeddings = self.embedder.encode(chunks, convert_to_numpy=True, show_progress_bar=True)
-        embeddings = embeddings.astype(np.float32)  # FAISS 要求 float32
-        dim = embeddings.shape[1]
-        self.index = faiss.IndexFlatL2(dim)
-        self.index.add(embeddings)
-        faiss.write_index(self.index, self.index_path)
+        self._write_index(chunks, embeddings)
+
+    def update_index(self, chunks: List[str], reuse_embeddings: bool = True):
+        if not reuse_embeddings or not self.exists():
+            self.build_index(chunks)
+            return
+        self.load_index()
+
+        # 按 chunk 内容复用旧向量，只对新增或变更的 chunk 重新编码
+        old_ids = {}
+        for i, chunk in enumerate(self.chunks):
+            old_ids.setdefault(chunk, i)
+        reused = {i: old_ids[c] for i, c in enumerate(chunks) if c in old_ids}
+
+        old_vectors = self._stored_vectors()
+        if old_vectors is None:
+            # IVF-PQ 等有损索引且没有向量副本时无法复用
+            reused = {}
+        changed = [i for i in range(len(chunks)) if i not in reused]
+        print(f"FAISS 增量更新：复用 {len(reused)} 个 chunk，重新编码 {len(changed)} 个")
+
+        dim = self.index.d
+        embeddings = np.empty((len(chunks), dim), dtype=np.float32)
+        if reused:
+            new_rows = np.fromiter(reused.keys(), dtype=np.int64)
+            old_rows = np.fromiter(reused.values(), dtype=np.int64)
+            embeddings[new_rows] = old_vectors[old_rows]
+        if changed:
+            embeddings[changed] = self.embedder.encode(
+                [chunks[i] for i in changed], convert_to_numpy=True, show_progress_bar=True
+            )
+        del old_vectors  # 释放对旧向量副本的映射，随后会被覆盖
+        self._write_index(chunks, embeddings)
+
+    def _write_index(self, chunks: List[str], embeddings: np.ndarray):
+        embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)  # FAISS 要求 float32
+        self.index = None  # 先释放旧索引（可能映射着要被替换的文件）
+        index, meta = create_index(embeddings, build_config())
+        self.install_index(chunks, index, meta, embeddings)
+
+    def install_index(
+        self, chunks: List[str], index: faiss.Index, meta: dict, embeddings: Optional[np.ndarray] = None
+    ):
+        """
+        保存建好的索引与 chunk 并切换过去（离线并行建索引时由 IncrementalIndex 逐块建好）。
+        embeddings 为归一化后的全部向量，仅有损索引需要
+        """
+        self.index, self.index_meta = index, meta
+        self.mmapped = False
+        apply_search_params(self.index, self.index_meta)
+        # 先写临时文件再替换，其他进程仍映射着的旧索引不受影响；
+        # 元数据在索引替换前原子写好，崩溃时不会出现新索引配着旧的或写了一半的元数据
+        faiss.write_index(self.index, self.index_path + ".tmp")
+        save_meta(self.index_path, self.index_meta)
+        os.replace(self.index_path + ".tmp", self.index_path)
+        if FAISS_MMAP:
+            # 以 mmap 方式重新打开，释放刚建好的内存副本
+            self.index, self.mmapped = read_index(self.index_path, self.index_meta)
+            apply_search_params(self.index, self.index_meta)
+
+        # 有损索引无法还原原始向量，另存一份 fp16 副本供增量更新复用
+        if self._is_lossy():
+            if embeddings is None:
+                raise ValueError("有损索引需要同时提供原始向量")
+            np.save(self.vectors_path, embeddings.astype(np.float16))
+        elif os.path.exists(self.vectors_path):
+            os.remove(self.vectors_path)
         self.save_chunks(chunks)
+        self._clear_rerank_cache()
+
+    def _is_lossy(self) -> bool:
+        return self.index_meta["type"] == "ivfpq"
 
-    def retrieve(self, query: str, top_k: int = 3) -> List[str]:
+    def _stored_vectors(self) -> Optional[np.ndarray]:
+        if os.path.exists(self.vectors_path):
+            vectors = np.load(self.vectors_path, mmap_mode="r")
+            if len(vectors) == self.index.ntotal:
+                return vectors
+        if self._is_lossy():
+            return None
+        return self.index.reconstruct_n(0, self.index.ntotal)
+
+    def _encode_queries(self, queries: List[str], query_embeddings=None) -> np.ndarray:
+        if query_embeddings is not None:
+            # 复制一份再归一化，不改动调用方的向量
+            q_emb = np.array(query_embeddings, dtype=np.float32)
+        else:
+            with tracing.span("embed"):
+                q_emb = np.ascontiguousarray(
+                    self.embedder.encode(queries, convert_to_numpy=True), dtype=np.float32
+                )
+        if is_inner_product(self.index_meta):
+            faiss.normalize_L2(q_emb)
+        return q_emb
+
+    def search(self, query: str, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """第一阶段向量召回，返回 (chunk ids, 分数)，分数越大越相关"""
+        return self.search_batch([query], k)[0]
+
+    def search_batch(self, queries: List[str], k: int, query_embeddings=None) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """多个问题一次编码（已提供问题向量时跳过）、一次多行检索"""
         if self.index is None:
             raise RuntimeError("FAISS 索引未加载！请先调用 build_index() 或 load_index()")
+        q_emb = self._encode_queries(queries, query_embeddings)
+        with tracing.span("faiss_search"):
+            D, I = self.index.search(q_emb, min(self.index.ntotal, k))
+        results = []
+        for d, i in zip(D, I):
+            # 近似索引结果不足时会返回 -1
+            mask = i >= 0
+            scores = d[mask]
+            if not is_inner_product(self.index_meta):
+                scores = -scores  # L2 距离越小越相关
+            results.append((i[mask], scores))
+            tracing.incr("rag_candidates_total", int(mask.sum()), retriever="faiss")
+        return results
+
+    def retrieve_ids(self, query: str, top_k: int = 3) -> List[int]:
+        return self.retrieve_ids_batch([query], top_k)[0]
 
+    def retrieve_ids_batch(self, queries: List[str], top_k: int = 3, query_embeddings=None) -> List[List[int]]:
         # 第一阶段：FAISS 向量召回
-        q_emb = self.embedder.encode([query], convert_to_numpy=True).astype(np.float32)
-        candidate_k = min(self.index.ntotal, top_k * 5 if self.use_rerank else top_k)
-        _, I = self.index.search(q_emb, candidate_k)
-        indices = I[0]
-        candidates = [self.chunks[i] for i in indices if i < len(self.chunks)]
+        candidate_k = top_k * 5 if self.use_rerank else top_k
+        results = self.search_batch(queries, candidate_k, query_embeddings)
 
         # 第二阶段：Cross-Encoder 重排（可选）
         if self.use_rerank and self.reranker is not None:
-            pairs = [[query, doc] for doc in candidates]
-            rerank_scores = self.reranker.predict(pairs)
-            reranked = sorted(zip(candidates, rerank_scores), key=lambda x: x[1], reverse=True)
-            results = [doc for doc, _ in reranked[:top_k]]
-        else:
-            results = candidates[:top_k]
-
-        return results
+            return self.reranker.rerank_batch(
+                queries,
+                [ids for ids, _ in results],
+                [[self.chunks[i] for i in ids] for ids, _ in results],
+                top_k,
+                [scores for _, scores in results]
+            )
+        return [[int(i) for i in ids[:top_k]] for ids, _ in results]
 
     def exists(self) -> bool:
-        return os.path.exists(self.index_path) and os.path.exists("chunks_cache.txt")
+        return os.path.exists(self.index_path) and (
+            ChunkStore.exists(self.chunk_store_path) or os.path.exists(LEGACY_CHUNKS_PATH)
+        )
 
     def save_chunks(self, chunks: List[str]):
-        with open("chunks_cache.txt", "w", encoding="utf-8") as f:
-            f.write("\n===CHUNK===\n".join(chunks))
+        if isinstance(self.chunks, ChunkStore):
+            self.chunks.close()  # Windows 下被映射的文件无法替换
+        self.chunks = ChunkStore.write(self.chunk_store_path, chunks)
 
-    def load_chunks(self) -> List[str]:
-        with open("chunks_cache.txt", "r", encoding="utf-8") as f:
-            text = f.read()
-            self.chunks = [chunk for chunk in text.split("===CHUNK===\n") if chunk.strip()]
+    def load_chunks(self) -> ChunkStore:
+        if not ChunkStore.exists(self.chunk_store_path):
+            # 兼容旧版本的 chunks_cache.txt，读取一次后转存为 chunk store
+            with open(LEGACY_CHUNKS_PATH, "r", encoding="utf-8") as f:
+                text = f.read()
+            self.save_chunks([chunk for chunk in text.split("\n===CHUNK===\n") if chunk.strip()])
             return self.chunks
+        self.chunks = ChunkStore.open(self.chunk_store_path)
+        return self.chunks
 
     def load_index(self):
         if not os.path.exists(self.index_path):
             raise FileNotFoundError(f"FAISS 索引文件不存在: {self.index_path}")
-        self.index = faiss.read_index(self.index_path)
-        self.load_chunks()
\ No newline at end of file
+        self.index_meta = load_meta(self.index_path)
+        self.index, self.mmapped = read_index(self.index_path, self.index_meta)
+        apply_search_params(self.index, self.index_meta)
+        self.load_chunks()
+        self._clear_rerank_cache()
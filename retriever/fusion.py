@@ -0,0 +1,54 @@
+import numpy as np
+from collections import defaultdict
+from typing import List, Sequence, Tuple
+
+FUSION_METHODS = ("rrf", "linear")
+
+
+def rrf_fusion(
+    rankings: List[Sequence[int]],
+    weights: Sequence[float],
+    k: int = 60
+) -> Tuple[List[int], List[float]]:
+    """加权 RRF：score(d) = Σ w_i / (k + rank_i(d))，rank 从 1 开始"""
+    scores = defaultdict(float)
+    for ranking, weight in zip(rankings, weights):
+        for rank, chunk_id in enumerate(ranking, start=1):
+            scores[int(chunk_id)] += weight / (k + rank)
+    ranked = sorted(scores.items(), key=lambda x: x[1], reverse=True)
+    return [i for i, _ in ranked], [s for _, s in ranked]
+
+
+def linear_fusion(
+    results: List[Tuple[Sequence[int], Sequence[float]]],
+    weights: Sequence[float]
+) -> Tuple[List[int], List[float]]:
+    """
+    分数归一化线性融合：每路分数先做 min-max 归一化到 [0, 1]，再按权重相加。
+    某路未召回的 chunk 在该路记 0 分
+    """
+    scores = defaultdict(float)
+    for (ids, raw), weight in zip(results, weights):
+        raw = np.asarray(raw, dtype=np.float64)
+        if len(raw) == 0:
+            continue
+        span = raw.max() - raw.min()
+        normed = (raw - raw.min()) / span if span > 0 else np.ones_like(raw)
+        for chunk_id, s in zip(ids, normed):
+            scores[int(chunk_id)] += weight * float(s)
+    ranked = sorted(scores.items(), key=lambda x: x[1], reverse=True)
+    return [i for i, _ in ranked], [s for _, s in ranked]
+
+
+def fuse(
+    results: List[Tuple[Sequence[int], Sequence[float]]],
+    method: str = "rrf",
+    weights: Sequence[float] = (1.0, 1.0),
+    rrf_k: int = 60
+) -> Tuple[List[int], List[float]]:
+    """融合多路召回结果（每路为按分数降序的 (chunk ids, 原始分数)），返回融合后的 (ids, 分数)"""
+    if method == "rrf":
+        return rrf_fusion([ids for ids, _ in results], weights, k=rrf_k)
+    if method == "linear":
+        return linear_fusion(results, weights)
+    raise ValueError(f"Unknown fusion method: {method}（可选：{', '.join(FUSION_METHODS)}）")
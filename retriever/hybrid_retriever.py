@@ -1,8 +1,11 @@
-from typing import List, Optional
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Sequence
+from models.reranker import Reranker
 from retriever.base import BaseRetriever
 from retriever.faiss_retriever import FaissRetriever
 from retriever.bm25_retriever import BM25Retriever
-from collections import defaultdict
+from retriever.fusion import fuse
+from core import tracing
 
 
 class HybridRetriever(BaseRetriever):
@@ -11,7 +14,10 @@ class HybridRetriever(BaseRetriever):
         faiss_path: str = "novel_index.faiss",
         bm25_path: str = "bm25_index.pkl",
         use_rerank: bool = False,
-        reranker_model_name: Optional[str] = None
+        reranker_model_name: Optional[str] = None,
+        fusion: str = "rrf",
+        weights: Sequence[float] = (1.0, 1.0),
+        rrf_k: int = 60
     ):
         # 初始化子 retriever，传递 rerank 配置
         self.faiss = FaissRetriever(
@@ -22,65 +28,64 @@ class HybridRetriever(BaseRetriever):
             index_path=bm25_path,
             use_rerank=False,  # 同上
         )
+        self.fusion = fusion
+        self.weights = tuple(weights)  # (FAISS, BM25)
+        self.rrf_k = rrf_k
         self.use_rerank = use_rerank
         self.reranker = None
+        # FAISS 检索与 numpy 计算会释放 GIL，两路召回可以真正并发
+        self._pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="hybrid-recall")
 
         if use_rerank:
-            try:
-                from sentence_transformers import CrossEncoder
-                model = reranker_model_name or "BAAI/bge-reranker-base"
-                self.reranker = CrossEncoder(model)
-            except ImportError:
-                raise ImportError(
-                    "Please install sentence-transformers for re-ranking: "
-                    "pip install sentence-transformers"
-                )
+            self.reranker = Reranker(reranker_model_name)
+
+    @property
+    def chunks(self):
+        return self.faiss.chunks
 
     def build_index(self, chunks: List[str]):
         # 构建两个索引
         self.faiss.build_index(chunks)
         self.bm25.build_index(chunks)
+        self._clear_rerank_cache()
 
+    def update_index(self, chunks: List[str], reuse_embeddings: bool = True):
+        self.faiss.update_index(chunks, reuse_embeddings=reuse_embeddings)
+        self.bm25.update_index(chunks)
+        self._clear_rerank_cache()
 
-    def retrieve(self, query: str, top_k: int = 3) -> List[str]:
-        # 第一阶段：分别召回（取稍多一点，用于融合）
-        recall_k = max(top_k * 2, 10)  # 至少取10个，避免漏掉
-
-        faiss_results = self.faiss.retrieve(query, top_k=recall_k)
-        bm25_results = self.bm25.retrieve(query, top_k=recall_k)
-
-        # 过滤空字符串
-        faiss_results = [doc.strip() for doc in faiss_results if doc.strip()]
-        bm25_results = [doc.strip() for doc in bm25_results if doc.strip()]
-
-        # === RRF 融合 ===
-        k_rrf = 60  # RRF 平滑常数，通常设为60
-        rrf_scores = defaultdict(float)
+    def retrieve_ids(self, query: str, top_k: int = 3) -> List[int]:
+        return self.retrieve_ids_batch([query], top_k)[0]
 
-        # 给 FAISS 结果打分（rank 从 1 开始）
-        for rank, doc in enumerate(faiss_results, start=1):
-            rrf_scores[doc] += 1.0 / (k_rrf + rank)
-
-        # 给 BM25 结果打分
-        for rank, doc in enumerate(bm25_results, start=1):
-            rrf_scores[doc] += 1.0 / (k_rrf + rank)
+    def retrieve_ids_batch(self, queries: List[str], top_k: int = 3, query_embeddings=None) -> List[List[int]]:
+        # 第一阶段：两路并发召回（取稍多一点，用于融合）
+        recall_k = max(top_k * 2, 10)  # 至少取10个，避免漏掉
+        faiss_future = tracing.run_in_context(self._pool, self.faiss.search_batch, queries, recall_k, query_embeddings)
+        bm25_future = tracing.run_in_context(self._pool, self.bm25.search_batch, queries, recall_k)
+        recalled = list(zip(faiss_future.result(), bm25_future.result()))
 
-        # 按 RRF 分数降序排序
-        rrf_ranked = sorted(rrf_scores.items(), key=lambda x: x[1], reverse=True)
-        candidates = [doc for doc, _ in rrf_ranked]
+        # 按 chunk id 融合（RRF 或分数归一化线性加权）
+        with tracing.span("fusion"):
+            fused = [
+                fuse(list(results), method=self.fusion, weights=self.weights, rrf_k=self.rrf_k)
+                for results in recalled
+            ]
 
         # 如果不需要 rerank，直接返回 top_k
         if not self.use_rerank or self.reranker is None:
-            return "\n".join(candidates[:top_k])
+            return [candidates[:top_k] for candidates, _ in fused]
 
         # === 第二阶段：Cross-Encoder 重排（可选）===
-        rerank_candidates = candidates[:top_k * 2]  # 可选：只重排前 N 个以节省计算
-        pairs = [[query, doc] for doc in rerank_candidates]
-        scores = self.reranker.predict(pairs)
-        reranked = sorted(zip(rerank_candidates, scores), key=lambda x: x[1], reverse=True)
-        final_results = [doc for doc, _ in reranked[:top_k]]
-
-        return final_results
+        # 只重排融合后的前 top_k * 2 个以节省计算；候选数已不超过 top_k * RERANK_SHRINK_FACTOR（默认 2），
+        # 级联的缩减分支对混合检索不起作用，只有跳过分支生效
+        rerank_candidates = [candidates[:top_k * 2] for candidates, _ in fused]
+        return self.reranker.rerank_batch(
+            queries,
+            rerank_candidates,
+            [[self.chunks[i] for i in ids] for ids in rerank_candidates],
+            top_k,
+            [scores[:top_k * 2] for _, scores in fused]
+        )
 
     def exists(self) -> bool:
         return self.faiss.exists() and self.bm25.exists()
@@ -88,4 +93,8 @@ class HybridRetriever(BaseRetriever):
     def load_index(self):
         # 分别加载索引（无需传 chunks）
         self.faiss.load_index()
-        self.bm25.load_index()
\ No newline at end of file
+        self.bm25.load_index()
+        # 融合按 chunk id 进行，两个索引必须来自同一份切分结果
+        if len(self.faiss.chunks) != len(self.bm25.chunks):
+            raise RuntimeError("FAISS 与 BM25 索引的 chunk 数不一致，请删除索引文件后重建")
+        self._clear_rerank_cache()
@@ -0,0 +1,348 @@
+"""
+离线并行建索引：
+- 流式切分小说，每 shard_size 个 chunk 为一个分片，交给进程池编码（嵌入）与分词（jieba）；
+  切分与编码同时进行，进程池中最多排队 2 × workers 个分片
+- 每个分片完成后结果落盘（向量可选 fp16）并记入断点；中断后重新运行，内容未变的分片直接读取
+- 分片按顺序边完成边加入 FAISS 索引，最后写出与 RAGEngine 相同的索引文件、清单与 chunk 偏移，
+  之后 RAGEngine 启动时直接加载
+- 结束时报告各阶段的 chunks/s
+
+命令行入口为项目根目录的 build_index.py。
+"""
+import os
+import time
+import pickle
+import shutil
+import hashlib
+import contextlib
+import multiprocessing
+from collections import Counter, deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from functools import partial
+from typing import Deque, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+from tqdm import tqdm
+
+from config import (
+    CHUNK_SIZE, CHUNK_OVERLAP, EMBEDDING_MODEL_NAME, EMBEDDING_BACKEND, RETRIEVER_TYPE, CPU_NUM_THREADS,
+    INDEX_BUILD_WORKERS, INDEX_BUILD_SHARD_SIZE, INDEX_BUILD_FP16
+)
+from retriever.chunking import READ_BLOCK_SIZE, iter_chunks
+from retriever.manifest import (
+    build_manifest, load_manifest, save_manifest, manifest_path_for, spans_path_for,
+    settings_match, source_stat, source_unchanged, text_hash
+)
+
+CHECKPOINT_FILE = "checkpoint.json"
+STAGES = (
+    ("chunk", "切分"), ("embed", "编码"), ("tokenize", "分词"),
+    ("save", "分片落盘"), ("index", "加入索引"), ("write", "写出索引"),
+)
+WORKER_STAGES = ("embed", "tokenize")
+
+ShardResult = Tuple[Optional[np.ndarray], Optional[List[Dict[str, int]]]]
+
+
+# ---------- 子进程 ----------
+
+_worker: dict = {}
+
+
+def _init_worker(embed: bool, tokenize: bool, threads: int, batch_size: int):
+    """每个进程各加载一次嵌入模型与分词词典"""
+    if embed:
+        if threads and not CPU_NUM_THREADS:
+            # 每个进程默认都用全部核心，多进程时互相争抢，按进程数均分
+            import torch
+            torch.set_num_threads(threads)
+        from models.embedding import EmbeddingModel
+        _worker["embedder"] = EmbeddingModel(EMBEDDING_MODEL_NAME)
+        _worker["batch_size"] = batch_size
+    if tokenize:
+        import jieba
+        from retriever.bm25_retriever import tokenize as tokenize_text
+        jieba.initialize()  # 词典在首次分词时才加载，提前加载以免计入分词耗时
+        _worker["tokenize"] = tokenize_text
+
+
+def _process_shard(texts: List[str]) -> Tuple[Optional[np.ndarray], Optional[List[Counter]], Dict[str, float]]:
+    """编码并分词一个分片，返回 (向量, 各 chunk 的词频, 各阶段耗时)"""
+    vectors = counts = None
+    seconds = {}
+    embedder = _worker.get("embedder")
+    if embedder is not None:
+        start = time.perf_counter()
+        vectors = np.asarray(
+            embedder.encode(texts, batch_size=_worker["batch_size"], convert_to_numpy=True), dtype=np.float32
+        )
+        seconds["embed"] = time.perf_counter() - start
+    tokenize = _worker.get("tokenize")
+    if tokenize is not None:
+        start = time.perf_counter()
+        counts = [Counter(tokenize(text)) for text in texts]
+        seconds["tokenize"] = time.perf_counter() - start
+    return vectors, counts, seconds
+
+
+# ---------- 主进程 ----------
+
+class IndexBuilder:
+    def __init__(
+        self,
+        index_path: str = "novel_index",
+        workers: int = INDEX_BUILD_WORKERS,
+        shard_size: int = INDEX_BUILD_SHARD_SIZE,
+        batch_size: int = 32,
+        fp16: bool = INDEX_BUILD_FP16
+    ):
+        """
+        index_path: 索引路径前缀，与 RAGEngine 的 index_path 相同
+        workers: 编码与分词的进程数，0 表示 CPU 核数，1 表示在本进程中完成
+        batch_size: 嵌入模型每次前向的 chunk 数
+        """
+        self.index_path = index_path
+        self.build_dir = index_path + ".build"
+        self.workers = workers or os.cpu_count() or 1
+        self.shard_size = max(1, shard_size)
+        self.batch_size = batch_size
+        self.fp16 = fp16
+        self.embed = RETRIEVER_TYPE in ("faiss", "hybrid")
+        self.tokenize = RETRIEVER_TYPE in ("bm25", "hybrid")
+        self.seconds = {name: 0.0 for name, _ in STAGES}
+        self.processed = 0  # 本次编码/分词的 chunk 数（不含从断点读取的）
+
+    def build(self, novel_path: str, resume: bool = True, force: bool = False) -> dict:
+        """建索引并写出清单，返回清单；resume=False 时丢弃已有断点，force=False 时索引已是最新则直接返回"""
+        from retriever import get_retriever, current_index_settings
+        from retriever.faiss_index import IncrementalIndex, build_config
+
+        settings = current_index_settings()
+        manifest_path = manifest_path_for(self.index_path)
+        retriever = get_retriever(self.index_path)
+        old_manifest = load_manifest(manifest_path)
+        if (
+            not force and retriever.exists() and settings_match(old_manifest, settings)
+            and source_unchanged(old_manifest, novel_path)
+        ):
+            print(f"索引已是最新：{self.index_path}")
+            return old_manifest
+
+        checkpoint = self._open_checkpoint(resume)
+        if checkpoint["shards"]:
+            print(f"从断点恢复：已完成 {len(checkpoint['shards'])} 个分片（{self.build_dir}）")
+
+        wall_start = time.perf_counter()
+        source_hash = hashlib.sha1()
+        chunks: List[str] = []
+        spans: List[Tuple[int, int]] = []
+        doc_counts: List[Dict[str, int]] = []
+        vectors_index = IncrementalIndex(build_config()) if self.embed else None
+
+        with self._executor() as pool, tqdm(desc="建索引", unit="chunk") as bar:
+            shards = self._iter_shards(novel_path, source_hash, chunks, spans)
+            for texts, vectors, counts in self._pipeline(pool, shards, checkpoint):
+                if vectors_index is not None:
+                    start = time.perf_counter()
+                    vectors_index.add(vectors)
+                    self.seconds["index"] += time.perf_counter() - start
+                if counts is not None:
+                    doc_counts.extend(counts)
+                bar.update(len(texts))
+        if not chunks:
+            raise ValueError(f"小说为空，没有可索引的内容：{novel_path}")
+
+        start = time.perf_counter()
+        faiss_part, bm25_part = self._parts(retriever)
+        if faiss_part is not None:
+            index, meta, embeddings = vectors_index.finish()
+            faiss_part.install_index(chunks, index, meta, embeddings)
+        if bm25_part is not None:
+            bm25_part.build_index(chunks, doc_counts=doc_counts)
+        self._save_spans(np.array(spans, dtype=np.int64).reshape(-1, 2))
+        manifest = build_manifest(source_hash.hexdigest(), chunks, settings)
+        manifest.update(source_stat(novel_path))
+        save_manifest(manifest_path, manifest)
+        self.seconds["write"] += time.perf_counter() - start
+
+        shutil.rmtree(self.build_dir, ignore_errors=True)
+        self.report(len(chunks), time.perf_counter() - wall_start)
+        return manifest
+
+    # ---------- 流水线 ----------
+
+    def _read_blocks(self, path: str, source_hash) -> Iterator[str]:
+        # 与 RAGEngine 读入全文后计算的哈希相同：逐块累加 UTF-8 编码
+        with open(path, "r", encoding="utf-8") as f:
+            for block in iter(partial(f.read, READ_BLOCK_SIZE), ""):
+                source_hash.update(block.encode("utf-8"))
+                yield block
+
+    def _iter_shards(
+        self, novel_path: str, source_hash, chunks: List[str], spans: List[Tuple[int, int]]
+    ) -> Iterator[Tuple[int, List[str]]]:
+        """流式切分，每凑满一个分片产出 (分片号, chunk 文本)；同时收集全部 chunk 与偏移"""
+        pieces = iter_chunks(self._read_blocks(novel_path, source_hash), CHUNK_SIZE, CHUNK_OVERLAP)
+        number = 0
+        texts: List[str] = []
+        while True:
+            start = time.perf_counter()
+            chunk = next(pieces, None)
+            self.seconds["chunk"] += time.perf_counter() - start
+            if chunk is None:
+                break
+            chunks.append(chunk.text)
+            spans.append((chunk.start, chunk.end))
+            texts.append(chunk.text)
+            if len(texts) == self.shard_size:
+                yield number, texts
+                number, texts = number + 1, []
+        if texts:
+            yield number, texts
+
+    def _pipeline(
+        self, pool: Optional[ProcessPoolExecutor], shards: Iterator[Tuple[int, List[str]]], checkpoint: dict
+    ) -> Iterator[Tuple[List[str], Optional[np.ndarray], Optional[List[Dict[str, int]]]]]:
+        """按分片顺序产出 (chunk 文本, 向量, 词频)；断点中内容相同的分片直接读盘，其余提交给进程池"""
+        pending: Deque[Tuple[int, str, List[str], Optional[Future]]] = deque()
+        limit = 2 * self.workers
+        for number, texts in shards:
+            digest = text_hash("".join(text_hash(t) for t in texts))
+            future = None
+            if checkpoint["shards"].get(str(number)) != digest or not self._has_shard(number):
+                if pool is not None:
+                    future = pool.submit(_process_shard, texts)
+                else:
+                    future = Future()
+                    future.set_result(_process_shard(texts))
+            pending.append((number, digest, texts, future))
+            while len(pending) > limit:
+                yield self._finish(pending.popleft(), checkpoint)
+        while pending:
+            yield self._finish(pending.popleft(), checkpoint)
+
+    def _finish(self, item, checkpoint: dict):
+        number, digest, texts, future = item
+        if future is None:
+            return (texts,) + self._load_shard(number)
+        vectors, counts, seconds = future.result()
+        for stage, value in seconds.items():
+            self.seconds[stage] += value
+        self.processed += len(texts)
+
+        start = time.perf_counter()
+        if vectors is not None and self.fp16:
+            # 断点续跑时读回的是 fp16，本次也用同样舍入后的向量，两种情况建出的索引相同
+            vectors = vectors.astype(np.float16)
+        self._save_shard(number, vectors, counts)
+        checkpoint["shards"][str(number)] = digest
+        save_manifest(self._checkpoint_path(), checkpoint)
+        self.seconds["save"] += time.perf_counter() - start
+        return texts, None if vectors is None else vectors.astype(np.float32, copy=False), counts
+
+    def _executor(self):
+        if self.workers <= 1:
+            _init_worker(self.embed, self.tokenize, 0, self.batch_size)
+            return contextlib.nullcontext(None)
+        # 主进程已导入 faiss（OpenMP），fork 出的子进程再用多线程推理可能卡死，改用 spawn
+        return ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(self.embed, self.tokenize, max(1, (os.cpu_count() or 1) // self.workers), self.batch_size),
+        )
+
+    @staticmethod
+    def _parts(retriever):
+        """返回 (FAISS 检索器, BM25 检索器)，当前检索器类型不用的一路为 None"""
+        if RETRIEVER_TYPE == "hybrid":
+            return retriever.faiss, retriever.bm25
+        if RETRIEVER_TYPE == "faiss":
+            return retriever, None
+        return None, retriever
+
+    # ---------- 分片与断点 ----------
+
+    def _checkpoint_path(self) -> str:
+        return os.path.join(self.build_dir, CHECKPOINT_FILE)
+
+    def _checkpoint_settings(self) -> dict:
+        # 任一项变化时分片结果不能复用
+        return {
+            "chunk_size": CHUNK_SIZE,
+            "chunk_overlap": CHUNK_OVERLAP,
+            "shard_size": self.shard_size,
+            "embedding_model": EMBEDDING_MODEL_NAME if self.embed else None,
+            "embedding_backend": EMBEDDING_BACKEND if self.embed else None,
+            "fp16": self.fp16,
+            "tokenize": self.tokenize,
+        }
+
+    def _open_checkpoint(self, resume: bool) -> dict:
+        settings = self._checkpoint_settings()
+        # 断点与清单一样是小 JSON 文件，沿用清单的读取与原子写入
+        checkpoint = load_manifest(self._checkpoint_path()) if resume else None
+        if checkpoint is None or checkpoint.get("settings") != settings:
+            shutil.rmtree(self.build_dir, ignore_errors=True)
+            os.makedirs(self.build_dir)
+            checkpoint = {"settings": settings, "shards": {}}
+            save_manifest(self._checkpoint_path(), checkpoint)
+        return checkpoint
+
+    def _shard_paths(self, number: int) -> Tuple[str, str]:
+        prefix = os.path.join(self.build_dir, f"shard-{number:05d}")
+        return prefix + ".vectors.npy", prefix + ".counts.pkl"
+
+    def _has_shard(self, number: int) -> bool:
+        vectors_path, counts_path = self._shard_paths(number)
+        return (not self.embed or os.path.exists(vectors_path)) and (
+            not self.tokenize or os.path.exists(counts_path)
+        )
+
+    def _save_shard(self, number: int, vectors: Optional[np.ndarray], counts: Optional[List[Dict[str, int]]]):
+        # 先写临时文件再替换，中断时不会留下写了一半的分片
+        vectors_path, counts_path = self._shard_paths(number)
+        if vectors is not None:
+            with open(vectors_path + ".tmp", "wb") as f:
+                np.save(f, vectors)
+            os.replace(vectors_path + ".tmp", vectors_path)
+        if counts is not None:
+            with open(counts_path + ".tmp", "wb") as f:
+                pickle.dump([dict(c) for c in counts], f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(counts_path + ".tmp", counts_path)
+
+    def _load_shard(self, number: int) -> ShardResult:
+        vectors_path, counts_path = self._shard_paths(number)
+        vectors = counts = None
+        if self.embed:
+            vectors = np.load(vectors_path).astype(np.float32, copy=False)
+        if self.tokenize:
+            with open(counts_path, "rb") as f:
+                counts = pickle.load(f)
+        return vectors, counts
+
+    def _save_spans(self, spans: np.ndarray):
+        path = spans_path_for(self.index_path)
+        with open(path + ".tmp", "wb") as f:
+            np.save(f, spans)
+        os.replace(path + ".tmp", path)
+
+    # ---------- 报告 ----------
+
+    def report(self, num_chunks: int, wall_seconds: float):
+        reused = num_chunks - self.processed
+        print(
+            f"共 {num_chunks} 个 chunk（{reused} 个读自断点），{self.workers} 个进程，"
+            f"总耗时 {wall_seconds:.1f}s，{num_chunks / max(wall_seconds, 1e-9):.0f} chunks/s"
+        )
+        for stage, name in STAGES:
+            seconds = self.seconds[stage]
+            if not seconds:
+                continue
+            if stage in WORKER_STAGES:
+                # 各进程耗时之和，得到的是单进程吞吐；并行时整体约再乘以进程数
+                print(f"  {name}: {seconds:.1f}s（各进程合计），单进程 {self.processed / seconds:.0f} chunks/s")
+            elif stage == "save":
+                print(f"  {name}: {seconds:.1f}s，{self.processed / seconds:.0f} chunks/s")
+            else:
+                print(f"  {name}: {seconds:.1f}s，{num_chunks / seconds:.0f} chunks/s")
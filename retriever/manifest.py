@@ -0,0 +1,94 @@
+import os
+import json
+import hashlib
+from typing import List, Optional
+
+MANIFEST_VERSION = 2
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+def manifest_path_for(index_path: str) -> str:
+    return index_path + ".manifest.json"
+
+
+def spans_path_for(index_path: str) -> str:
+    """各 chunk 在原文中的字符偏移，供上下文打包使用"""
+    return index_path + ".spans.npy"
+
+
+def index_settings(
+    chunk_size: int,
+    chunk_overlap: int,
+    embedding_model: str,
+    retriever_type: str,
+    faiss_index: Optional[dict] = None,
+    embedding_backend: str = "torch"
+) -> dict:
+    return {
+        "version": MANIFEST_VERSION,
+        "chunk_size": chunk_size,
+        "chunk_overlap": chunk_overlap,
+        "embedding_model": embedding_model,
+        "embedding_backend": embedding_backend,
+        "retriever_type": retriever_type,
+        "faiss_index": faiss_index,
+    }
+
+
+def source_stat(path: str) -> dict:
+    st = os.stat(path)
+    return {"source_size": st.st_size, "source_mtime_ns": st.st_mtime_ns}
+
+
+def build_manifest(source_hash: str, chunks: List[str], settings: dict) -> dict:
+    """根据小说原文哈希、切分结果和配置生成索引清单"""
+    chunk_hashes = [text_hash(c) for c in chunks]
+    return {
+        **settings,
+        "source_hash": source_hash,
+        "num_chunks": len(chunks),
+        "max_chunk_len": max((len(c) for c in chunks), default=0),
+        "chunks_hash": text_hash("".join(chunk_hashes)),
+        "chunk_hashes": chunk_hashes,
+    }
+
+
+def index_version(manifest: dict) -> str:
+    """索引内容与配置的指纹，用于让依赖 chunk id 的缓存随索引一起失效"""
+    keys = sorted(k for k in manifest if k not in ("chunk_hashes", "source_size", "source_mtime_ns"))
+    return text_hash(json.dumps({k: manifest[k] for k in keys}, ensure_ascii=False, sort_keys=True))
+
+
+def load_manifest(path: str) -> Optional[dict]:
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        # 清单损坏时视为不存在，走增量更新
+        return None
+
+
+def save_manifest(path: str, manifest: dict):
+    # 先写临时文件再替换，避免中途退出留下半个清单
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def settings_match(manifest: Optional[dict], settings: dict) -> bool:
+    if manifest is None:
+        return False
+    return all(manifest.get(k) == v for k, v in settings.items())
+
+
+def source_unchanged(manifest: Optional[dict], path: Optional[str]) -> bool:
+    """只比较文件大小和修改时间，O(1) 判断源文件是否变化"""
+    if manifest is None or not path or not os.path.exists(path):
+        return False
+    return all(manifest.get(k) == v for k, v in source_stat(path).items())